@@ -3,4 +3,7 @@ from pos.models import *
 
 admin.site.register(Shop)
 admin.site.register(Receipt)
-admin.site.register(Item)
\ No newline at end of file
+admin.site.register(Product)
+admin.site.register(ReceiptLine)
+admin.site.register(BestSeller)
+admin.site.register(ShopDailySales)
\ No newline at end of file
@@ -7,12 +7,21 @@ urlpatterns = [
     url(r'^receipts/pay/(?P<receipt_id>[0-9]+)/$', api_views.pay_receipt, name = 'api_pay_receipt'),
     url(r'^receipts/pay_with_change/(?P<receipt_id>[0-9]+)/$', api_views.pay_receipt_with_change, name = 'api_pay_receipt_change'),
     url(r'^receipts/$', api_views.receipts_list, name = 'api_receipts_list'),
+    url(r'^receipts/bulk/$', api_views.receipts_bulk, name = 'api_receipts_bulk'),
     url(r'^receipts/(?P<receipt_id>[0-9]+)/$', api_views.receipt_instance, name = 'api_receipts_instance'),
     url(r'^items/receipt/(?P<receipt_id>[0-9]+)/$', api_views.items_list, name = 'api_receipt_items_list'),
+    url(r'^items/bulk/$', api_views.items_bulk_update, name = 'api_items_bulk_update'),
     url(r'^items/set_stock/(?P<item_id>[0-9]+)/$', api_views.set_stock, name = 'api_set_item_stock'),
     url(r'^items/(?P<item_id>[0-9]+)/$', api_views.item_instance, name = 'api_item_instance'),
     url(r'^items/most_sold/$', api_views.get_most_sold, name = 'api_get_most_sold_item'),
+    url(r'^items/low_stock/$', api_views.get_low_stock, name = 'api_get_low_stock_items'),
+    url(r'^items/search/$', api_views.search_items, name = 'api_search_items'),
     url(r'^items/$', api_views.items_list, name = 'api_items_list'),
+    url(r'^shops/(?P<shop_id>[0-9]+)/daily_sales/$', api_views.shop_daily_sales, name = 'api_shop_daily_sales'),
+    url(r'^shops/(?P<shop_id>[0-9]+)/export/$', api_views.export_receipts, name = 'api_export_receipts'),
+    url(r'^cache/stats/$', api_views.cache_stats, name = 'api_cache_stats'),
+    url(r'^db/pool/stats/$', api_views.db_pool_stats, name = 'api_db_pool_stats'),
+    url(r'^metrics/$', api_views.prometheus_metrics, name = 'api_metrics'),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
\ No newline at end of file
@@ -1,22 +1,54 @@
-from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
+from django.db import transaction
+from django.db.models import ProtectedError
+from django.http import HttpResponse
+from django.utils.dateparse import parse_date
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import NotFound
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from pos.serializers import *
 from pos.models import *
+from pos import cache, conditional, metrics, search
+from pos.backends import pool
+from pos.bulk import ReceiptUpload, ItemBulkUpdate
+from pos.export import export_response, export_rows
+from pos.idempotency import idempotent
+from pos.pagination import KeysetPagination
+from pos.permissions import IsMetricsScraper
+from pos.renderers import CSVRenderer, NDJSONRenderer
+from pos.routers import read_replica, reading_replica
+from pos.streaming import is_stream_requested, stream_serialized
+
+# Fast read-only serialization of list endpoints, see ValuesSerializer.
+receipt_values = ValuesSerializer(ReceiptSerializer)
+product_values = ValuesSerializer(ProductSerializer)
+line_values = ValuesSerializer(ReceiptLineSerializer)
 
 
 @api_view(['GET', 'POST'])
 @permission_classes((IsAuthenticated,))
+@renderer_classes(api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer])
+@idempotent
+@read_replica
 def receipts_list(request, format=None):
     """ Receipts list associated with auth user."""
 
+    if request.method == 'GET' and is_stream_requested(request):
+        # Stream every receipt owned by user.
+        return stream_serialized(Receipt.objects.filter(user=request.user), ReceiptSerializer)
+
     if request.method == 'GET':
         # Retrieve all receipts that owned by user.
         try:
-            receipts = Receipt.objects.filter(user=request.user)
-            receipts_serialized = ReceiptSerializer(receipts, many = True)
-            return Response(receipts_serialized.data)
+            paginator = KeysetPagination(('-date', '-id'))
+            receipts = receipt_values.values(Receipt.objects.filter(user=request.user))
+            receipts = paginator.paginate_queryset(receipts, request)
+            return Response(receipt_values.represent(receipts), headers=paginator.get_headers(request))
+        except NotFound:
+            raise
         except:
             request.user.receipts = []
             return Response([])
@@ -30,19 +62,41 @@ def receipts_list(request, format=None):
         return Response(receipt_instance.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@permission_classes((IsAuthenticated,))
+@idempotent
+def receipts_bulk(request, format=None):
+    """ Inserts a batch of offline receipts with embedded items."""
+
+    results = ReceiptUpload(request.data, request.user).save()
+    return Response(results, status=status.HTTP_200_OK)
+
+
 @api_view(['GET', 'PUT', 'DELETE'])
 @permission_classes((IsAuthenticated,))
 def receipt_instance(request, receipt_id, format=None):
     """ Allows for Retreive, Update, Delete."""
 
+    if request.method == 'GET':
+        validators = conditional.receipt_validators(receipt_id)
+        if validators is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        not_modified = conditional.not_modified_response(request, validators)
+        if not_modified is not None:
+            return not_modified
+        payload = cache.receipts.get(receipt_id)
+        if payload is not None:
+            return conditional.with_validators(Response(payload), *validators)
+
     try:
-        receipt = Receipt.objects.get(pk=receipt_id)
+        receipt = ReceiptSerializer.setup_eager_loading(Receipt.objects).get(pk=receipt_id)
     except Receipt.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
     if request.method == 'GET':
         serializer = ReceiptSerializer(receipt)
-        return Response(serializer.data)
+        response = Response(cache.receipts.set(receipt_id, serializer.data))
+        return conditional.with_validators(response, *validators)
 
     elif request.method == 'PUT':
         serializer = ReceiptPOSTSerializer(receipt, data=request.data)
@@ -57,18 +111,30 @@ def receipt_instance(request, receipt_id, format=None):
 
 @api_view(['GET'])
 @permission_classes((IsAuthenticated,))
+@read_replica
 def receipt_avg(request, receipt_id, format = None):
     """ Returns average of receipt's items."""
 
+    payload = cache.averages.get(receipt_id)
+    if payload is not None:
+        return Response(payload)
+
     try:
         receipt = Receipt.objects.get(pk=receipt_id)
-        return Response({'average': receipt.get_avg()})
     except Receipt.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
+    payload = {'average': receipt.get_avg()}
+    # A lagging replica would cache an average older than the last invalidation.
+    if reading_replica():
+        return Response(payload)
+    return Response(cache.averages.set(receipt_id, payload))
 
 
+# Commits right after checkout, not at the end of the request, to release stock locks early.
+@transaction.non_atomic_requests
 @api_view(['POST'])
 @permission_classes((IsAuthenticated,))
+@idempotent
 def pay_receipt(request, receipt_id, format = None):
     """ Pays receipt total cost."""
 
@@ -79,12 +145,17 @@ def pay_receipt(request, receipt_id, format = None):
             return Response(status=status.HTTP_200_OK)        
     except Receipt.DoesNotExist:
         pass
+    except OutOfStock as error:
+        return Response({'detail': 'Not enough stock.', 'lines': error.lines}, status=status.HTTP_409_CONFLICT)
 
     return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
+# Commits right after checkout, not at the end of the request, to release stock locks early.
+@transaction.non_atomic_requests
 @api_view(['POST'])
 @permission_classes((IsAuthenticated,))
+@idempotent
 def pay_receipt_with_change(request, receipt_id, format = None):
     """ Pays receipt total cost."""
 
@@ -95,28 +166,46 @@ def pay_receipt_with_change(request, receipt_id, format = None):
             return Response(status=status.HTTP_200_OK)        
     except Receipt.DoesNotExist:
         pass
+    except OutOfStock as error:
+        return Response({'detail': 'Not enough stock.', 'lines': error.lines}, status=status.HTTP_409_CONFLICT)
 
     return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['GET', 'POST'])
 @permission_classes((IsAuthenticated,))
+@renderer_classes(api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer])
+@read_replica
 def items_list(request, receipt_id=0, format=None):
-    """ All items available or some related to receipt_id."""
+    """ All catalog products, or the lines of receipt_id."""
 
     if request.method == 'GET':
-        # Retrieve all receipts that owned by user.
+        validators = conditional.collection_validators(request, 'items')
+        not_modified = conditional.not_modified_response(request, validators)
+        if not_modified is not None:
+            return not_modified
+
+        # Retrieve the catalog or the lines sold on the receipt.
         if receipt_id:
-            items = Item.objects.filter(receipt=receipt_id)
+            items = ReceiptLine.objects.filter(receipt=receipt_id)
+            serializer_class, fast = ReceiptLineSerializer, line_values
         else:
-            items = Item.objects.all()
-        items_serialized = ItemSerializer(items, many = True)
-        return Response(items_serialized.data)
+            items = Product.objects.all()
+            serializer_class, fast = ProductSerializer, product_values
+        if is_stream_requested(request):
+            return stream_serialized(items, serializer_class)
+        paginator = KeysetPagination(('id',))
+        items = paginator.paginate_queryset(fast.values(items), request)
+        response = Response(fast.represent(items), headers=paginator.get_headers(request))
+        return conditional.with_validators(response, *validators)
 
 
     if request.method == 'POST':
-        # Insert new item.
-        item_instance = ItemPOSTSerializer(data=request.data)
+        # Sell an item on a receipt, or add a product to the catalog.
+        if 'receipt' in request.data:
+            item_instance = ReceiptLinePOSTSerializer(data=request.data)
+        else:
+            item_instance = ProductSerializer(data=request.data)
         if item_instance.is_valid():
             item_instance.save()
             return Response(item_instance.data, status=status.HTTP_201_CREATED)
@@ -128,24 +217,33 @@ def items_list(request, receipt_id=0, format=None):
 def item_instance(request, item_id, format=None):
     """ Allows for Retreive, Update, Delete."""
 
+    if request.method == 'GET':
+        payload = cache.items.get(item_id)
+        if payload is not None:
+            return Response(payload)
+
     try:
-        item = Item.objects.get(pk=item_id)
-    except Item.DoesNotExist:
+        item = ProductSerializer.setup_eager_loading(Product.objects).get(pk=item_id)
+    except Product.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
     if request.method == 'GET':
-        serializer = ItemSerializer(item)
-        return Response(serializer.data)
+        serializer = ProductSerializer(item)
+        return Response(cache.items.set(item_id, serializer.data))
 
     elif request.method == 'PUT':
-        serializer = ItemPOSTSerializer(item, data=request.data)
+        serializer = ProductSerializer(item, data=request.data)
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     elif request.method == 'DELETE':
-        receipt.delete()
+        try:
+            item.delete()
+        except ProtectedError:
+            # Receipt lines keep sold products.
+            return Response({'detail': 'Product is sold on receipts.'}, status=status.HTTP_409_CONFLICT)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -155,19 +253,142 @@ def set_stock(request, item_id, format = None):
     """ Override the current stock amount of given item."""
 
     try:
-        item = Item.objects.get(pk=item_id)
+        item = Product.objects.get(pk=item_id)
         amount = request.POST.get('amount', -1)
         item.set_stock_amount(amount)
         return Response(status=status.HTTP_200_OK)        
-    except Item.DoesNotExist:
+    except Product.DoesNotExist:
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@permission_classes((IsAuthenticated,))
+def items_bulk_update(request, format = None):
+    """ Changes stock, price or discount of many items at once."""
+
+    results = ItemBulkUpdate(request.data).save()
+    return Response(results, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 @permission_classes((IsAuthenticated,))
+@read_replica
 def get_most_sold(request, format = None):
-    """ Returns the most sold item(s)."""
+    """ Returns the most sold item(s) of a window, optionally per shop."""
+
+    window = request.query_params.get('window', 'day')
+    if window not in BestSeller.WINDOWS:
+        return Response(
+            {'window': ['Choose one of: ' + ', '.join(BestSeller.WINDOWS)]}, status=status.HTTP_400_BAD_REQUEST
+        )
+    shop = request.query_params.get('shop')
+    if shop is not None and not shop.isdigit():
+        return Response({'shop': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+    validators = conditional.collection_validators(request, 'items', 'best_sellers')
+    not_modified = conditional.not_modified_response(request, validators)
+    if not_modified is not None:
+        return not_modified
+
+    items = product_values.values(Product.get_most_sold(window, shop))
+    return conditional.with_validators(Response(product_values.represent(items)), *validators)
+
+
+@api_view(['GET'])
+@permission_classes((IsAuthenticated,))
+@read_replica
+def search_items(request, format = None):
+    """ Returns items whose code or name matches `q`, best match first."""
+
+    query = request.query_params.get('q', '').strip()
+    if not search.fold(query):
+        return Response({'q': ['This field is required.']}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = int(request.query_params.get('limit', settings.POS_SEARCH_LIMIT))
+    except ValueError:
+        return Response({'limit': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+    limit = max(1, min(limit, settings.POS_SEARCH_MAX_LIMIT))
+    validators = conditional.collection_validators(request, 'items')
+    not_modified = conditional.not_modified_response(request, validators)
+    if not_modified is not None:
+        return not_modified
+
+    items = product_values.values(Product.search(query))[:limit]
+    return conditional.with_validators(Response(product_values.represent(items)), *validators)
+
+
+@api_view(['GET'])
+@permission_classes((IsAuthenticated,))
+def get_low_stock(request, format = None):
+    """ Returns items running out of stock."""
+
+    paginator = KeysetPagination(('stock_amount', 'id'))
+    items = paginator.paginate_queryset(product_values.values(Product.get_low_stock()), request)
+    return Response(product_values.represent(items), headers=paginator.get_headers(request))
+
+
+@api_view(['GET'])
+@permission_classes((IsAuthenticated,))
+def shop_daily_sales(request, shop_id, format = None):
+    """ Returns daily sales rollups of a shop, optionally between ?start= and ?end= days."""
+
+    sales = ShopDailySales.objects.filter(shop=shop_id).order_by('day')
+    try:
+        if 'start' in request.query_params:
+            sales = sales.filter(day__gte=parse_date(request.query_params['start']))
+        if 'end' in request.query_params:
+            sales = sales.filter(day__lte=parse_date(request.query_params['end']))
+    except (TypeError, ValueError):
+        return Response({'detail': 'Dates should be formatted as YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = ShopDailySalesSerializer(sales[:settings.POS_MAX_PAGE_SIZE], many=True)
+    return Response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes((IsAdminUser,))
+@renderer_classes((CSVRenderer, NDJSONRenderer))
+@read_replica
+def export_receipts(request, shop_id, format = None):
+    """ Streams lines of shop receipts created from ?start= to ?end= days as CSV or NDJSON.
+
+    Rows carry amounts and users of every receipt of the shop, so only staff may export them.
+    """
+
+    try:
+        start = parse_date(request.query_params.get('start', ''))
+        end = parse_date(request.query_params.get('end', ''))
+    except ValueError:
+        start = end = None
+    if start is None or end is None or end < start:
+        return Response(
+            {'detail': 'Give ?start= and ?end= days formatted as YYYY-MM-DD, start first.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    rows = export_rows(shop_id, start, end)
+    return export_response(request, rows, 'receipts-{}-{}-{}'.format(shop_id, start, end))
+
+
+@api_view(['GET'])
+@permission_classes((IsAdminUser,))
+def cache_stats(request, format = None):
+    """ Returns hit and miss counters of cached payloads."""
+
+    return Response(cache.stats())
+
+
+@api_view(['GET'])
+@permission_classes((IsAdminUser,))
+def db_pool_stats(request, format = None):
+    """ Returns connection pool metrics of the worker serving the request."""
+
+    return Response(pool.stats())
+
+
+@api_view(['GET'])
+@permission_classes((IsMetricsScraper,))
+def prometheus_metrics(request, format = None):
+    """ Returns request timing histograms of all workers for Prometheus."""
 
-    items = Item.get_most_sold()
-    serializer = ItemSerializer(items, many=True)
-    return Response(serializer.data)
\ No newline at end of file
+    text = metrics.render_prometheus(metrics.collect())
+    return HttpResponse(text, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class PosConfig(AppConfig):
     name = 'pos'
+
+    def ready(self):
+        """ Registers signals that keep receipt totals up to date."""
+        import pos.signals  # noqa
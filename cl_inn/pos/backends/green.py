@@ -0,0 +1,42 @@
+""" Cooperative psycopg2 for gevent workers.
+
+psycopg2 talks to Postgres from C and would block the whole worker on every
+query. With a wait callback installed it hands control back to the gevent hub
+while waiting on the socket, the same thing psycogreen does.
+"""
+import psycopg2
+from psycopg2 import extensions
+
+
+def is_gevent_patched():
+    """ Returns True when gevent has monkey patched this process's sockets."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+def gevent_wait_callback(conn, timeout=None):
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError('Bad result from poll: %r' % state)
+
+
+def make_psycopg_green():
+    """ Installs the gevent wait callback, once per process."""
+    if extensions.get_wait_callback() is not gevent_wait_callback:
+        extensions.set_wait_callback(gevent_wait_callback)
+
+
+def is_green():
+    return extensions.get_wait_callback() is gevent_wait_callback
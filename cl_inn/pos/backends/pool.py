@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import Counter
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+from psycopg2 import extensions, OperationalError
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool(object):
+    """ Bounded pool of open psycopg2 connections, one per worker process.
+
+    At most max_size connections are open at once (checked out and idle
+    together). Callers beyond that wait up to timeout seconds for one to be
+    released. Idle connections are checked with SELECT 1 before being handed
+    out again once they have been idle longer than check_interval seconds, and
+    connections left broken or mid transaction are dropped on release.
+
+    Under gevent, threading and queue are monkey patched so waiting callers
+    yield to other greenlets instead of blocking the worker.
+    """
+
+    isolation_level = None
+
+    def __init__(self, max_size=20, timeout=10, check_interval=30):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.counts = Counter()
+
+    def count(self, *outcomes):
+        with self.lock:
+            self.counts.update(outcomes)
+
+    def acquire(self, connect):
+        """ Returns an idle healthy connection, or a new one from connect()."""
+        started = time.time()
+        if not self.slots.acquire(timeout=self.timeout):
+            self.count('timeouts')
+            raise PoolTimeout(
+                'No database connection released within {} seconds '
+                '({} in use).'.format(self.timeout, self.max_size))
+        waited = time.time() - started
+        try:
+            conn = self.checkout(connect)
+        except Exception:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.in_use += 1
+            self.counts['wait_ms'] += int(waited * 1000)
+        return conn
+
+    def checkout(self, connect):
+        while True:
+            try:
+                conn, released_at = self.idle.get_nowait()
+            except queue.Empty:
+                conn = connect()
+                self.count('created')
+                return conn
+            if self.is_healthy(conn, released_at):
+                self.count('reused')
+                return conn
+            self.discard(conn)
+
+    def release(self, conn):
+        """ Puts conn back in the pool, or closes it if it is unusable."""
+        try:
+            if self.reset(conn):
+                self.idle.put((conn, time.time()))
+            else:
+                self.discard(conn)
+        finally:
+            with self.lock:
+                self.in_use -= 1
+            self.slots.release()
+
+    def reset(self, conn):
+        """ Rolls back leftover work. Returns False when conn is unusable."""
+        if conn.closed:
+            return False
+        status = conn.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_IDLE:
+            return True
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        try:
+            conn.rollback()
+        except Exception:
+            return False
+        return True
+
+    def is_healthy(self, conn, released_at):
+        if conn.closed:
+            return False
+        if time.time() - released_at < self.check_interval:
+            return True
+        self.count('health_checks')
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not conn.autocommit:
+                conn.rollback()
+        except Exception:
+            return False
+        return True
+
+    def discard(self, conn):
+        self.count('discarded')
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """ Closes every idle connection."""
+        while True:
+            try:
+                conn, released_at = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self.discard(conn)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats.update(in_use = self.in_use)
+        stats.update(
+            idle = self.idle.qsize(),
+            max_size = self.max_size,
+        )
+        for outcome in ('created', 'reused', 'discarded', 'timeouts', 'health_checks', 'wait_ms'):
+            stats.setdefault(outcome, 0)
+        return stats
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(alias, max_size, timeout, check_interval):
+    """ Returns the pool of a database alias, creating it on first use."""
+    with pools_lock:
+        if alias not in pools:
+            pools[alias] = ConnectionPool(max_size, timeout, check_interval)
+        return pools[alias]
+
+
+def stats():
+    """ Returns pool metrics of this worker, by database alias."""
+    return {alias: pool.stats() for alias, pool in pools.items()}
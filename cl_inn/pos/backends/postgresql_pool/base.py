@@ -0,0 +1,63 @@
+""" PostgreSQL backend that borrows connections from a per-worker pool.
+
+Django opens a connection per request (CONN_MAX_AGE = 0) and closes it when
+the request finishes; this backend turns those into a checkout from and a
+return to pos.backends.pool, so a worker holds at most MAX_CONNS connections
+however many requests it serves at once. Under gevent workers psycopg2 is made
+cooperative as soon as the backend loads.
+
+Pool settings are read from OPTIONS:
+    MAX_CONNS: connections open per worker (default 20).
+    POOL_TIMEOUT: seconds a request waits for a free connection (default 10).
+    HEALTH_CHECK_INTERVAL: idle seconds after which a connection is checked
+        before reuse (default 30).
+"""
+from django.db.backends.postgresql import base
+
+from pos.backends import green, pool
+
+if green.is_gevent_patched():
+    green.make_psycopg_green()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    pool_options = {
+        'MAX_CONNS': 20,
+        'POOL_TIMEOUT': 10,
+        'HEALTH_CHECK_INTERVAL': 30,
+    }
+
+    @property
+    def pool(self):
+        options = self.settings_dict['OPTIONS']
+        return pool.get_pool(
+            self.alias,
+            max_size = options.get('MAX_CONNS', self.pool_options['MAX_CONNS']),
+            timeout = options.get('POOL_TIMEOUT', self.pool_options['POOL_TIMEOUT']),
+            check_interval = options.get('HEALTH_CHECK_INTERVAL', self.pool_options['HEALTH_CHECK_INTERVAL']),
+        )
+
+    def get_connection_params(self):
+        conn_params = super(DatabaseWrapper, self).get_connection_params()
+        for name in self.pool_options:
+            conn_params.pop(name, None)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        connections = self.pool
+        connect = super(DatabaseWrapper, self).get_new_connection
+
+        def open_connection():
+            connection = connect(conn_params)
+            # Reused connections skip the isolation level lookup done on connect.
+            connections.isolation_level = self.isolation_level
+            return connection
+
+        connection = connections.acquire(open_connection)
+        self.isolation_level = connections.isolation_level
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.release(self.connection)
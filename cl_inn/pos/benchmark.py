@@ -0,0 +1,201 @@
+import itertools
+import math
+import time
+import tracemalloc
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from pos import api_urls
+from pos.models import Shop, Receipt, Product, ReceiptLine
+from pos.serializers import User
+
+BENCHMARK_USERNAME = 'benchmark'
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+class Seeder(object):
+    """ Fills the database with shops, a product catalog and receipts with
+    `items` lines overall, in bulk batches.
+    """
+
+    def __init__(self, shops, receipts, items, products=1000, batch_size=10000, stdout=None):
+        self.shops, self.receipts, self.items = shops, receipts, items
+        self.products = min(products, items)
+        self.batch_size = batch_size
+        self.stdout = stdout
+
+    def log(self, message):
+        if self.stdout:
+            self.stdout.write(message)
+
+    def seed(self):
+        user, _ = User.objects.get_or_create(username=BENCHMARK_USERNAME)
+        Shop.objects.bulk_create(Shop(name='Shop ' + chr(65 + i % 26)) for i in range(self.shops))
+        shop_ids = itertools.cycle(Shop.objects.values_list('pk', flat=True).order_by('-pk')[:self.shops])
+        per_receipt = max(1, self.items // max(1, self.receipts))
+        code = itertools.count(Product.objects.count())
+        products = Product.objects.bulk_create([
+            Product(code='bench' + str(next(code)), name='Item', price=100, stock_amount=1000)
+            for _ in range(max(1, self.products))
+        ], batch_size=self.batch_size)
+        product_ids = itertools.cycle([product.pk for product in products])
+
+        created = 0
+        while created < self.receipts:
+            count = min(self.batch_size, self.receipts - created)
+            with transaction.atomic():
+                receipts = Receipt.objects.bulk_create([
+                    Receipt(
+                        name='Receipt', shop_id=next(shop_ids), user=user,
+                        total=100 * per_receipt, items_sum=100 * per_receipt, item_count=per_receipt
+                    ) for _ in range(count)
+                ])
+                ReceiptLine.objects.bulk_create([
+                    ReceiptLine(
+                        receipt_id=receipt.pk, product_id=next(product_ids), price=100, created_at=receipt.created_at
+                    )
+                    for receipt in receipts for _ in range(per_receipt)
+                ], batch_size=self.batch_size)
+            created += count
+            self.log('Seeded {}/{} receipts'.format(created, self.receipts))
+        return user
+
+
+class Benchmark(object):
+    """ Drives every route of pos.api_urls through the DRF test client.
+
+    Each route is requested `iterations` times for latency, then once more
+    under query capture and tracemalloc for query count, SQL time and peak
+    Python memory, so tracing doesn't skew the latency figures.
+    """
+
+    def __init__(self, user, iterations=20):
+        self.user = user
+        self.iterations = iterations
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+        self.receipt = Receipt.objects.filter(user=user).order_by('-pk').first()
+        self.item = Product.objects.filter(lines__receipt=self.receipt).first()
+        self.codes = itertools.count()
+
+    def fresh_receipt(self, items=5):
+        """ Returns a new receipt with lines, for requests that consume their target."""
+        receipt = Receipt.objects.create(name='Benchmark receipt', shop=self.receipt.shop, user=self.user)
+        for _ in range(items):
+            receipt.add_line(Product.objects.create(
+                name='Item', code='benchmark-{}-{}'.format(time.time(), next(self.codes)),
+                price=100, stock_amount=10
+            ))
+        return receipt
+
+    def new_receipt_data(self):
+        return {'name': 'Benchmark receipt', 'user': self.user.pk, 'shop': self.receipt.shop_id}
+
+    def new_item_data(self):
+        return {
+            'name': 'Item', 'code': 'benchmark-{}-{}'.format(time.time(), next(self.codes)),
+            'price': 100, 'receipt': self.receipt.pk
+        }
+
+    def routes(self):
+        """ Returns {route name: callable building (method, url, data)}."""
+        receipt, item = self.receipt, self.item
+        return {
+            'api_receipt_average': lambda: ('get', reverse('api_receipt_average', args=[receipt.pk]), None),
+            'api_pay_receipt': lambda: (
+                'post', reverse('api_pay_receipt', args=[self.fresh_receipt().pk]), {'money': 500}
+            ),
+            'api_pay_receipt_change': lambda: (
+                'post', reverse('api_pay_receipt_change', args=[self.fresh_receipt().pk]), {'money': 600}
+            ),
+            'api_receipts_list': lambda: ('get', reverse('api_receipts_list'), None),
+            'api_receipts_bulk': lambda: ('post', reverse('api_receipts_bulk'), [
+                dict(self.new_receipt_data(), client_id=str(i), items=[self.new_item_data()]) for i in range(10)
+            ]),
+            'api_receipts_instance': lambda: ('get', reverse('api_receipts_instance', args=[receipt.pk]), None),
+            'api_receipt_items_list': lambda: ('get', reverse('api_receipt_items_list', args=[receipt.pk]), None),
+            'api_items_bulk_update': lambda: (
+                'post', reverse('api_items_bulk_update'), [{'id': item.pk, 'stock_delta': 1}]
+            ),
+            'api_set_item_stock': lambda: ('post', reverse('api_set_item_stock', args=[item.pk]), {'amount': 100}),
+            'api_item_instance': lambda: ('get', reverse('api_item_instance', args=[item.pk]), None),
+            'api_get_most_sold_item': lambda: ('get', reverse('api_get_most_sold_item'), None),
+            'api_get_low_stock_items': lambda: ('get', reverse('api_get_low_stock_items'), None),
+            'api_search_items': lambda: ('get', reverse('api_search_items'), {'q': item.code[:6]}),
+            'api_items_list': lambda: ('get', reverse('api_items_list'), None),
+            'api_shop_daily_sales': lambda: (
+                'get', reverse('api_shop_daily_sales', args=[receipt.shop_id]), None
+            ),
+            'api_export_receipts': lambda: (
+                'get', reverse('api_export_receipts', args=[receipt.shop_id]),
+                dict.fromkeys(('start', 'end'), timezone.localtime(receipt.created_at).date())
+            ),
+            'api_cache_stats': lambda: ('get', reverse('api_cache_stats'), None),
+            'api_db_pool_stats': lambda: ('get', reverse('api_db_pool_stats'), None),
+            'api_metrics': lambda: ('get', reverse('api_metrics'), None),
+        }
+
+    def request(self, method, url, data):
+        extra = {'format': 'json'} if isinstance(data, list) else {}
+        response = getattr(self.client, method)(url, data, **extra)
+        if response.status_code >= 400:
+            raise RuntimeError('{} {} returned {}'.format(method.upper(), url, response.status_code))
+        if response.streaming:
+            # Streamed rows are only read as the body is consumed.
+            for _ in response.streaming_content:
+                pass
+        return response
+
+    def measure(self, build):
+        latencies = []
+        for _ in range(self.iterations):
+            method, url, data = build()
+            start = time.perf_counter()
+            self.request(method, url, data)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        method, url, data = build()
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as queries:
+            self.request(method, url, data)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return {
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'queries': len(queries),
+            'sql_ms': round(sum(float(query['time']) for query in queries.captured_queries) * 1000, 3),
+            'peak_kb': round(peak / 1024.0, 1),
+        }
+
+    def run(self, only=None):
+        routes = self.routes()
+        names = {pattern.name for pattern in api_urls.urlpatterns if pattern.name}
+        missing = names - set(routes)
+        if missing:
+            raise RuntimeError('No benchmark defined for: ' + ', '.join(sorted(missing)))
+        self.user.is_staff = True
+        self.user.save()
+        return {name: self.measure(routes[name]) for name in sorted(routes) if not only or name in only}
+
+
+def compare(report, baseline, threshold):
+    """ Returns lines describing metrics that grew more than threshold over baseline."""
+    regressions = []
+    for name, metrics in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous:
+            continue
+        for metric, value in metrics.items():
+            before = previous.get(metric)
+            if before and value > before * (1 + threshold):
+                regressions.append('{} {}: {} -> {}'.format(name, metric, before, value))
+    return regressions
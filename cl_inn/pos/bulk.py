@@ -0,0 +1,347 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from rest_framework.exceptions import ValidationError
+from pos import cache
+from pos.models import Shop, Receipt, Product, ReceiptLine, ItemSales
+from pos.serializers import BulkReceiptSerializer, ItemChangeSerializer, User
+
+
+def case_by_pk(values, default, output_field):
+    """ Returns a CASE expression picking values[pk] for each row, default otherwise."""
+    whens = [models.When(pk=pk, then=models.Value(value)) for pk, value in values.items()]
+    return models.Case(*whens, default=default, output_field=output_field)
+
+
+def chunked(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+class ReceiptUpload(object):
+    """ Validates and inserts a batch of offline receipts with their items.
+
+    Field validation runs per record, while foreign keys are checked and item
+    codes looked up in the catalog with one query each for the whole batch.
+    Items become receipt lines of the catalog product with their code, codes
+    missing from the catalog are added to it. Valid records are inserted with
+    bulk_create in a single transaction; invalid ones are reported back
+    without blocking the rest of the batch.
+
+    Paid receipts are checked out like Receipt.checkout: their items are
+    taken from stock and counted as sold in the same transaction, and a paid
+    receipt asking for more than is left in stock is rejected with its short
+    items.
+    """
+
+    def __init__(self, records, user):
+        if not isinstance(records, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of receipts.']})
+        if len(records) > settings.POS_BULK_MAX_RECORDS:
+            raise ValidationError({'non_field_errors': [
+                'At most {} receipts can be uploaded at once.'.format(settings.POS_BULK_MAX_RECORDS)
+            ]})
+        self.records = records
+        self.user = user
+        self.results = [None] * len(records)
+
+    def reject(self, index, client_id, errors):
+        self.results[index] = OrderedDict([('client_id', client_id), ('status', 'rejected'), ('errors', errors)])
+
+    def validate_fields(self):
+        """ Returns (index, validated data) of records passing field validation."""
+        valid = []
+        for index, record in enumerate(self.records):
+            serializer = BulkReceiptSerializer(data=record)
+            if serializer.is_valid():
+                data = serializer.validated_data
+                data.setdefault('user', self.user.pk)
+                valid.append((index, data))
+            else:
+                client_id = record.get('client_id') if isinstance(record, dict) else None
+                self.reject(index, client_id, serializer.errors)
+        return valid
+
+    def validate_batch(self, valid):
+        """ Drops records pointing at missing rows."""
+        shops = set(Shop.objects.filter(pk__in={d['shop'] for _, d in valid}).values_list('pk', flat=True))
+        users = set(User.objects.filter(pk__in={d['user'] for _, d in valid}).values_list('pk', flat=True))
+
+        accepted = []
+        for index, data in valid:
+            errors = {}
+            if data['shop'] not in shops:
+                errors['shop'] = ['Invalid pk "{}" - object does not exist.'.format(data['shop'])]
+            if data['user'] not in users:
+                errors['user'] = ['Invalid pk "{}" - object does not exist.'.format(data['user'])]
+
+            if errors:
+                self.reject(index, data['client_id'], errors)
+            else:
+                accepted.append((index, data))
+        return accepted
+
+    def catalog(self, accepted):
+        """ Returns {code: product} of every item, unsaved for codes new to the catalog."""
+        codes = {item['code'] for _, data in accepted for item in data['items']}
+        products = {product.code: product for product in Product.objects.filter(code__in=codes)}
+        for _, data in accepted:
+            for item in data['items']:
+                if item['code'] not in products:
+                    fields = {field: value for field, value in item.items() if field != 'quantity'}
+                    products[item['code']] = Product(**fields)
+        return products
+
+    def create_products(self, products):
+        """ Inserts products new to the catalog.
+
+        A code inserted meanwhile by another upload fails the insert, which is
+        then retried once selling the product that now has that code.
+        """
+        for attempt in range(2):
+            new = [product for product in products.values() if product.pk is None]
+            try:
+                with transaction.atomic():
+                    Product.objects.bulk_create(new)
+                return
+            except IntegrityError:
+                if attempt:
+                    raise
+                # Lines point at these instances, so they take over the existing rows in place.
+                existing = dict(
+                    Product.objects.filter(code__in=[product.code for product in new]).values_list('code', 'pk')
+                )
+                for product in new:
+                    product.pk = existing.get(product.code)
+                    product._state.adding = product.pk is None
+
+    def build(self, data, products):
+        """ Returns unsaved receipt and its lines with totals filled in."""
+        lines = []
+        for item in data['items']:
+            product = products[item['code']]
+            lines.append(ReceiptLine(
+                product=product, quantity=item['quantity'], price=product.price, discount=product.discount
+            ))
+        receipt = Receipt(
+            name=data['name'],
+            paid_amount=data.get('paid_amount', 0),
+            change=data.get('change', 0),
+            cashier=data.get('cashier', -1),
+            shop_id=data['shop'],
+            user_id=data['user'],
+            total=sum(line.total_price for line in lines),
+            items_sum=sum(line.quantity * line.price for line in lines),
+            item_count=sum(line.quantity for line in lines)
+        )
+        return receipt, lines
+
+    @staticmethod
+    def sold_quantities(lines):
+        """ Returns {product id: quantity} over lines."""
+        sold = {}
+        for line in lines:
+            sold[line.product.pk] = sold.get(line.product.pk, 0) + line.quantity
+        return sold
+
+    def take_stock(self, built):
+        """ Takes items of paid receipts from stock in input order, returns built entries taken.
+
+        Products are locked in pk order, as in Product.take_stock, then stock
+        is handed to receipts while it lasts. Receipts short of it are
+        rejected with their short items, the others are taken with one UPDATE.
+        """
+        paid = [entry for entry in built if entry[2].paid_amount]
+        if not paid:
+            return built
+        wanted = {pk for _, _, _, lines in paid for pk in self.sold_quantities(lines)}
+        available = dict(Product.objects.select_for_update().filter(pk__in=wanted).order_by('pk').values_list(
+            'pk', 'stock_amount'
+        ))
+
+        taken, short = {}, set()
+        for index, client_id, receipt, lines in paid:
+            sold = self.sold_quantities(lines)
+            codes = {line.product.pk: line.product.code for line in lines}
+            missing = [
+                OrderedDict([
+                    ('product', pk), ('code', codes[pk]), ('requested', quantity), ('available', available.get(pk, 0))
+                ])
+                for pk, quantity in sorted(sold.items()) if quantity > available.get(pk, 0)
+            ]
+            if missing:
+                self.reject(index, client_id, {'items': missing})
+                short.add(index)
+                continue
+            for pk, quantity in sold.items():
+                available[pk] -= quantity
+                taken[pk] = taken.get(pk, 0) + quantity
+
+        if taken:
+            Product.objects.filter(pk__in=taken).update(
+                stock_amount=models.F('stock_amount') - case_by_pk(taken, 0, models.IntegerField())
+            )
+            cache.items.invalidate(*taken)
+        return [entry for entry in built if entry[0] not in short]
+
+    def record_sales(self, built):
+        """ Counts items of paid receipts as sold, one ItemSales update per shop and hour."""
+        hours = OrderedDict()
+        for _, _, receipt, lines in built:
+            if not receipt.paid_amount:
+                continue
+            key = (receipt.shop_id, ItemSales.truncate_hour(receipt.date))
+            sold = hours.setdefault(key, (receipt, {}))[1]
+            for pk, quantity in self.sold_quantities(lines).items():
+                sold[pk] = sold.get(pk, 0) + quantity
+        for receipt, sold in hours.values():
+            ItemSales.record_receipt(receipt, sold)
+
+    def save(self):
+        """ Inserts accepted records, returns per-record results in input order."""
+        accepted = self.validate_batch(self.validate_fields())
+        products = self.catalog(accepted)
+        built = [(index, data['client_id']) + self.build(data, products) for index, data in accepted]
+
+        with transaction.atomic():
+            self.create_products(products)
+            built = self.take_stock(built)
+            Receipt.objects.bulk_create([receipt for _, _, receipt, _ in built])
+            for _, _, receipt, lines in built:
+                for line in lines:
+                    line.receipt_id = receipt.pk
+                    line.product_id = line.product.pk
+                    line.created_at = receipt.created_at
+            ReceiptLine.objects.bulk_create([line for _, _, _, lines in built for line in lines])
+            self.record_sales(built)
+        cache.touch('items')
+
+        for index, client_id, receipt, lines in built:
+            self.results[index] = OrderedDict([
+                ('client_id', client_id),
+                ('status', 'created'),
+                ('id', receipt.pk),
+                ('items', [line.pk for line in lines]),
+                ('products', [line.product_id for line in lines]),
+            ])
+        return self.results
+
+
+class ItemBulkUpdate(object):
+    """ Applies a batch of stock, price and discount changes to catalog products.
+
+    Changes are sorted once by the pk of their product, then locked a chunk
+    at a time, so overlapping batches take row locks in one global order
+    instead of deadlocking. Locked rows are checked against current stock,
+    then written with one UPDATE per chunk using CASE expressions keyed on
+    pk (F() additions for stock deltas). Receipt lines
+    keep the price they were sold at, so receipt totals stay as they are.
+    """
+
+    def __init__(self, changes):
+        if not isinstance(changes, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of item changes.']})
+        if len(changes) > settings.POS_BULK_MAX_ITEM_CHANGES:
+            raise ValidationError({'non_field_errors': [
+                'At most {} items can be changed at once.'.format(settings.POS_BULK_MAX_ITEM_CHANGES)
+            ]})
+        self.changes = changes
+        self.results = [None] * len(changes)
+        self.seen = set()
+
+    def reject(self, index, data, errors):
+        self.results[index] = OrderedDict([
+            ('id', data.get('id')), ('code', data.get('code')), ('status', 'rejected'), ('errors', errors)
+        ])
+
+    def validate_fields(self):
+        valid = []
+        for index, change in enumerate(self.changes):
+            serializer = ItemChangeSerializer(data=change)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                self.reject(index, change if isinstance(change, dict) else {}, serializer.errors)
+        return valid
+
+    def in_lock_order(self, valid):
+        """ Returns valid changes sorted by product pk, codes resolved with one query.
+
+        Changes of unknown codes come first, to be rejected; the sort is
+        stable, so the first of two changes to one product still wins.
+        """
+        codes = [data['code'] for _, data in valid if 'id' not in data]
+        pks = dict(Product.objects.filter(code__in=codes).values_list('code', 'pk')) if codes else {}
+        return sorted(valid, key=lambda entry: entry[1]['id'] if 'id' in entry[1] else pks.get(entry[1]['code'], 0))
+
+    def lock_rows(self, chunk):
+        """ Returns current rows of chunk's products by pk and code, locked in pk order."""
+        ids = [data['id'] for _, data in chunk if 'id' in data]
+        codes = [data['code'] for _, data in chunk if 'code' in data]
+        rows = Product.objects.select_for_update().filter(
+            models.Q(pk__in=ids) | models.Q(code__in=codes)
+        ).order_by('pk').values('pk', 'code', 'price', 'discount', 'stock_amount')
+
+        by_pk, by_code = {}, {}
+        for row in rows:
+            by_pk[row['pk']] = by_code[row['code']] = row
+        return by_pk, by_code
+
+    def apply(self, chunk):
+        by_pk, by_code = self.lock_rows(chunk)
+        prices, discounts, stocks, deltas = {}, {}, {}, {}
+
+        for index, data in chunk:
+            row = by_pk.get(data['id']) if 'id' in data else by_code.get(data['code'])
+            if row is None:
+                self.reject(index, data, {'non_field_errors': ['Item does not exist.']})
+                continue
+            if row['pk'] in self.seen:
+                self.reject(index, data, {'non_field_errors': ['Item is changed twice in one batch.']})
+                continue
+            stock = data.get('stock_amount', row['stock_amount'] + data.get('stock_delta', 0))
+            if stock < 0:
+                self.reject(index, data, {'stock_delta': [Product.stock_amount_msg]})
+                continue
+
+            self.seen.add(row['pk'])
+            price = data.get('price', row['price'])
+            discount = data.get('discount', row['discount'])
+            if 'price' in data:
+                prices[row['pk']] = price
+            if 'discount' in data:
+                discounts[row['pk']] = discount
+            if 'stock_amount' in data:
+                stocks[row['pk']] = stock
+            if data.get('stock_delta'):
+                deltas[row['pk']] = data['stock_delta']
+
+            self.results[index] = OrderedDict([
+                ('id', row['pk']), ('code', row['code']), ('status', 'updated'),
+                ('price', price), ('discount', discount), ('stock_amount', stock),
+            ])
+
+        updates = {}
+        if prices:
+            updates['price'] = case_by_pk(prices, models.F('price'), models.FloatField())
+        if discounts:
+            updates['discount'] = case_by_pk(discounts, models.F('discount'), models.FloatField())
+        if stocks or deltas:
+            stock = case_by_pk(stocks, models.F('stock_amount'), models.IntegerField())
+            if deltas:
+                stock = stock + case_by_pk(deltas, models.Value(0), models.IntegerField())
+            updates['stock_amount'] = stock
+        if updates:
+            changed = set(prices) | set(discounts) | set(stocks) | set(deltas)
+            Product.objects.filter(pk__in=changed).update(**updates)
+            cache.items.invalidate(*changed)
+            cache.touch('items')
+
+    def save(self):
+        """ Applies valid changes in one transaction, returns per-change results."""
+        valid = self.in_lock_order(self.validate_fields())
+        with transaction.atomic():
+            for chunk in chunked(valid, settings.POS_BULK_UPDATE_CHUNK_SIZE):
+                self.apply(chunk)
+        return self.results
@@ -0,0 +1,102 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+def get_cache():
+    return caches[settings.POS_CACHE_ALIAS]
+
+
+class PayloadCache(object):
+    """ Read-through cache of serialized payloads for one kind of object.
+
+    Entries are keyed by primary key and dropped by signal handlers whenever
+    the object (or anything nested in its payload) is saved or deleted, once
+    the change commits.
+    """
+
+    stats_kinds = []
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.stats_kinds.append(kind)
+
+    def key(self, pk):
+        return 'pos:{}:{}'.format(self.kind, pk)
+
+    def count(self, outcome):
+        cache = get_cache()
+        key = 'pos:stats:{}:{}'.format(self.kind, outcome)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+    def get(self, pk):
+        """ Returns cached payload of pk or None, counting hits and misses."""
+        payload = get_cache().get(self.key(pk))
+        self.count('hits' if payload is not None else 'misses')
+        return payload
+
+    def set(self, pk, payload):
+        get_cache().set(self.key(pk), payload, settings.POS_CACHE_TIMEOUT)
+        return payload
+
+    def invalidate(self, *pks):
+        """ Drops payloads of pks when the current transaction commits.
+
+        Dropped before the commit, a concurrent read would cache the rows
+        still committed until POS_CACHE_TIMEOUT.
+        """
+        keys = [self.key(pk) for pk in pks if pk is not None]
+        if keys:
+            transaction.on_commit(lambda: get_cache().delete_many(keys))
+
+
+receipts = PayloadCache('receipt')
+items = PayloadCache('item')
+averages = PayloadCache('average')
+
+
+def invalidate_receipts(*receipt_ids):
+    """ Drops payloads derived from receipts, their totals included."""
+    receipts.invalidate(*receipt_ids)
+    averages.invalidate(*receipt_ids)
+
+
+def stats():
+    """ Returns hit and miss counters of every payload cache."""
+    keys = [
+        'pos:stats:{}:{}'.format(kind, outcome)
+        for kind in PayloadCache.stats_kinds for outcome in ('hits', 'misses')
+    ]
+    counters = get_cache().get_many(keys)
+    return {
+        kind: {outcome: counters.get('pos:stats:{}:{}'.format(kind, outcome), 0) for outcome in ('hits', 'misses')}
+        for kind in PayloadCache.stats_kinds
+    }
+
+
+def touch(*names):
+    """ Starts a new generation of the named collections when the change commits.
+
+    Started before the commit, a concurrent read would tag the rows still
+    committed with the new generation.
+    """
+    transaction.on_commit(lambda: get_cache().set_many({
+        'pos:generation:' + name: (uuid.uuid4().hex, int(time.time())) for name in names
+    }, None))
+
+
+def generation(name):
+    """ Returns (token, unix time) of the named collection's current generation."""
+    key = 'pos:generation:' + name
+    current = get_cache().get(key)
+    if current is None:
+        current = (uuid.uuid4().hex, int(time.time()))
+        if not get_cache().add(key, current, None):
+            current = get_cache().get(key, current)
+    return tuple(current)
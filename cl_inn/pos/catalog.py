@@ -0,0 +1,212 @@
+""" Bulk catalog import through COPY.
+
+The file is copied as text into a temporary staging table, so a bad value
+rejects its row instead of aborting the COPY. Rows are then checked in
+set-based SQL with the rules of the Product model: the name pattern of
+GeneralCMSValidator.name_validator, non-negative price and stock, discount
+between 0 and 1, and a code given once per file. Valid rows update the
+products of existing codes and insert the others.
+
+Postgres 9.3 has no INSERT ... ON CONFLICT, so existing codes are updated
+first and the rest inserted. A product created with the same code meanwhile
+fails the import, which can be run again.
+
+An empty cell keeps the current value of an existing product. New products
+need a name and a price, and default to no discount and no stock.
+"""
+import csv
+import io
+import json
+from collections import OrderedDict
+
+from pos import cache
+from pos.models import Product
+from pos.validators import GeneralCMSValidator
+
+COLUMNS = ('code', 'name', 'price', 'discount', 'stock_amount')
+FORMATS = ('csv', 'json')
+
+FLOAT_PATTERN = r'^\s*[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]{1,3})?\s*$'
+INTEGER_PATTERN = r'^\s*[+-]?[0-9]+\s*$'
+NEW_PRODUCT = 'NOT EXISTS (SELECT 1 FROM pos_product WHERE pos_product.code = pos_catalog_staging.code)'
+
+# (condition, reason) checked in order, the first one matching rejects the row.
+CHECKS = (
+    ('code IS NULL', 'Code is required.'),
+    ('length(code) > 255', 'Code is longer than 255 characters.'),
+    ('name IS NULL AND ' + NEW_PRODUCT, 'Name is required for new products.'),
+    ('length(name) > 255', 'Name is longer than 255 characters.'),
+    ('name !~ %s', GeneralCMSValidator.name_validator.message),
+    ('price IS NULL AND ' + NEW_PRODUCT, 'Price is required for new products.'),
+    ('price !~ %s', 'Price should be a number.'),
+    ('price::numeric < 0', Product.price_msg),
+    ('price::numeric >= 1e308', 'Price is too large.'),
+    ('discount !~ %s', 'Discount should be a number.'),
+    ('discount::numeric < 0', Product.price_msg),
+    ('discount::numeric > 1', Product.discount_msg),
+    ('stock_amount !~ %s', 'Stock amount should be an integer.'),
+    ('stock_amount::numeric < 0', Product.stock_amount_msg),
+    ('stock_amount::numeric > 2147483647', 'Stock amount is too large.'),
+)
+CHECK_PATTERNS = (
+    GeneralCMSValidator.name_validator.regex.pattern, FLOAT_PATTERN, FLOAT_PATTERN, INTEGER_PATTERN
+)
+
+
+class TextStream(object):
+    """ Readable file over an iterable of strings, for COPY FROM STDIN."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        size = len(self.buffer) if size < 0 else size
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def json_objects(handle):
+    """ Yields objects of a JSON array, or of JSON lines read one at a time."""
+    first = handle.read(1)
+    while first.isspace():
+        first = handle.read(1)
+    if first == '[':
+        # A JSON array has to be parsed whole, JSON lines stream.
+        for item in json.loads(first + handle.read()):
+            yield item
+        return
+    for number, line in enumerate(handle, 1):
+        line = (first + line) if number == 1 else line
+        if line.strip():
+            yield json.loads(line)
+
+
+def json_as_csv(handle, chunk_size=1000):
+    """ Yields CSV text of the COLUMNS of JSON objects, chunk_size rows at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for count, item in enumerate(json_objects(handle), 1):
+        item = item if isinstance(item, dict) else {}
+        writer.writerow(['' if item.get(column) is None else item[column] for column in COLUMNS])
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+class CatalogImport(object):
+    """ Stages, checks and applies one catalog file inside the caller's transaction."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.results = OrderedDict([('rows', 0), ('rejected', 0), ('created', 0), ('updated', 0), ('unchanged', 0)])
+
+    def stage(self, handle, format='csv'):
+        """ Copies rows of handle into the staging table, numbered from 1.
+
+        CSV files name their columns in a header row, any of COLUMNS in any
+        order with code required.
+        """
+        # Left over by an earlier import in the same transaction.
+        self.cursor.execute('DROP TABLE IF EXISTS pos_catalog_staging')
+        self.cursor.execute(
+            'CREATE TEMPORARY TABLE pos_catalog_staging ('
+            'row_no serial, code text, name text, price text, discount text, stock_amount text, reason text'
+            ') ON COMMIT DROP'
+        )
+        if format == 'csv':
+            header = next(csv.reader([handle.readline()]), [])
+            columns = [column.strip() for column in header]
+            unknown = set(columns) - set(COLUMNS)
+            if unknown or 'code' not in columns or len(set(columns)) != len(columns):
+                raise ValueError(
+                    'CSV header should name the columns once each, code included, out of: ' + ', '.join(COLUMNS)
+                )
+        else:
+            columns, handle = COLUMNS, TextStream(json_as_csv(handle))
+
+        self.cursor.copy_expert(
+            'COPY pos_catalog_staging ({}) FROM STDIN WITH (FORMAT csv)'.format(', '.join(columns)), handle
+        )
+        self.cursor.execute('CREATE INDEX ON pos_catalog_staging (code)')
+        # Temporary tables are never analyzed automatically.
+        self.cursor.execute('ANALYZE pos_catalog_staging')
+        self.cursor.execute('SELECT COUNT(*) FROM pos_catalog_staging')
+        self.results['rows'] = self.cursor.fetchone()[0]
+
+    def check(self):
+        """ Gives every invalid row the reason of its first failed check."""
+        conditions = ' '.join('WHEN {} THEN %s'.format(condition) for condition, _ in CHECKS)
+        patterns = iter(CHECK_PATTERNS)
+        params = []
+        for condition, reason in CHECKS:
+            if '%s' in condition:
+                params.append(next(patterns))
+            params.append(reason)
+        self.cursor.execute('UPDATE pos_catalog_staging SET reason = CASE {} END'.format(conditions), params)
+        self.cursor.execute(
+            "UPDATE pos_catalog_staging SET reason = 'Code is repeated from row ' || kept.row_no || '.' "
+            'FROM ('
+            'SELECT code, MIN(row_no) AS row_no FROM pos_catalog_staging WHERE reason IS NULL '
+            'GROUP BY code HAVING COUNT(*) > 1'
+            ') kept '
+            'WHERE pos_catalog_staging.code = kept.code AND pos_catalog_staging.row_no > kept.row_no '
+            'AND pos_catalog_staging.reason IS NULL'
+        )
+        self.cursor.execute('SELECT COUNT(*) FROM pos_catalog_staging WHERE reason IS NOT NULL')
+        self.results['rejected'] = self.cursor.fetchone()[0]
+
+    def rejected(self, batch_size=1000):
+        """ Yields (row, code, reason) of rejected rows in file order."""
+        self.cursor.execute(
+            'SELECT row_no, code, reason FROM pos_catalog_staging WHERE reason IS NOT NULL ORDER BY row_no'
+        )
+        while True:
+            rows = self.cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield row
+
+    def apply(self, batch_size=1000):
+        """ Updates products of known codes that change, inserts the others."""
+        self.cursor.execute(
+            'UPDATE pos_product SET '
+            'name = COALESCE(staged.name, pos_product.name), '
+            'price = COALESCE(staged.price::float8, pos_product.price), '
+            'discount = COALESCE(staged.discount::float8, pos_product.discount), '
+            'stock_amount = COALESCE(staged.stock_amount::integer, pos_product.stock_amount) '
+            'FROM pos_catalog_staging staged '
+            'WHERE staged.code = pos_product.code AND staged.reason IS NULL '
+            'AND (pos_product.name, pos_product.price, pos_product.discount, pos_product.stock_amount) '
+            'IS DISTINCT FROM ('
+            'COALESCE(staged.name, pos_product.name), COALESCE(staged.price::float8, pos_product.price), '
+            'COALESCE(staged.discount::float8, pos_product.discount), '
+            'COALESCE(staged.stock_amount::integer, pos_product.stock_amount)'
+            ') RETURNING pos_product.id'
+        )
+        updated = 0
+        while True:
+            ids = [row[0] for row in self.cursor.fetchmany(batch_size)]
+            if not ids:
+                break
+            updated += len(ids)
+            cache.items.invalidate(*ids)
+        self.cursor.execute(
+            'INSERT INTO pos_product (code, name, price, discount, stock_amount) '
+            'SELECT code, name, price::float8, COALESCE(discount::float8, 0), COALESCE(stock_amount::integer, 0) '
+            'FROM pos_catalog_staging WHERE reason IS NULL AND ' + NEW_PRODUCT + ' ORDER BY row_no'
+        )
+        self.results['created'] = self.cursor.rowcount
+        self.results['updated'] = updated
+        self.results['unchanged'] = self.results['rows'] - self.results['rejected'] - self.results['created'] - updated
+        if updated or self.results['created']:
+            cache.touch('items')
+        return self.results
@@ -0,0 +1,63 @@
+import calendar
+import hashlib
+
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from pos import cache
+from pos.models import Receipt
+from pos.routers import reading_replica
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest())
+
+
+def receipt_validators(receipt_id):
+    """ Returns (etag, last modified) of a receipt from its row version, None if missing."""
+    modified_at = Receipt.objects.filter(pk=receipt_id).values_list('modified_at', flat=True).first()
+    if modified_at is None:
+        return None
+    return make_etag('receipt', receipt_id, modified_at.isoformat()), calendar.timegm(modified_at.utctimetuple())
+
+
+def collection_validators(request, *names):
+    """ Returns (etag, last modified) of a listing from its collections' generations."""
+    generations = [cache.generation(name) for name in names]
+    etag = make_etag(request.get_full_path(), *[token for token, _ in generations])
+    return etag, max(modified for _, modified in generations)
+
+
+def is_not_modified(request, etag, last_modified):
+    """ Evaluates If-None-Match, or If-Modified-Since when no ETag is sent."""
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def with_validators(response, etag, last_modified):
+    """ Sets validators of a response, unless its rows were read from a replica.
+
+    Generations are bumped on the primary, a lagging replica may serve rows
+    older than them.
+    """
+    if reading_replica():
+        return response
+    return set_validators(response, etag, last_modified)
+
+
+def not_modified_response(request, validators):
+    """ Returns a 304 response if the client's copy is current, else None."""
+    etag, last_modified = validators
+    if request.method in ('GET', 'HEAD') and is_not_modified(request, etag, last_modified):
+        return set_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+    return None
@@ -0,0 +1,88 @@
+""" Streaming export of receipt lines joined with their receipts.
+
+Rows are read in keyset chunks, like streamed list responses, rather than
+through a server-side cursor that would keep a transaction open for the
+whole download. Lines and receipts are both filtered on created_at, so only
+partitions of the exported months are read (see pos.partitions).
+"""
+import re
+from collections import OrderedDict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from pos.models import ReceiptLine
+from pos.renderers import render_csv_rows, render_ndjson_line
+from pos.streaming import iter_chunks
+
+# Exported column: lookup from ReceiptLine.
+COLUMNS = OrderedDict([
+    ('receipt', 'receipt'),
+    ('receipt_name', 'receipt__name'),
+    ('created_at', 'receipt__created_at'),
+    ('shop', 'receipt__shop'),
+    ('user', 'receipt__user'),
+    ('cashier', 'receipt__cashier'),
+    ('paid_amount', 'receipt__paid_amount'),
+    ('change', 'receipt__change'),
+    ('receipt_total', 'receipt__total'),
+    ('line', 'id'),
+    ('product', 'product'),
+    ('code', 'product__code'),
+    ('name', 'product__name'),
+    ('quantity', 'quantity'),
+    ('price', 'price'),
+    ('discount', 'discount'),
+])
+FORMATS = ('csv', 'ndjson')
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+def day_range(start, end):
+    """ Returns aware datetimes bounding days start to end, both included."""
+    first = timezone.make_aware(datetime.combine(start, time.min))
+    return first, timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+
+
+def export_rows(shop, start, end):
+    """ Returns lines of shop's receipts created between days start and end, as values() rows."""
+    since, until = day_range(start, end)
+    return ReceiptLine.objects.filter(
+        receipt__shop=shop,
+        created_at__gte=since, created_at__lt=until,
+        receipt__created_at__gte=since, receipt__created_at__lt=until
+    ).values(*COLUMNS.values())
+
+
+def iter_export(rows, format, chunk_size=None):
+    """ Yields rows encoded as CSV, header first, or NDJSON, one chunk at a time."""
+    chunk_size = chunk_size or settings.POS_STREAM_CHUNK_SIZE
+    if format == 'csv':
+        yield render_csv_rows([list(COLUMNS)]).encode('utf-8')
+    for chunk in iter_chunks(rows, chunk_size):
+        if format == 'csv':
+            text = render_csv_rows([[row[lookup] for lookup in COLUMNS.values()] for row in chunk])
+        else:
+            text = ''.join(
+                render_ndjson_line(OrderedDict((column, row[lookup]) for column, lookup in COLUMNS.items()))
+                for row in chunk
+            )
+        yield text.encode('utf-8')
+
+
+def export_response(request, rows, filename):
+    """ Returns a response streaming rows in the accepted format, gzipped if the client accepts it."""
+    renderer = request.accepted_renderer
+    # Rows are read after the view returns, so keep the database it routed to.
+    chunks = iter_export(rows.using(rows.db), renderer.format)
+    gzipped = ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    content_type = renderer.media_type + ('; charset=' + renderer.charset if renderer.charset else '')
+    response = StreamingHttpResponse(compress_sequence(chunks) if gzipped else chunks, content_type=content_type)
+    if gzipped:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(filename, renderer.format)
+    return response
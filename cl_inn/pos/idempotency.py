@@ -0,0 +1,103 @@
+import hashlib
+import json
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+from pos.cache import get_cache
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+REPLAY_HEADER = 'Idempotent-Replayed'
+
+
+def request_fingerprint(request):
+    """ Returns a digest of the request payload, to catch reused keys."""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = sorted(data.lists())
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def wait_for_stored(cache, key):
+    """ Polls for the response stored by a concurrent first request."""
+    deadline = time.time() + settings.POS_IDEMPOTENCY_LOCK_TIMEOUT
+    while time.time() < deadline:
+        stored = cache.get(key)
+        if stored is not None:
+            return stored
+        time.sleep(settings.POS_IDEMPOTENCY_POLL_INTERVAL)
+    return None
+
+
+def replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return Response(
+            {'detail': 'Idempotency-Key was already used with a different request.'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    return Response(stored['data'], status=stored['status'], headers={REPLAY_HEADER: 'true'})
+
+
+def idempotent(view):
+    """ Replays the stored response of unsafe requests retried with the same Idempotency-Key.
+
+    The first request takes a short lock in the cache, runs the view and
+    stores its response for POS_IDEMPOTENCY_TTL seconds once its changes
+    commit. Duplicates arriving meanwhile wait for that response instead of
+    running the view again. Server errors are not stored so they can be
+    retried, and a request that fails to commit holds the lock until it
+    times out.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        idempotency_key = request.META.get(HEADER)
+        if not idempotency_key or request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return view(request, *args, **kwargs)
+
+        cache = get_cache()
+        key = 'pos:idempotency:{}:{}:{}'.format(view.__name__, request.user.pk, idempotency_key)
+        lock_key = key + ':lock'
+        fingerprint = request_fingerprint(request)
+
+        stored = cache.get(key)
+        if stored is None:
+            if cache.add(lock_key, 1, settings.POS_IDEMPOTENCY_LOCK_TIMEOUT):
+                # The first request may have stored its response and unlocked in between.
+                stored = cache.get(key)
+                if stored is not None:
+                    cache.delete(lock_key)
+            else:
+                stored = wait_for_stored(cache, key)
+                if stored is None:
+                    return Response(
+                        {'detail': 'A request with this Idempotency-Key is still in progress.'},
+                        status=status.HTTP_409_CONFLICT
+                    )
+        if stored is not None:
+            return replay(stored, fingerprint)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            cache.delete(lock_key)
+            raise
+
+        def store():
+            try:
+                if response.status_code < 500:
+                    cache.set(key, {
+                        'fingerprint': fingerprint,
+                        'status': response.status_code,
+                        'data': response.data,
+                    }, settings.POS_IDEMPOTENCY_TTL)
+            finally:
+                cache.delete(lock_key)
+
+        transaction.on_commit(store)
+        return response
+
+    return wrapper
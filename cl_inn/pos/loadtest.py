@@ -0,0 +1,352 @@
+""" Checkout workload simulator.
+
+Terminals are asyncio tasks sharing one event loop, each with its own
+keep-alive HTTP connection to a running server. A terminal repeats the
+checkout flow of a cashier: open a receipt, add lines of catalog items,
+check the receipt average and pay, which takes the lines from stock, with
+exponentially distributed think times between steps. Catalog items are
+picked with a Zipf skew so a few hot SKUs take most of the stock traffic,
+which is where terminals contend for row locks.
+"""
+import asyncio
+import base64
+import bisect
+import json
+import math
+import random
+import time
+import uuid
+from collections import Counter, defaultdict, namedtuple
+from urllib.parse import urlencode, urlsplit
+
+from pos.benchmark import percentile
+
+# Statuses meaning a request lost a race with another terminal.
+CONTENTION_STATUSES = (409, 423, 503)
+
+Response = namedtuple('Response', 'status headers body')
+
+
+def response_json(response):
+    return json.loads(response.body.decode('utf-8')) if response.body else None
+
+
+class NoResponse(ConnectionError):
+    pass
+
+
+class HTTPClient(object):
+    """ Minimal HTTP/1.1 client on asyncio streams, one keep-alive connection."""
+
+    def __init__(self, base_url, username, password, timeout=30):
+        parts = urlsplit(base_url)
+        self.ssl = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        credentials = '{}:{}'.format(username, password).encode('utf-8')
+        self.headers = {
+            'Host': parts.netloc,
+            'Authorization': 'Basic ' + base64.b64encode(credentials).decode('ascii'),
+            'Accept': 'application/json',
+        }
+        self.reader = self.writer = None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, method, path, data=None, form=None, headers=None):
+        """ Returns the Response to method on path, with a JSON or form body."""
+        body = b''
+        request_headers = dict(self.headers)
+        request_headers.update(headers or {})
+        if data is not None:
+            body = json.dumps(data).encode('utf-8')
+            request_headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            body = urlencode(form).encode('utf-8')
+            request_headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        request_headers['Content-Length'] = str(len(body))
+        head = '{} {}{} HTTP/1.1\r\n'.format(method, self.prefix, path) + ''.join(
+            '{}: {}\r\n'.format(name, value) for name, value in request_headers.items()
+        ) + '\r\n'
+
+        # A kept-alive connection may have been closed by the server meanwhile;
+        # that shows as no response at all and is retried once on a new one.
+        reused = self.writer is not None
+        while True:
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.timeout
+                )
+            try:
+                self.writer.write(head.encode('latin-1') + body)
+                return await asyncio.wait_for(self.read_response(method), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError) as error:
+                self.close()
+                if not reused or not isinstance(error, NoResponse):
+                    raise
+                reused = False
+            except BaseException:
+                self.close()
+                raise
+
+    async def read_response(self, method):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise NoResponse('Connection closed before a response.')
+        version, status = status_line.decode('latin-1').split(' ', 2)[:2]
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        status = int(status)
+        if method == 'HEAD' or status in (204, 304):
+            body = b''
+        elif 'content-length' in headers:
+            body = await self.reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await self.read_chunked()
+        else:
+            body = await self.reader.read()
+            headers['connection'] = 'close'
+
+        keep_alive = version == 'HTTP/1.1' or headers.get('connection', '').lower() == 'keep-alive'
+        if not keep_alive or headers.get('connection', '').lower() == 'close':
+            self.close()
+        return Response(status, headers, body)
+
+    async def read_chunked(self):
+        chunks = []
+        while True:
+            size = int((await self.reader.readline()).split(b';')[0], 16)
+            if not size:
+                await self.reader.readline()
+                return b''.join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readline()
+
+
+class RequestFailed(Exception):
+
+    def __init__(self, operation, response):
+        super().__init__('{} returned {}'.format(operation, response.status))
+        self.response = response
+
+
+class Stats(object):
+    """ Latencies and outcomes of requests, by operation."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.failures = Counter()
+        self.stock_rejections = 0
+        self.checkouts = 0
+
+    def record(self, operation, started, status):
+        self.latencies[operation].append((time.perf_counter() - started) * 1000)
+        self.statuses[operation][status] += 1
+
+    def report(self, elapsed, terminals):
+        requests = sum(sum(counter.values()) for name, counter in self.statuses.items() if name != 'checkout')
+        errors = sum(
+            count for name, counter in self.statuses.items() if name != 'checkout'
+            for status, count in counter.items() if status is None or status >= 400
+        )
+        contended = sum(
+            counter[status] for name, counter in self.statuses.items() if name != 'checkout'
+            for status in CONTENTION_STATUSES
+        )
+        operations = {}
+        for name, latencies in sorted(self.latencies.items()):
+            operations[name] = {
+                'count': len(latencies),
+                'p50_ms': round(percentile(latencies, 0.50), 3),
+                'p95_ms': round(percentile(latencies, 0.95), 3),
+                'p99_ms': round(percentile(latencies, 0.99), 3),
+                'max_ms': round(max(latencies), 3),
+                'statuses': {str(status): count for status, count in sorted(
+                    self.statuses[name].items(), key=lambda pair: str(pair[0])
+                )},
+            }
+        return {
+            'terminals': terminals,
+            'elapsed_s': round(elapsed, 3),
+            'checkouts': self.checkouts,
+            'checkouts_per_s': round(self.checkouts / elapsed, 3) if elapsed else 0,
+            'requests': requests,
+            'requests_per_s': round(requests / elapsed, 3) if elapsed else 0,
+            'error_rate': round(errors / requests, 4) if requests else 0,
+            'contention_rate': round(contended / requests, 4) if requests else 0,
+            'stock_rejections': self.stock_rejections,
+            'failures': dict(self.failures),
+            'operations': operations,
+        }
+
+
+def zipf_weights(count, skew):
+    """ Returns cumulative weights of ranks 1..count, 1 / rank ** skew each."""
+    cumulative, total = [], 0.0
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** skew
+        cumulative.append(total)
+    return cumulative
+
+
+class Simulation(object):
+    """ Runs checkout terminals against base_url and reports their stats.
+
+    Terminals stop after `checkouts` checkouts each, or when `duration`
+    seconds have passed, whichever comes first. Receipts are opened for user
+    and shop (ids), so the API user must be allowed to act for them.
+    """
+
+    def __init__(self, base_url, username, password, user, shop, terminals=10, duration=60,
+                 checkouts=None, think_time=1.0, max_lines=5, skus=200, skew=1.1, stock=100000, seed=None):
+        self.base_url, self.username, self.password = base_url, username, password
+        self.user, self.shop = user, shop
+        self.terminals = terminals
+        self.duration = duration
+        self.checkouts = checkouts
+        self.think_time = think_time
+        self.max_lines = max_lines
+        self.skus = skus
+        self.skew = skew
+        self.stock = stock
+        self.random = random.Random(seed)
+        self.run_id = uuid.uuid4().hex[:8]
+        self.stats = Stats()
+        self.catalog = []
+        self.weights = zipf_weights(skus, skew)
+
+    def client(self):
+        return HTTPClient(self.base_url, self.username, self.password)
+
+    async def call(self, client, operation, method, path, expected, **kwargs):
+        """ Returns the response of a timed request, raising RequestFailed if unexpected."""
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            self.stats.record(operation, started, None)
+            raise
+        self.stats.record(operation, started, response.status)
+        if response.status != expected:
+            raise RequestFailed(operation, response)
+        return response
+
+    async def setup(self):
+        """ Creates the SKU catalog the terminals take stock from."""
+        items = [
+            {
+                'name': 'SKU {}'.format(rank), 'code': 'sim-{}-sku-{}'.format(self.run_id, rank),
+                'price': self.random.randint(1, 100) * 5, 'stock_amount': self.stock,
+            } for rank in range(self.skus)
+        ]
+        client = self.client()
+        try:
+            response = await client.request('POST', '/receipts/bulk/', data=[{
+                'client_id': 'sim-{}-catalog'.format(self.run_id), 'name': 'Simulator catalog',
+                'shop': self.shop, 'user': self.user, 'items': items,
+            }])
+        finally:
+            client.close()
+        if response.status != 200:
+            raise RuntimeError('Catalog upload returned {}'.format(response.status))
+        result = response_json(response)[0]
+        if result['status'] != 'created':
+            raise RuntimeError('Catalog upload rejected: {}'.format(result['errors']))
+        self.catalog = [dict(item, id=pk) for item, pk in zip(items, result['products'])]
+
+    def pick_sku(self):
+        return self.catalog[bisect.bisect_left(self.weights, self.random.random() * self.weights[-1])]
+
+    async def think(self):
+        if self.think_time > 0:
+            await asyncio.sleep(self.random.expovariate(1.0 / self.think_time))
+
+    async def checkout(self, client, terminal, number):
+        """ Opens, fills, inspects and pays one receipt."""
+        response = await self.call(client, 'open_receipt', 'POST', '/receipts/', 201, data={
+            'name': 'Terminal {} receipt {}'.format(terminal, number), 'shop': self.shop, 'user': self.user,
+        })
+        receipt = response_json(response)['id']
+
+        total = 0
+        for _ in range(self.random.randint(1, self.max_lines)):
+            await self.think()
+            sku = self.pick_sku()
+            await self.call(client, 'add_item', 'POST', '/items/', 201, data={
+                'receipt': receipt, 'product': sku['id'],
+            })
+            total += sku['price']
+
+        await self.think()
+        await self.call(client, 'average', 'GET', '/receipts/average/{}/'.format(receipt), 200)
+
+        await self.think()
+        headers = {'Idempotency-Key': uuid.uuid4().hex}
+        try:
+            if self.random.random() < 0.5:
+                await self.call(client, 'pay', 'POST', '/receipts/pay/{}/'.format(receipt), 200,
+                                form={'money': total}, headers=headers)
+            else:
+                money = (math.floor(total / 50) + 1) * 50
+                await self.call(client, 'pay_with_change', 'POST', '/receipts/pay_with_change/{}/'.format(receipt),
+                                200, form={'money': money}, headers=headers)
+        except RequestFailed as failure:
+            if failure.response.status == 409:
+                # Lines short of stock, the receipt stays unpaid.
+                self.stats.stock_rejections += 1
+            raise
+
+    async def terminal(self, terminal, deadline):
+        client = self.client()
+        number = 0
+        try:
+            while time.perf_counter() < deadline and (self.checkouts is None or number < self.checkouts):
+                number += 1
+                started = time.perf_counter()
+                try:
+                    await self.checkout(client, terminal, number)
+                except RequestFailed as failure:
+                    self.stats.failures[str(failure)] += 1
+                    self.stats.record('checkout', started, failure.response.status)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as error:
+                    self.stats.failures[type(error).__name__] += 1
+                    self.stats.record('checkout', started, None)
+                    client.close()
+                else:
+                    self.stats.checkouts += 1
+                    self.stats.record('checkout', started, 200)
+        finally:
+            client.close()
+
+    async def run_terminals(self):
+        await self.setup()
+        deadline = time.perf_counter() + self.duration
+        started = time.perf_counter()
+        await asyncio.gather(*[self.terminal(terminal, deadline) for terminal in range(1, self.terminals + 1)])
+        return time.perf_counter() - started
+
+    def run(self, loop=None):
+        """ Returns the report of a whole simulation."""
+        loop = loop or asyncio.new_event_loop()
+        try:
+            elapsed = loop.run_until_complete(self.run_terminals())
+        finally:
+            loop.close()
+        report = self.stats.report(elapsed, self.terminals)
+        report['settings'] = {
+            'think_time_s': self.think_time, 'max_lines': self.max_lines,
+            'skus': self.skus, 'skew': self.skew, 'checkouts': self.checkouts, 'duration_s': self.duration,
+        }
+        return report
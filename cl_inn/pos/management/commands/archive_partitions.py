@@ -0,0 +1,74 @@
+import os
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from pos import cache, partitions
+
+
+class Command(BaseCommand):
+    help = 'Detaches receipt partitions of old months into the archive schema, or into compressed dumps.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep', type=int, default=settings.POS_PARTITIONS_KEEP,
+            help='Months kept online, the current one included.'
+        )
+        parser.add_argument('--dump-dir', help='Dump archived partitions there with pg_dump, then drop them.')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the months to archive.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def forget(self, receipts, batch_size):
+        """ Drops cached payloads of the receipts of an archived partition."""
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM {}'.format(receipts))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                cache.invalidate_receipts(*[row[0] for row in rows])
+
+    def dump(self, table, directory):
+        """ Writes table to a compressed pg_dump archive in directory, then drops it."""
+        database = connection.settings_dict
+        path = os.path.join(directory, table + '.dump')
+        command = ['pg_dump', '--format=custom', '--compress=9', '--table=' + table, '--file=' + path]
+        for option, key in (('--host', 'HOST'), ('--port', 'PORT'), ('--username', 'USER')):
+            if database[key]:
+                command.append('{}={}'.format(option, database[key]))
+        command.append(database['NAME'])
+        env = dict(os.environ, PGPASSWORD=database['PASSWORD']) if database['PASSWORD'] else None
+        subprocess.check_call(command, env=env)
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE {}'.format(table))
+        return path
+
+    def handle(self, *args, **options):
+        if options['keep'] < 1:
+            raise CommandError('--keep should be at least 1.')
+        if options['dump_dir'] and not os.path.isdir(options['dump_dir']):
+            raise CommandError('{} is not a directory.'.format(options['dump_dir']))
+
+        oldest_kept = partitions.add_months(partitions.month_of(timezone.now()), 1 - options['keep'])
+        with connection.cursor() as cursor:
+            months = [month for month, _ in partitions.partitions(cursor, 'pos_receipt') if month < oldest_kept]
+
+        for month in months:
+            if options['dry_run']:
+                self.stdout.write('Would archive {:%Y-%m}'.format(month))
+                continue
+            with transaction.atomic(), connection.cursor() as cursor:
+                archived = partitions.detach(cursor, month, settings.POS_ARCHIVE_SCHEMA)
+            self.forget(archived[-1], options['batch_size'])
+            for table in archived:
+                if options['dump_dir']:
+                    self.stdout.write('Dumped {} to {}'.format(table, self.dump(table, options['dump_dir'])))
+                else:
+                    self.stdout.write('Detached {}'.format(table))
+
+        if months and not options['dry_run']:
+            cache.touch('items')
+        action = 'to archive' if options['dry_run'] else 'archived'
+        self.stdout.write(self.style.SUCCESS('{} months {}.'.format(len(months), action)))
@@ -0,0 +1,66 @@
+import json
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from pos.benchmark import BENCHMARK_USERNAME, Benchmark, Seeder, compare
+from pos.serializers import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks every POS API route against the configured database and writes a JSON report. '
+        'Run it against a dedicated benchmark database: seeding and requests write to it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help='Seed data before benchmarking.')
+        parser.add_argument('--shops', type=int, default=100)
+        parser.add_argument('--receipts', type=int, default=10000)
+        parser.add_argument('--items', type=int, default=100000, help='Receipt lines seeded over all receipts.')
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--route', action='append', dest='routes', help='Only benchmark given route names.')
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--baseline', help='Report to compare against.')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Allowed relative growth of any metric over the baseline.'
+        )
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            user = Seeder(
+                options['shops'], options['receipts'], options['items'], options['products'], stdout=self.stdout
+            ).seed()
+        else:
+            user = User.objects.filter(username=BENCHMARK_USERNAME).first()
+            if user is None:
+                raise CommandError('No benchmark data found, run with --seed first.')
+
+        report = {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'iterations': options['iterations'],
+                'volumes': {
+                    'shops': options['shops'], 'receipts': options['receipts'], 'items': options['items'],
+                    'products': options['products'],
+                } if options['seed'] else None,
+            },
+            'endpoints': Benchmark(user, options['iterations']).run(options['routes']),
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+        for name, metrics in sorted(report['endpoints'].items()):
+            self.stdout.write('{:<28} p50 {p50_ms:>9}ms  p95 {p95_ms:>9}ms  {queries:>3} queries  '
+                              'sql {sql_ms:>8}ms  peak {peak_kb:>9}kB'.format(name, **metrics))
+        self.stdout.write('Report written to ' + options['output'])
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = compare(report, json.load(baseline), options['threshold'])
+            if regressions:
+                raise CommandError('Regressions over baseline:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions over baseline.'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from pos import partitions
+
+
+class Command(BaseCommand):
+    help = 'Creates receipt partitions of the coming months and seals months that are over.'
+
+    def handle(self, *args, **options):
+        created = partitions.ensure()
+        for name in created:
+            self.stdout.write('Created {}'.format(name))
+        self.stdout.write(self.style.SUCCESS('Created {} partitions.'.format(len(created))))
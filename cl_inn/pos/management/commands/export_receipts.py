@@ -0,0 +1,45 @@
+import gzip
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from pos.export import FORMATS, export_rows, iter_export
+
+
+class Command(BaseCommand):
+    help = 'Streams lines of a shop\'s receipts created between two days, as CSV or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', type=int, required=True)
+        parser.add_argument('--start', required=True, help='First day, YYYY-MM-DD.')
+        parser.add_argument('--end', required=True, help='Last day, YYYY-MM-DD.')
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', help='File to write, stdout when left out.')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            start, end = parse_date(options['start']), parse_date(options['end'])
+        except ValueError:
+            start = end = None
+        if start is None or end is None or end < start:
+            raise CommandError('Give --start and --end days formatted as YYYY-MM-DD, start first.')
+
+        rows = export_rows(options['shop'], start, end)
+        target = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        output = gzip.GzipFile(fileobj=target, mode='wb') if options['gzip'] else target
+        written = 0
+        try:
+            for chunk in iter_export(rows, options['format'], options['chunk_size']):
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if output is not target:
+                output.close()
+            if options['output']:
+                target.close()
+            else:
+                target.flush()
+        # Progress goes to stderr, stdout may carry the export.
+        self.stderr.write('Exported {} bytes.'.format(written))
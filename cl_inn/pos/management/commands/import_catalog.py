@@ -0,0 +1,53 @@
+import csv
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from pos.catalog import FORMATS, CatalogImport
+
+
+class Command(BaseCommand):
+    help = 'Loads a CSV or JSON product catalog through COPY, reporting rejected rows with reasons.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV with a header row, JSON array or JSON lines.')
+        parser.add_argument('--format', choices=FORMATS, help='Guessed from the file extension when left out.')
+        parser.add_argument('--rejected', help='Write rejected rows there as CSV instead of listing them.')
+        parser.add_argument('--dry-run', action='store_true', help='Only check the rows, change nothing.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def report(self, catalog, path):
+        if path:
+            with open(path, 'w', newline='', encoding='utf-8') as output:
+                writer = csv.writer(output)
+                writer.writerow(['row', 'code', 'reason'])
+                writer.writerows(catalog.rejected(self.batch_size))
+            return
+        for row, code, reason in catalog.rejected(self.batch_size):
+            self.stdout.write('Row {} ({}): {}'.format(row, code, reason))
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if format in ('ndjson', 'jsonl'):
+            format = 'json'
+        if format not in FORMATS:
+            raise CommandError('Give --format, one of: ' + ', '.join(FORMATS))
+
+        try:
+            with open(options['path'], newline='', encoding='utf-8') as handle, transaction.atomic():
+                with connection.cursor() as cursor:
+                    catalog = CatalogImport(cursor)
+                    catalog.stage(handle, format)
+                    catalog.check()
+                    self.report(catalog, options['rejected'])
+                    if not options['dry_run']:
+                        catalog.apply(self.batch_size)
+                    else:
+                        transaction.set_rollback(True)
+        except (OSError, ValueError, DatabaseError) as error:
+            raise CommandError('Import failed, nothing was changed: {}'.format(error))
+
+        self.stdout.write(self.style.SUCCESS(
+            ', '.join('{} {}'.format(count, outcome) for outcome, count in catalog.results.items()) + '.'
+        ))
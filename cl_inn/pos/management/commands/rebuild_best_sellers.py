@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from pos.models import ReceiptLine, ItemSales, BestSeller
+
+
+class Command(BaseCommand):
+    help = 'Recomputes hourly product sales from paid receipts and refreshes best sellers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--leaderboard-only', action='store_true',
+            help='Only refresh leaderboards from the current sales counters.'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def rebuild_sales(self, batch_size):
+        """ Replaces sales counters with the line quantities of every paid receipt."""
+        ItemSales.objects.all().delete()
+        sold = ReceiptLine.objects.filter(receipt__paid_amount__gt=0).annotate(
+            hour=Trunc('receipt__date', 'hour', tzinfo=timezone.utc)
+        ).values('product', 'receipt__shop', 'hour').annotate(
+            sold=models.Sum('quantity')
+        ).order_by().values_list('product', 'receipt__shop', 'hour', 'sold')
+
+        batch, total = [], 0
+        for item_id, shop_id, hour, quantity in sold.iterator():
+            batch.append(ItemSales(item_id=item_id, shop_id=shop_id, hour=hour, quantity=quantity))
+            total += quantity
+            if len(batch) == batch_size:
+                ItemSales.objects.bulk_create(batch)
+                batch = []
+        ItemSales.objects.bulk_create(batch)
+        return total
+
+    def handle(self, *args, **options):
+        if not options['leaderboard_only']:
+            with transaction.atomic():
+                total = self.rebuild_sales(options['batch_size'])
+            self.stdout.write('Counted {} sold units.'.format(total))
+
+        BestSeller.refresh()
+        self.stdout.write(self.style.SUCCESS('Best sellers refreshed.'))
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from pos.models import ShopDailySales
+
+
+class Command(BaseCommand):
+    help = 'Recomputes shop daily sales rollups of the last given days.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30)
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        for offset in range(options['days'], -1, -1):
+            ShopDailySales.refresh_day(today - timedelta(days=offset))
+        self.stdout.write(self.style.SUCCESS('Rebuilt {} days of shop sales.'.format(options['days'] + 1)))
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.utils import timezone
+from pos import cache
+from pos.models import Receipt, ReceiptLine
+
+
+class Command(BaseCommand):
+    help = 'Checks stored receipt totals against their lines and repairs any drift.'
+
+    tolerance = 1e-6
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted receipts.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def live_totals(self, receipt_ids):
+        """ Aggregates totals of given receipts straight from their lines."""
+        line_total = models.ExpressionWrapper(
+            models.F('quantity') * (models.F('price') - models.F('discount')*models.F('price')),
+            output_field=models.FloatField()
+        )
+        line_sum = models.ExpressionWrapper(models.F('quantity') * models.F('price'), output_field=models.FloatField())
+        rows = ReceiptLine.objects.filter(
+            receipt__in=receipt_ids
+        ).values('receipt').annotate(
+            total=models.Sum(line_total),
+            items_sum=models.Sum(line_sum),
+            item_count=models.Sum('quantity')
+        ).order_by()
+
+        return {row['receipt']: (row['total'], row['items_sum'], row['item_count']) for row in rows}
+
+    def is_drifted(self, stored, live):
+        return any(abs(s - l) > self.tolerance for s, l in zip(stored, live))
+
+    def handle(self, *args, **options):
+        last_id, checked, drifted = 0, 0, 0
+
+        while True:
+            batch = list(
+                Receipt.objects.filter(pk__gt=last_id).order_by('pk').values_list(
+                    'pk', *Receipt.totals_fields
+                )[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            live = self.live_totals([row[0] for row in batch])
+
+            with transaction.atomic():
+                for receipt_id, *stored in batch:
+                    checked += 1
+                    expected = live.get(receipt_id, (0, 0, 0))
+                    if not self.is_drifted(stored, expected):
+                        continue
+                    drifted += 1
+                    self.stdout.write('Receipt #{}: stored {} live {}'.format(receipt_id, tuple(stored), expected))
+                    if not options['dry_run']:
+                        Receipt.objects.filter(pk=receipt_id).update(
+                            modified_at=timezone.now(), **dict(zip(Receipt.totals_fields, expected))
+                        )
+                        cache.invalidate_receipts(receipt_id)
+
+        if drifted and not options['dry_run']:
+            cache.touch('items')
+        action = 'found' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS('Checked {} receipts, {} {} drifted.'.format(checked, action, drifted)))
@@ -0,0 +1,59 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from pos.loadtest import Simulation
+from pos.models import Shop
+from pos.serializers import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulates concurrent checkout terminals against a running server and writes a JSON report. '
+        'Receipts, items and stock changes are really written, so point it at a load test deployment.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000/api', help='Base URL of the POS API.')
+        parser.add_argument('--username', required=True, help='API user, authenticated with HTTP basic auth.')
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--shop', type=int, help='Shop id of receipts, the first shop by default.')
+        parser.add_argument('--terminals', type=int, default=50)
+        parser.add_argument('--duration', type=float, default=60, help='Seconds to run.')
+        parser.add_argument('--checkouts', type=int, help='Stop each terminal after this many checkouts.')
+        parser.add_argument('--think-time', type=float, default=1.0, help='Mean seconds between steps.')
+        parser.add_argument('--max-lines', type=int, default=5, help='Most lines on one receipt.')
+        parser.add_argument('--skus', type=int, default=200, help='Catalog items created for the run.')
+        parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of SKU popularity, 0 for uniform.')
+        parser.add_argument('--stock', type=int, default=100000, help='Starting stock of each SKU.')
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--output', default='checkout-simulation.json')
+        parser.add_argument('--max-error-rate', type=float, help='Fail when more requests than this fail.')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError('No user named {}.'.format(options['username']))
+        shop = options['shop'] or Shop.objects.values_list('pk', flat=True).order_by('pk').first()
+        if shop is None:
+            raise CommandError('No shop to open receipts in, create one or pass --shop.')
+
+        report = Simulation(
+            options['url'], options['username'], options['password'], user.pk, shop,
+            terminals=options['terminals'], duration=options['duration'], checkouts=options['checkouts'],
+            think_time=options['think_time'], max_lines=options['max_lines'], skus=options['skus'],
+            skew=options['skew'], stock=options['stock'], seed=options['seed'],
+        ).run()
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+        self.stdout.write('{checkouts} checkouts by {terminals} terminals in {elapsed_s}s: '
+                          '{checkouts_per_s} checkouts/s, {requests_per_s} requests/s, '
+                          'error rate {error_rate}, contention rate {contention_rate}, '
+                          '{stock_rejections} stock rejections'.format(**report))
+        for name, metrics in sorted(report['operations'].items()):
+            self.stdout.write('{:<16} {count:>7}  p50 {p50_ms:>9}ms  p95 {p95_ms:>9}ms  p99 {p99_ms:>9}ms'.format(
+                name, **metrics))
+        self.stdout.write('Report written to ' + options['output'])
+
+        if options['max_error_rate'] is not None and report['error_rate'] > options['max_error_rate']:
+            raise CommandError('Error rate {} over {}.'.format(report['error_rate'], options['max_error_rate']))
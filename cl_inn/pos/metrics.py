@@ -0,0 +1,227 @@
+""" Request timings: Server-Timing headers and per-route histograms.
+
+ServerTimingMiddleware samples POS_METRICS_SAMPLE_RATE of requests. For a
+sampled request it counts queries and SQL time from every database
+connection, and serializers and renderers add their own time. The results go
+into a Server-Timing header and into histograms kept in each worker.
+
+Each worker copies its histograms to the cache every POS_METRICS_FLUSH_INTERVAL
+seconds. The metrics endpoint merges those copies, so one scrape sees every
+worker.
+"""
+import bisect
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from pos.cache import get_cache
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+PHASES = ('total', 'sql', 'serialize', 'render')
+# Modules whose views are timed.
+MODULES = ('pos.api_views',)
+
+WORKER = '{}:{}'.format(socket.gethostname(), os.getpid())
+WORKERS_KEY = 'pos:metrics:workers'
+
+state = threading.local()
+
+
+class Timing(object):
+    """ Measurements of one sampled request, in seconds."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.depths = {}
+        self.queries = 0
+        self.connections = [
+            (connection, connection.force_debug_cursor, len(connection.queries_log))
+            for connection in connections.all()
+        ]
+        for connection, forced, logged in self.connections:
+            connection.force_debug_cursor = True
+
+    def add(self, phase, seconds):
+        self.phases[phase] += seconds
+
+    def finish(self):
+        """ Stops counting queries and sets the sql and total phases."""
+        for connection, forced, logged in self.connections:
+            connection.force_debug_cursor = forced
+            queries = list(connection.queries_log)[logged:]
+            self.queries += len(queries)
+            self.phases['sql'] += sum(float(query['time']) for query in queries)
+        self.phases['total'] = time.perf_counter() - self.started
+
+    def header(self):
+        """ Returns the Server-Timing header value, durations in ms."""
+        return ', '.join(
+            '{};dur={:.1f}'.format(phase, self.phases[phase] * 1000) + (
+                ';desc="{} queries"'.format(self.queries) if phase == 'sql' else ''
+            )
+            for phase in PHASES
+        )
+
+
+def current():
+    """ Returns the Timing of the running sampled request, or None."""
+    return getattr(state, 'timing', None)
+
+
+def begin():
+    state.timing = Timing()
+    return state.timing
+
+
+def end():
+    timing, state.timing = state.timing, None
+    timing.finish()
+    return timing
+
+
+class timed(object):
+    """ Adds the time spent in the block to phase of the sampled request.
+
+    Nested blocks of the same phase, such as nested serializers, count once.
+    Outside sampled requests it does nothing.
+    """
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.timing = timing = current()
+        if timing is not None:
+            depth = timing.depths[self.phase] = timing.depths.get(self.phase, 0) + 1
+            if depth == 1:
+                self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        timing = self.timing
+        if timing is not None:
+            timing.depths[self.phase] -= 1
+            if not timing.depths[self.phase]:
+                timing.add(self.phase, time.perf_counter() - self.started)
+
+
+class Histogram(object):
+    """ Prometheus style histogram, with counts kept per bucket."""
+
+    def __init__(self, buckets, counts=None, total=0, count=0):
+        self.buckets = buckets
+        self.counts = list(counts or [0] * (len(buckets) + 1))
+        self.sum = total
+        self.count = count
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def snapshot(self):
+        return (self.buckets, self.counts, self.sum, self.count)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        return cls(*snapshot)
+
+
+# {(metric, route, phase): Histogram} of this worker.
+histograms = {}
+lock = threading.Lock()
+last_flush = 0.0
+
+
+def observe(metric, route, phase, buckets, value):
+    key = (metric, route, phase)
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms.setdefault(key, Histogram(buckets))
+    histogram.observe(value)
+
+
+def record(route, timing):
+    """ Adds a finished request of route to this worker's histograms."""
+    with lock:
+        for phase in PHASES:
+            observe('pos_request_duration_seconds', route, phase, DURATION_BUCKETS, timing.phases[phase])
+        observe('pos_request_queries', route, '', QUERY_BUCKETS, timing.queries)
+    if time.time() - last_flush >= settings.POS_METRICS_FLUSH_INTERVAL:
+        flush()
+
+
+def snapshot():
+    with lock:
+        return {key: histogram.snapshot() for key, histogram in histograms.items()}
+
+
+def worker_key(worker):
+    return 'pos:metrics:{}'.format(worker)
+
+
+def flush():
+    """ Copies this worker's histograms to the cache and lists the worker.
+
+    Workers silent for a few flush intervals are dropped from the list. Two
+    workers flushing at once may drop each other until their next flush.
+    """
+    global last_flush
+    now = last_flush = time.time()
+    timeout = settings.POS_METRICS_FLUSH_INTERVAL * 6
+    cache = get_cache()
+    cache.set(worker_key(WORKER), snapshot(), timeout)
+    workers = {
+        worker: flushed_at for worker, flushed_at in (cache.get(WORKERS_KEY) or {}).items()
+        if now - flushed_at < timeout
+    }
+    workers[WORKER] = now
+    cache.set(WORKERS_KEY, workers, timeout)
+
+
+def collect():
+    """ Returns {(metric, route, phase): Histogram} merged over all workers."""
+    cache = get_cache()
+    workers = set(cache.get(WORKERS_KEY) or {}) - {WORKER}
+    snapshots = list(cache.get_many([worker_key(worker) for worker in workers]).values())
+    snapshots.append(snapshot())
+    merged = {}
+    for worker_snapshot in snapshots:
+        for key, histogram in worker_snapshot.items():
+            histogram = Histogram.from_snapshot(histogram)
+            if key in merged:
+                merged[key].merge(histogram)
+            else:
+                merged[key] = histogram
+    return merged
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(merged):
+    """ Returns merged histograms in Prometheus text exposition format."""
+    lines = []
+    for metric in sorted({key[0] for key in merged}):
+        lines.append('# TYPE {} histogram'.format(metric))
+        for (name, route, phase) in sorted(key for key in merged if key[0] == metric):
+            histogram = merged[(name, route, phase)]
+            labels = 'route="{}"'.format(route) + (',phase="{}"'.format(phase) if phase else '')
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(metric, labels, bound, cumulative))
+            lines.append('{}_sum{{{}}} {}'.format(metric, labels, format_value(histogram.sum)))
+            lines.append('{}_count{{{}}} {}'.format(metric, labels, histogram.count))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,72 @@
+import random
+import time
+
+from django.conf import settings
+
+from pos import metrics
+from pos.querywatch import QueryWatcher
+from pos.routers import pin_to_primary
+
+
+class ServerTimingMiddleware(object):
+    """ Times sampled requests to POS API views, see pos.metrics.
+
+    Keep it first in MIDDLEWARE so the total phase covers the whole request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.POS_METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+        metrics.begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            timing = metrics.end()
+        match = request.resolver_match
+        if match is not None and getattr(match.func, '__module__', None) in metrics.MODULES:
+            response['Server-Timing'] = timing.header()
+            metrics.record(match.url_name, timing)
+        return response
+
+    def process_template_response(self, request, response):
+        timing = metrics.current()
+        if timing is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda response: timing.add('render', time.perf_counter() - started)
+            )
+        return response
+
+
+class ReplicaPinMiddleware(object):
+    """ Pins users to the primary database right after they write."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            user = getattr(request, 'user', None)
+            if user is not None:
+                pin_to_primary(user)
+        return response
+
+
+class QueryWatchMiddleware(object):
+    """ Reports repeated queries of each request per POS_QUERY_WATCH."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = settings.POS_QUERY_WATCH
+        if mode not in ('log', 'raise'):
+            return self.get_response(request)
+        with QueryWatcher() as watcher:
+            response = self.get_response(request)
+        watcher.check(mode, ' in {} {}'.format(request.method, request.path))
+        return response
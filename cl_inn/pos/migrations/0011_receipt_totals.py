@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_receipt_totals(apps, schema_editor):
+    """ Computes stored totals for receipts created before they existed."""
+    Receipt = apps.get_model('pos', 'Receipt')
+    Item = apps.get_model('pos', 'Item')
+
+    totals = {}
+    for receipt_id, price, discount in Item.objects.values_list('receipt_id', 'price', 'discount').iterator():
+        total, items_sum, item_count = totals.get(receipt_id, (0, 0, 0))
+        totals[receipt_id] = (total + price - discount*price, items_sum + price, item_count + 1)
+
+    for receipt_id, (total, items_sum, item_count) in totals.items():
+        Receipt.objects.filter(pk=receipt_id).update(
+            total=total,
+            items_sum=items_sum,
+            item_count=item_count
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0010_receipt_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receipt',
+            name='item_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='receipt',
+            name='items_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='receipt',
+            name='total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(fill_receipt_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0011_receipt_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales', to='pos.Item')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='item_sales', to='pos.Shop')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BestSeller',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(choices=[('hour', 'hour'), ('day', 'day'), ('month', 'month')], max_length=10)),
+                ('rank', models.IntegerField()),
+                ('quantity', models.IntegerField()),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='best_sellers', to='pos.Item')),
+                ('shop', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='best_sellers', to='pos.Shop')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='itemsales',
+            unique_together=set([('item', 'shop', 'hour')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='itemsales',
+            index_together=set([('hour', 'shop')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bestseller',
+            unique_together=set([('window', 'shop', 'rank')]),
+        ),
+    ]
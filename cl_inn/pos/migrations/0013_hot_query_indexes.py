@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0012_best_sellers'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='receipt',
+            index_together=set([('user', 'date', 'id'), ('shop', 'date')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='item',
+            index_together=set([('receipt', 'id', 'price', 'discount')]),
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX pos_item_low_stock ON pos_item (stock_amount, id) WHERE stock_amount <= 5;',
+            'DROP INDEX pos_item_low_stock;',
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0013_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='receipt',
+            name='date',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='ShopDailySales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('revenue', models.FloatField(default=0)),
+                ('receipt_count', models.IntegerField(default=0)),
+                ('item_count', models.IntegerField(default=0)),
+                ('average_basket', models.FloatField(default=0)),
+                ('discount_given', models.FloatField(default=0)),
+                ('refreshed_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='pos.Shop')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='shopdailysales',
+            unique_together=set([('shop', 'day')]),
+        ),
+    ]
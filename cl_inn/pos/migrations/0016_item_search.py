@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0015_receipt_modified_at'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunSQL(
+            'CREATE INDEX pos_item_code_search ON pos_item USING gin (lower(code) gin_trgm_ops);',
+            'DROP INDEX pos_item_code_search;',
+        ),
+        # Same expression as pos.search.Fold('name').
+        migrations.RunSQL(
+            "CREATE INDEX pos_item_name_search ON pos_item USING gin ("
+            "translate(lower(name), 'أإآىةـًٌٍَُِّْ', "
+            "'ااايه') gin_trgm_ops);",
+            'DROP INDEX pos_item_name_search;',
+        ),
+    ]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0016_item_search'),
+    ]
+
+    operations = [
+        migrations.RenameModel(
+            old_name='Item',
+            new_name='Product',
+        ),
+        migrations.RunSQL(
+            'ALTER INDEX pos_item_low_stock RENAME TO pos_product_low_stock;'
+            'ALTER INDEX pos_item_code_search RENAME TO pos_product_code_search;'
+            'ALTER INDEX pos_item_name_search RENAME TO pos_product_name_search;',
+            'ALTER INDEX pos_product_low_stock RENAME TO pos_item_low_stock;'
+            'ALTER INDEX pos_product_code_search RENAME TO pos_item_code_search;'
+            'ALTER INDEX pos_product_name_search RENAME TO pos_item_name_search;',
+        ),
+        migrations.CreateModel(
+            name='ReceiptLine',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(default=1, validators=[django.core.validators.MinValueValidator(1, 'Quantity should be at least 1!')])),
+                ('price', models.FloatField(validators=[django.core.validators.MinValueValidator(0, 'Price cannot be negative!')])),
+                ('discount', models.FloatField(default=0, validators=[django.core.validators.MinValueValidator(0, 'Price cannot be negative!'), django.core.validators.MaxValueValidator(1, 'Discount should be less than original price!')])),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='lines', to='pos.Product')),
+                ('receipt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='pos.Receipt')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='receiptline',
+            index_together=set([('receipt', 'id')]),
+        ),
+        # Every item becomes a line of one unit on its receipt, both keeping the item id.
+        # Foreign keys are checked right away, so no trigger events stay pending for the ALTERs below.
+        migrations.RunSQL(
+            'SET CONSTRAINTS ALL IMMEDIATE;'
+            'INSERT INTO pos_receiptline (id, receipt_id, product_id, quantity, price, discount) '
+            'SELECT id, receipt_id, id, 1, price, discount FROM pos_product;'
+            "SELECT setval(pg_get_serial_sequence('pos_receiptline', 'id'), COALESCE(MAX(id), 0) + 1, false) "
+            'FROM pos_receiptline;',
+        ),
+        migrations.AlterIndexTogether(
+            name='product',
+            index_together=set([]),
+        ),
+        migrations.RemoveField(
+            model_name='product',
+            name='receipt',
+        ),
+    ]
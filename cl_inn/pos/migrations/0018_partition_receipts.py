@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+from pos import partitions
+
+
+def partition_receipts(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        # Foreign keys are checked right away, so no trigger events stay pending for sealing ALTERs.
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        partitions.move_rows(cursor)
+    partitions.ensure()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0017_product_receipt_lines'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receipt',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='receiptline',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='receiptline',
+            name='receipt',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='pos.Receipt'),
+        ),
+        # The last save is the closest known creation time of existing receipts.
+        migrations.RunSQL(
+            'UPDATE pos_receipt SET created_at = date;'
+            'UPDATE pos_receiptline SET created_at = pos_receipt.created_at '
+            'FROM pos_receipt WHERE pos_receipt.id = pos_receiptline.receipt_id;',
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunPython(partition_receipts),
+    ]
@@ -1,8 +1,28 @@
-from django.db import models
+from collections import OrderedDict
+from datetime import datetime, time, timedelta
+
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Greatest, Lower
 from django.conf import settings 
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 from pos import validators as custom_validators
+from pos import cache as pos_cache
+from pos import search
+
+
+
+class OutOfStock(Exception):
+    """ Raised by Product.take_stock with the products short of stock."""
 
+    def __init__(self, lines):
+        super().__init__('Not enough stock for {} product(s).'.format(len(lines)))
+        self.lines = lines
+
+
+class AlreadyPaid(Exception):
+    """ Raised by Receipt.add_line on a receipt that was paid, its lines are final."""
 
 
 # Create your models here.
@@ -26,7 +46,9 @@ class Receipt(models.Model):
         max_length=255,
         validators=[custom_validators.GeneralCMSValidator.name_validator]
     )
-    date = models.DateTimeField(auto_now=True)
+    date = models.DateTimeField(auto_now=True, db_index=True)
+    # Never changes, receipts are partitioned by its month (see pos.partitions).
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     paid_amount = models.FloatField(
         validators=[MinValueValidator(0, paid_msg)],
         default=0
@@ -44,57 +66,128 @@ class Receipt(models.Model):
     )
     cashier = models.IntegerField(default=-1) # Can be updated in future.
 
+    # Changes on every save and totals shift, validates cached copies.
+    modified_at = models.DateTimeField(auto_now=True)
+
+    # Stored totals, maintained by lines on save/delete.
+    total = models.FloatField(default=0)
+    items_sum = models.FloatField(default=0)
+    item_count = models.IntegerField(default=0)
+
+    totals_fields = ('total', 'items_sum', 'item_count')
+
+    class Meta:
+        # Receipts of a user/shop in date order, (date, id) is the list keyset.
+        index_together = [
+            ('user', 'date', 'id'),
+            ('shop', 'date'),
+        ]
+
     # Methods
     @property
     def total_amount(self):
-        """ Sums all total prices of associated items."""
-        items = Item.objects.filter(receipt=self)
-        result = 0
-        for item in items:
-            result += item.total_price
+        """ Returns the stored sum of total prices of associated lines."""
+        self.refresh_from_db(fields=self.totals_fields)
+        return self.total
 
-        return result
+    @classmethod
+    def add_to_totals(cls, receipt_id, total=0, items_sum=0, item_count=0):
+        """ Shifts stored totals of given receipt by given deltas in place."""
+        cls.objects.filter(pk=receipt_id).update(
+            total=models.F('total') + total,
+            items_sum=models.F('items_sum') + items_sum,
+            item_count=models.F('item_count') + item_count,
+            modified_at=timezone.now()
+        )
 
     def pay_receipt(self, sum, change=False):
         """ Marks receipts as paid."""
+        total = self.total_amount
         if not change:
-            if (not self.paid_amount) and (sum == self.total_amount):
+            if (not self.paid_amount) and (sum == total):
                 self.paid_amount = float(sum)
-                self.save()
-                return True
+                return self.checkout()
         else:
-            if (not self.paid_amount) and (sum >= self.total_amount):
+            if (not self.paid_amount) and (sum >= total):
                 self.paid_amount = float(sum)
-                self.change = sum - self.total_amount
-                self.save()
-                return True
+                self.change = sum - total
+                return self.checkout()
         return False
 
-    def get_avg(self):
-        """ Returns the average of receipts items."""
-
-        # Annotate the total price for each item, calculate the avg.
-        items_avg = Item.objects.filter(
-            receipt=self
-        ).annotate(
-            total=models.F('price') - (models.F('discount')*models.F('price'))
-        ).aggregate(
-            target=models.Avg('total')
+    def add_line(self, product, quantity=1):
+        """ Adds quantity of product at its current catalog price and discount.
+
+        Raises AlreadyPaid if the receipt was paid: checkout took its stock
+        and counted its sales already. The receipt stays locked until the
+        commit, so a concurrent checkout counts the new line.
+        """
+        with transaction.atomic():
+            paid = Receipt.objects.select_for_update().filter(pk=self.pk).values_list('paid_amount', flat=True)
+            if (paid.first() or 0) > 0:
+                raise AlreadyPaid('Receipt #{} is already paid.'.format(self.pk))
+            return ReceiptLine.objects.create(
+                receipt=self, product=product, quantity=quantity, price=product.price, discount=product.discount,
+                created_at=self.created_at
+            )
+
+    def sold_quantities(self):
+        """ Returns {product id: quantity} over the lines of the receipt."""
+        return dict(
+            ReceiptLine.objects.filter(receipt=self).values('product').annotate(
+                sold=models.Sum('quantity')
+            ).order_by().values_list('product', 'sold')
         )
-        
-        return items_avg['target'] or 0
+
+    def checkout(self):
+        """ Saves payment, counts receipt lines as sold and takes them from stock.
+
+        Returns False if the receipt was paid meanwhile. Raises OutOfStock,
+        with nothing saved, if lines ask for more than is in stock. Stock is
+        taken last, so hot products stay locked only until the commit.
+        """
+        try:
+            with transaction.atomic():
+                paid = Receipt.objects.select_for_update().filter(pk=self.pk).values_list('paid_amount', flat=True)
+                if paid.first():
+                    return False
+                self.save()
+                sold = self.sold_quantities()
+                ItemSales.record_receipt(self, sold)
+                Product.take_stock(sold)
+        except OutOfStock:
+            self.refresh_from_db(fields=['paid_amount', 'change'])
+            raise
+        return True
+
+    def get_avg(self):
+        """ Returns the average price of units sold on the receipt."""
+        self.refresh_from_db(fields=self.totals_fields)
+        if not self.item_count:
+            return 0
+        return self.total / self.item_count
+
+    def save(self, *args, **kwargs):
+        """ Keeps stored totals out of regular updates, lines own them."""
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.totals_fields
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
 
         return 'Receipt #'+ str(self.id) +' of '+self.user.username
 
 
-class Item(models.Model):
+class Product(models.Model):
+    """ Catalog entry sold on receipts through ReceiptLine."""
 
     # Helpers
     price_msg = 'Price cannot be negative!'
     stock_amount_msg = 'Stock is empty!'
     discount_msg = 'Discount should be less than original price!'
+    low_stock_amount = 5 # Matches the pos_product_low_stock partial index.
 
     # Attributes
     code = models.CharField(max_length=255, unique=True)
@@ -116,36 +209,380 @@ class Item(models.Model):
         validators=[MinValueValidator(0, stock_amount_msg)],
         default=0
     )
-    receipt = models.ForeignKey(
-        'Receipt',
-        related_name='items',
-        on_delete=models.CASCADE
-    )
 
     # Methods 
     @classmethod
-    def get_most_sold(cls):
-        """ Returns the most sold item."""
-        target_amount = Item.objects.aggregate(target=models.Min('stock_amount'))
-        items = Item.objects.filter(stock_amount=target_amount['target'])
-        return items
+    def get_most_sold(cls, window='day', shop=None):
+        """ Returns best selling products of window (and shop), best first."""
+        # One filter() call, so window, shop and rank share a single join of the leaderboard.
+        by_shop = {'best_sellers__shop__isnull': True} if shop is None else {'best_sellers__shop': shop}
+        return Product.objects.filter(best_sellers__window=window, **by_shop).order_by('best_sellers__rank')
+
+    @classmethod
+    def get_low_stock(cls):
+        """ Returns products running out of stock, emptiest first."""
+        return Product.objects.filter(stock_amount__lte=cls.low_stock_amount).order_by('stock_amount', 'id')
+
+    @classmethod
+    def search(cls, query):
+        """ Returns products whose code or name matches query, best match first.
+
+        Codes and names containing the query or similar to it by pg_trgm match,
+        both served by the trigram indexes of migration 0016; short queries
+        only match as prefixes. An exact code ranks first, then prefixes, then
+        the closest trigram similarity.
+        """
+        term = search.fold(query)
+        products = Product.objects.annotate(search_code=Lower('code'), search_name=search.Fold('name'))
+        prefix = models.Q(search_code__startswith=term) | models.Q(search_name__startswith=term)
+        if len(term) < search.MIN_TRIGRAM_LENGTH:
+            matches = prefix
+        else:
+            matches = (
+                models.Q(search_code__contains=term) | models.Q(search_name__contains=term) |
+                models.Q(search_code__trigram_similar=term) | models.Q(search_name__trigram_similar=term)
+            )
+        rank = models.Case(
+            models.When(search_code=term, then=models.Value(2)),
+            models.When(prefix, then=models.Value(1)),
+            default=models.Value(0),
+            output_field=models.IntegerField()
+        )
+        similarity = Greatest(
+            TrigramSimilarity(Lower('code'), term), TrigramSimilarity(search.Fold('name'), term)
+        )
+        return products.filter(matches).order_by(rank.desc(), similarity.desc(), 'id')
 
     @property
     def total_price(self):
         """ Returns the calculated total price after discount."""
         return self.price - (self.discount*self.price)
 
+    @classmethod
+    def take_stock(cls, quantities):
+        """ Takes {product id: quantity} from stock, all or nothing.
+
+        Rows are locked in pk order, so checkouts sharing products queue up
+        instead of deadlocking, then decreased by one conditional UPDATE.
+        Raises OutOfStock listing every product short of stock.
+        """
+        if not quantities:
+            return
+        wanted = models.Case(
+            *[models.When(pk=pk, then=models.Value(quantity)) for pk, quantity in quantities.items()],
+            output_field=models.IntegerField()
+        )
+        with transaction.atomic():
+            rows = list(cls.objects.select_for_update().filter(pk__in=quantities).order_by('pk').values_list(
+                'pk', 'code', 'stock_amount'
+            ))
+            taken = cls.objects.filter(pk__in=quantities, stock_amount__gte=wanted).update(
+                stock_amount=models.F('stock_amount') - wanted
+            )
+            if taken < len(quantities):
+                raise OutOfStock([
+                    OrderedDict([('product', pk), ('code', code), ('requested', quantities[pk]), ('available', stock)])
+                    for pk, code, stock in rows if stock < quantities[pk]
+                ])
+        pos_cache.items.invalidate(*quantities)
+        pos_cache.touch('items')
+
     def decrease_stock(self, i=1):
-        """ Decreases the item stock by i items."""
-        if i <= self.stock_amount:
-            self.stock_amount -= int(i)
+        """ Takes i items from stock with one conditional UPDATE, returns if there were enough."""
+        taken = Product.objects.filter(pk=self.pk, stock_amount__gte=int(i)).update(
+            stock_amount=models.F('stock_amount') - int(i)
+        )
+        self.refresh_from_db(fields=['stock_amount'])
+        pos_cache.items.invalidate(self.pk)
+        pos_cache.touch('items')
+        return bool(taken)
 
     def set_stock_amount(self, amount=0):
         """ Set stock amount to given amount."""
-        self.stock_amount = int(amount) if int(amount) >= 0 else self.stock_amount
-        self.save()
+        if int(amount) >= 0:
+            self.stock_amount = int(amount)
+            self.save(update_fields=['stock_amount'])
 
     def __str__(self):
-        return self.name +'@'+self.receipt.name
+        return self.name
+
+
+class ReceiptLine(models.Model):
+    """ Quantity of a product sold on a receipt, priced when it was added.
 
+    Lines are append-only: price and discount are copied from the catalog,
+    so later catalog changes leave past receipts as they were.
+    """
 
+    # Helpers
+    quantity_msg = 'Quantity should be at least 1!'
+
+    # Attributes
+    # Receipts live in partitions, which no database foreign key can reference.
+    receipt = models.ForeignKey(
+        'Receipt',
+        related_name='lines',
+        on_delete=models.CASCADE,
+        db_constraint=False
+    )
+    product = models.ForeignKey(
+        'Product',
+        related_name='lines',
+        on_delete=models.PROTECT
+    )
+    quantity = models.IntegerField(
+        validators=[MinValueValidator(1, quantity_msg)],
+        default=1
+    )
+    price = models.FloatField(
+        validators=[MinValueValidator(0, Product.price_msg)]
+    )
+    discount = models.FloatField(
+        validators=[
+            MinValueValidator(0, Product.price_msg),
+            MaxValueValidator(1, Product.discount_msg)
+        ],
+        default=0
+    )
+    # Creation time of the receipt, so lines share the partition of its month.
+    created_at = models.DateTimeField(editable=False)
+
+    class Meta:
+        # Lines of a receipt in id order.
+        index_together = [
+            ('receipt', 'id'),
+        ]
+
+    # Methods 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """ Remembers loaded line so totals can be shifted by difference."""
+        instance = super().from_db(db, field_names, values)
+        if {'receipt_id', 'quantity', 'price', 'discount'} <= set(instance.__dict__):
+            instance._synced_line = instance.line_totals()
+        return instance
+
+    @property
+    def total_price(self):
+        """ Returns the calculated total price of the line after discount."""
+        return self.quantity * (self.price - (self.discount*self.price))
+
+    def line_totals(self):
+        """ Returns (receipt_id, total price, price, quantity) this line adds to its receipt."""
+        return (self.receipt_id, self.total_price, self.quantity * self.price, self.quantity)
+
+    def sync_receipt_totals(self, deleted=False):
+        """ Applies this line's change to the stored totals of its receipt."""
+        old = getattr(self, '_synced_line', None)
+        new = None if deleted else self.line_totals()
+
+        if old == new:
+            return
+        if old and new and old[0] == new[0]:
+            Receipt.add_to_totals(new[0], *[n - o for n, o in zip(new[1:], old[1:])])
+        else:
+            if old:
+                Receipt.add_to_totals(old[0], *[-value for value in old[1:]])
+            if new:
+                Receipt.add_to_totals(*new)
+        self._synced_line = new
+
+    def save(self, *args, **kwargs):
+        """ Saves line and its receipt totals in the same transaction."""
+        if self.created_at is None:
+            self.created_at = self.receipt.created_at
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.product.name +'@'+self.receipt.name
+
+
+class ItemSales(models.Model):
+    """ Units of a product sold by a shop within one hour."""
+
+    # Attributes
+    item = models.ForeignKey(
+        'Product',
+        related_name='sales',
+        on_delete=models.CASCADE
+    )
+    shop = models.ForeignKey(
+        'Shop',
+        related_name='item_sales',
+        on_delete=models.CASCADE
+    )
+    hour = models.DateTimeField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('item', 'shop', 'hour')
+        index_together = ('hour', 'shop')
+
+    # Methods
+    @staticmethod
+    def truncate_hour(date):
+        return date.replace(minute=0, second=0, microsecond=0)
+
+    @classmethod
+    def record_receipt(cls, receipt, sold):
+        """ Adds sold {product id: quantity} of a paid receipt to the current hour.
+
+        Counters already present are incremented in place, the missing ones
+        inserted. A counter inserted meanwhile by another checkout fails the
+        insert, which is then retried once against it.
+        """
+        hour = cls.truncate_hour(receipt.date or timezone.now())
+        if not sold:
+            return
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    counters = cls.objects.filter(shop_id=receipt.shop_id, hour=hour, item__in=sold)
+                    counted = set(counters.select_for_update().order_by('item').values_list('item', flat=True))
+                    if counted:
+                        counters.filter(item__in=counted).update(quantity=models.F('quantity') + models.Case(
+                            *[models.When(item=item_id, then=models.Value(sold[item_id])) for item_id in counted],
+                            default=models.Value(0),
+                            output_field=models.IntegerField()
+                        ))
+                    cls.objects.bulk_create([
+                        cls(item_id=item_id, shop_id=receipt.shop_id, hour=hour, quantity=quantity)
+                        for item_id, quantity in sorted(sold.items()) if item_id not in counted
+                    ])
+                return
+            except IntegrityError:
+                if attempt:
+                    raise
+
+
+class BestSeller(models.Model):
+    """ Materialized rank of a best selling product in a window, per shop or overall."""
+
+    WINDOWS = OrderedDict([
+        ('hour', timedelta(hours=1)),
+        ('day', timedelta(days=1)),
+        ('month', timedelta(days=30)),
+    ])
+
+    # Attributes
+    window = models.CharField(max_length=10, choices=[(window, window) for window in WINDOWS])
+    shop = models.ForeignKey(
+        'Shop',
+        related_name='best_sellers',
+        on_delete=models.CASCADE,
+        null=True
+    )
+    rank = models.IntegerField()
+    item = models.ForeignKey(
+        'Product',
+        related_name='best_sellers',
+        on_delete=models.CASCADE
+    )
+    quantity = models.IntegerField()
+
+    class Meta:
+        unique_together = ('window', 'shop', 'rank')
+
+    # Methods
+    @classmethod
+    def top_items(cls, sales):
+        """ Returns (product id, quantity) of the best selling products in sales."""
+        return sales.values('item').annotate(
+            sold=models.Sum('quantity')
+        ).order_by('-sold', 'item').values_list('item', 'sold')[:settings.POS_BEST_SELLERS_SIZE]
+
+    @classmethod
+    def refresh(cls, now=None):
+        """ Recomputes every window's leaderboard from hourly product sales."""
+        now = now or timezone.now()
+        for window, length in cls.WINDOWS.items():
+            sales = ItemSales.objects.filter(hour__gte=ItemSales.truncate_hour(now - length))
+            ranks = [
+                cls(window=window, shop=None, rank=rank, item_id=item_id, quantity=sold)
+                for rank, (item_id, sold) in enumerate(cls.top_items(sales), 1)
+            ]
+            shop_ids = sales.order_by().values_list('shop', flat=True).distinct()
+            for shop_id in shop_ids:
+                ranks.extend(
+                    cls(window=window, shop_id=shop_id, rank=rank, item_id=item_id, quantity=sold)
+                    for rank, (item_id, sold) in enumerate(cls.top_items(sales.filter(shop=shop_id)), 1)
+                )
+
+            with transaction.atomic():
+                cls.objects.filter(window=window).delete()
+                cls.objects.bulk_create(ranks)
+        pos_cache.touch('best_sellers')
+
+
+class ShopDailySales(models.Model):
+    """ Paid receipts of a shop rolled up per day, built from stored receipt totals."""
+
+    # Attributes
+    shop = models.ForeignKey(
+        'Shop',
+        related_name='daily_sales',
+        on_delete=models.CASCADE
+    )
+    day = models.DateField()
+    revenue = models.FloatField(default=0)
+    receipt_count = models.IntegerField(default=0)
+    item_count = models.IntegerField(default=0)
+    average_basket = models.FloatField(default=0)
+    discount_given = models.FloatField(default=0)
+    refreshed_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    refresh_overlap = timedelta(minutes=5)
+
+    class Meta:
+        unique_together = ('shop', 'day')
+
+    # Methods
+    @classmethod
+    def refresh_day(cls, day):
+        """ Recomputes rollups of every shop for one day."""
+        start = timezone.make_aware(datetime.combine(day, time.min), timezone.utc)
+        rows = Receipt.objects.filter(
+            date__gte=start,
+            date__lt=start + timedelta(days=1),
+            paid_amount__gt=0
+        ).values('shop').annotate(
+            revenue=models.Sum('total'),
+            receipt_count=models.Count('id'),
+            item_count=models.Sum('item_count'),
+            items_sum=models.Sum('items_sum')
+        ).order_by()
+
+        with transaction.atomic():
+            cls.objects.filter(day=day).delete()
+            cls.objects.bulk_create([
+                cls(
+                    shop_id=row['shop'],
+                    day=day,
+                    revenue=row['revenue'],
+                    receipt_count=row['receipt_count'],
+                    item_count=row['item_count'],
+                    average_basket=row['revenue'] / row['receipt_count'],
+                    discount_given=row['items_sum'] - row['revenue']
+                ) for row in rows
+            ])
+
+    @classmethod
+    def refresh(cls, since=None):
+        """ Recomputes the days with receipts saved since the last refresh.
+
+        Returns the refreshed days. Without any previous refresh only the
+        last day is considered; older days are filled in by the
+        rebuild_shop_daily_sales command.
+        """
+        if since is None:
+            last = cls.objects.aggregate(last=models.Max('refreshed_at'))['last']
+            # Overlap the last run to catch receipts saved while it ran.
+            since = last - cls.refresh_overlap if last else timezone.now() - timedelta(days=1)
+        days = sorted(
+            date.astimezone(timezone.utc).date()
+            for date in Receipt.objects.filter(date__gte=since).datetimes('date', 'day', tzinfo=timezone.utc)
+        )
+        for day in days:
+            cls.refresh_day(day)
+        return days
@@ -0,0 +1,105 @@
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
+
+
+def row_value(row, field):
+    """ Reads field of a model instance or a `.values()` row."""
+    return row[field] if isinstance(row, dict) else getattr(row, field)
+
+
+class KeysetPagination(object):
+    """ Pages a queryset on a unique ordering by filtering past the last row seen.
+
+    Unlike offset pagination, every page costs the same index range scan no
+    matter how deep it is. The next page is advertised in a `Link` header so
+    the response body keeps its plain list shape.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor.'
+
+    def __init__(self, ordering):
+        self.ordering = ordering
+        self.fields = [field.lstrip('-') for field in ordering]
+        self.next_position = None
+
+    def get_page_size(self, request):
+        """ Returns requested page size bounded by POS_MAX_PAGE_SIZE."""
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.POS_PAGE_SIZE
+        return max(1, min(page_size, settings.POS_MAX_PAGE_SIZE))
+
+    def encode_cursor(self, position):
+        values = [value.isoformat() if isinstance(value, datetime) else value for value in position]
+        return base64.urlsafe_b64encode(json.dumps(values).encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor is None:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii'))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.fields):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def clean_position(self, position, model):
+        """ Converts cursor values to the ordering fields of model, NotFound if one does not fit."""
+        cleaned = []
+        for field, value in zip(self.fields, position):
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                cleaned.append(model._meta.get_field(field).to_python(value))
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        return cleaned
+
+    def position_filter(self, position):
+        """ Builds `(f1, f2, ..) after (v1, v2, ..)` in the page ordering."""
+        condition = Q()
+        for i, ordering in enumerate(self.ordering):
+            lookup = 'lt' if ordering.startswith('-') else 'gt'
+            step = Q(**{'{}__{}'.format(self.fields[i], lookup): position[i]})
+            for field, value in zip(self.fields[:i], position[:i]):
+                step &= Q(**{field: value})
+            condition |= step
+        return condition
+
+    def paginate_queryset(self, queryset, request):
+        """ Returns rows of the requested page, remembering where it ended."""
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            position = self.clean_position(position, queryset.model)
+            queryset = queryset.filter(self.position_filter(position))
+
+        rows = list(queryset[:page_size + 1])
+        page = rows[:page_size]
+        if len(rows) > page_size:
+            self.next_position = [row_value(page[-1], field) for field in self.fields]
+        return page
+
+    def get_next_link(self, request):
+        if self.next_position is None:
+            return None
+        url = request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_headers(self, request):
+        next_link = self.get_next_link(request)
+        return {'Link': '<{}>; rel="next"'.format(next_link)} if next_link else {}
@@ -0,0 +1,200 @@
+""" Monthly partitions of receipts and their lines.
+
+Postgres 9.3 has no declarative partitioning, so every month of pos_receipt
+and pos_receiptline is a child table inheriting from it, such as
+pos_receipt_201710, with a CHECK on the UTC month of created_at. Queries on
+the parents read their children too. Rows are still inserted into the
+parent, so Django gets their ids back through RETURNING, and an AFTER INSERT
+trigger moves each of them to the child of its month. Rows of a month
+without a child stay in the parent.
+
+created_at never changes: an UPDATE moving a row to another month fails the
+CHECK of its child.
+
+Lookups by id carry no created_at for the planner to skip children with.
+Once a month is over, its children are sealed with a CHECK on the range of
+receipt ids they hold, so constraint exclusion skips them in lookups of
+receipts by id and of lines by receipt, and checkout only touches the
+current months.
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+# Partitioned tables with the column holding their receipt id.
+TABLES = (('pos_receipt', 'id'), ('pos_receiptline', 'receipt_id'))
+# How long after its end a month is sealed, for receipts created just before.
+SEAL_DELAY = timedelta(days=1)
+# Longest wait for the table locks of sealing and detaching partitions.
+LOCK_TIMEOUT = '5s'
+
+ROUTE = '''
+    IF NEW.created_at >= '{start}' AND NEW.created_at < '{end}' THEN
+        INSERT INTO {partition} VALUES (NEW.*);
+        DELETE FROM ONLY {table} WHERE id = NEW.id;
+        RETURN NULL;
+    END IF;'''
+
+ROUTER = '''
+CREATE OR REPLACE FUNCTION {table}_route() RETURNS trigger AS $$
+BEGIN{routes}
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql'''
+
+
+def month_of(moment):
+    """ Returns the start of the UTC month of moment."""
+    moment = moment.astimezone(timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(table, month):
+    return '{}_{:%Y%m}'.format(table, month)
+
+
+def partitions(cursor, table):
+    """ Returns [(month, partition)] of table, oldest first."""
+    cursor.execute(
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+        'WHERE pg_inherits.inhparent = %s::regclass ORDER BY child.relname',
+        [table]
+    )
+    return [
+        (datetime.strptime(name[-6:], '%Y%m').replace(tzinfo=timezone.utc), name)
+        for name, in cursor.fetchall()
+    ]
+
+
+def create_partition(cursor, table, month):
+    """ Creates the partition of table for month, with the indexes and foreign keys of table."""
+    name = partition_name(table, month)
+    cursor.execute(
+        'CREATE TABLE {} (LIKE {} INCLUDING ALL, CHECK (created_at >= %s AND created_at < %s)) '
+        'INHERITS ({})'.format(name, table, table),
+        [month, add_months(month, 1)]
+    )
+    cursor.execute(
+        "SELECT pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table]
+    )
+    for definition, in cursor.fetchall():
+        cursor.execute('ALTER TABLE {} ADD {}'.format(name, definition))
+    return name
+
+
+def install_router(cursor, table):
+    """ Routes rows inserted into table to the partitions it has now."""
+    routes = ''.join(
+        ROUTE.format(start=month.isoformat(), end=add_months(month, 1).isoformat(), partition=name, table=table)
+        for month, name in reversed(partitions(cursor, table))
+    )
+    cursor.execute(ROUTER.format(table=table, routes=routes))
+    cursor.execute('SELECT 1 FROM pg_trigger WHERE tgname = %s AND tgrelid = %s::regclass', [table + '_route', table])
+    if cursor.fetchone() is None:
+        cursor.execute(
+            'CREATE TRIGGER {0}_route AFTER INSERT ON {0} FOR EACH ROW EXECUTE PROCEDURE {0}_route()'.format(table)
+        )
+
+
+def create_partitions(cursor, months):
+    """ Creates missing partitions of every table for months, returns their names."""
+    created = []
+    for table, _ in TABLES:
+        existing = {month for month, _ in partitions(cursor, table)}
+        for month in sorted(set(months) - existing):
+            created.append(create_partition(cursor, table, month))
+        install_router(cursor, table)
+    return created
+
+
+def move_rows(cursor):
+    """ Moves rows kept in the parent tables to partitions of their months."""
+    months = set()
+    for table, _ in TABLES:
+        cursor.execute(
+            "SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC') FROM ONLY {}".format(table)
+        )
+        months.update(month.replace(tzinfo=timezone.utc) for month, in cursor.fetchall())
+    create_partitions(cursor, months)
+    for table, _ in TABLES:
+        for month in months:
+            bounds = [month, add_months(month, 1)]
+            cursor.execute(
+                'INSERT INTO {} SELECT * FROM ONLY {} WHERE created_at >= %s AND created_at < %s'.format(
+                    partition_name(table, month), table
+                ),
+                bounds
+            )
+            cursor.execute('DELETE FROM ONLY {} WHERE created_at >= %s AND created_at < %s'.format(table), bounds)
+
+
+def is_sealed(cursor, name):
+    cursor.execute('SELECT 1 FROM pg_constraint WHERE conname = %s', [name + '_sealed'])
+    return cursor.fetchone() is not None
+
+
+def seal(cursor, month):
+    """ Bounds the receipt ids of both partitions of a month that is over.
+
+    Lines are bounded by the ids of the month's receipts, so lines added
+    later to those receipts still fit.
+    """
+    receipts = partition_name('pos_receipt', month)
+    cursor.execute("SET LOCAL lock_timeout = '{}'".format(LOCK_TIMEOUT))
+    # Deferred foreign key checks of rows inserted earlier in the transaction would block the ALTERs.
+    cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    cursor.execute('SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM ONLY {}'.format(receipts))
+    bounds = cursor.fetchone()
+    for table, column in TABLES:
+        name = partition_name(table, month)
+        cursor.execute(
+            'ALTER TABLE {0} ADD CONSTRAINT {0}_sealed CHECK ({1} BETWEEN %s AND %s)'.format(name, column),
+            bounds
+        )
+
+
+def ensure(now=None):
+    """ Creates partitions up to POS_PARTITIONS_AHEAD months ahead and seals months that are over.
+
+    Returns names of the partitions created.
+    """
+    now = now or timezone.now()
+    current = month_of(now)
+    with transaction.atomic(), connection.cursor() as cursor:
+        months = [add_months(current, count) for count in range(settings.POS_PARTITIONS_AHEAD + 1)]
+        created = create_partitions(cursor, months)
+        closed = [
+            month for month, name in partitions(cursor, 'pos_receipt')
+            if add_months(month, 1) + SEAL_DELAY <= now and not is_sealed(cursor, name)
+        ]
+    for month in closed:
+        with transaction.atomic(), connection.cursor() as cursor:
+            seal(cursor, month)
+    return created
+
+
+def detach(cursor, month, schema):
+    """ Moves both partitions of month out of the parent tables into schema.
+
+    Returns the archived table names, lines first.
+    """
+    cursor.execute("SET LOCAL lock_timeout = '{}'".format(LOCK_TIMEOUT))
+    cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    cursor.execute('CREATE SCHEMA IF NOT EXISTS {}'.format(schema))
+    archived = []
+    for table, _ in reversed(TABLES):
+        name = partition_name(table, month)
+        cursor.execute('ALTER TABLE {} NO INHERIT {}'.format(name, table))
+        cursor.execute('ALTER TABLE {} SET SCHEMA {}'.format(name, schema))
+        install_router(cursor, table)
+        archived.append('{}.{}'.format(schema, name))
+    return archived
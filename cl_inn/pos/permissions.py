@@ -0,0 +1,44 @@
+import ipaddress
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from rest_framework.permissions import BasePermission
+
+
+def bearer_token(request):
+    """ Returns the token of an `Authorization: Bearer <token>` header, None without one."""
+    parts = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(parts) == 2 and parts[0].lower() == 'bearer':
+        return parts[1]
+    return None
+
+
+def is_allowed_address(address, networks):
+    """ Tells whether address is in one of networks, given as addresses or CIDR ranges."""
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    for network in networks:
+        try:
+            if address in ipaddress.ip_network(network, strict=False):
+                return True
+        except ValueError:
+            continue
+    return False
+
+
+class IsMetricsScraper(BasePermission):
+    """ Lets in scrapers sending POS_METRICS_TOKEN as a bearer token or
+    connecting from POS_METRICS_ALLOWED_IPS, and admin users.
+
+    Either check is off while its setting is empty.
+    """
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_staff:
+            return True
+        token = bearer_token(request)
+        if settings.POS_METRICS_TOKEN and token and constant_time_compare(token, settings.POS_METRICS_TOKEN):
+            return True
+        return is_allowed_address(request.META.get('REMOTE_ADDR', ''), settings.POS_METRICS_ALLOWED_IPS)
@@ -0,0 +1,113 @@
+""" Detection of N+1 and duplicate queries.
+
+QueryWatcher records every query run while it is active, with the innermost
+project frame that triggered it. Queries sharing the same SQL (parameters
+aside) at least POS_QUERY_WATCH_THRESHOLD times are reported, the usual sign
+of a per-row lookup such as a nested serializer or __str__ following a
+foreign key. pos.middleware.QueryWatchMiddleware watches each request when
+POS_QUERY_WATCH is 'log' or 'raise'.
+"""
+import logging
+import sys
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.utils import CursorDebugWrapper
+
+logger = logging.getLogger(__name__)
+
+# Transaction control repeats by design, savepoint names aside.
+IGNORED_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class RepeatedQueriesError(Exception):
+    pass
+
+
+def call_site():
+    """ Returns 'path:line in function' of the innermost project frame."""
+    root = str(settings.APPS_DIR)
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(root) and filename != __file__:
+            return '{}:{} in {}'.format(filename[len(root):].lstrip('/'), frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+    return 'outside the project'
+
+
+class WatchingCursorWrapper(CursorDebugWrapper):
+
+    def __init__(self, cursor, db, watcher):
+        super().__init__(cursor, db)
+        self.watcher = watcher
+
+    def execute(self, sql, params=None):
+        self.watcher.add(sql, params)
+        return super().execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.watcher.add(sql, None)
+        return super().executemany(sql, param_list)
+
+
+class QueryWatcher(object):
+    """ Context manager collecting queries of every connection of the thread."""
+
+    def __init__(self, threshold=None):
+        self.threshold = threshold or settings.POS_QUERY_WATCH_THRESHOLD
+        self.queries = OrderedDict()
+
+    def add(self, sql, params):
+        if sql.lstrip().upper().startswith(IGNORED_STATEMENTS):
+            return
+        runs = self.queries.setdefault(sql, {'params': Counter(), 'sites': Counter()})
+        runs['params'][repr(params)] += 1
+        runs['sites'][call_site()] += 1
+
+    def __enter__(self):
+        self.installed = []
+        for connection in connections.all():
+            self.installed.append(
+                (connection, connection.force_debug_cursor, connection.__dict__.get('make_debug_cursor'))
+            )
+            connection.force_debug_cursor = True
+            connection.make_debug_cursor = (
+                lambda cursor, connection=connection: WatchingCursorWrapper(cursor, connection, self)
+            )
+        return self
+
+    def __exit__(self, *exc_info):
+        for connection, forced, make_debug_cursor in self.installed:
+            connection.force_debug_cursor = forced
+            if make_debug_cursor is None:
+                del connection.make_debug_cursor
+            else:
+                connection.make_debug_cursor = make_debug_cursor
+
+    def repeated(self):
+        """ Returns [(sql, runs, distinct parameter sets, Counter of call sites)]."""
+        return [
+            (sql, sum(runs['params'].values()), len(runs['params']), runs['sites'])
+            for sql, runs in self.queries.items()
+            if sum(runs['params'].values()) >= self.threshold
+        ]
+
+    def report(self):
+        lines = []
+        for sql, count, distinct, sites in self.repeated():
+            kind = 'N+1 query' if distinct > 1 else 'Duplicate query'
+            lines.append('{} ran {} times ({} distinct parameter sets): {}'.format(kind, count, distinct, sql))
+            lines.extend('    {} x {}'.format(runs, site) for site, runs in sites.most_common())
+        return '\n'.join(lines)
+
+    def check(self, mode, context=''):
+        """ Logs or raises the report of repeated queries, if any."""
+        report = self.report()
+        if not report:
+            return
+        report = 'Repeated queries{}:\n{}'.format(context, report)
+        if mode == 'raise':
+            raise RepeatedQueriesError(report)
+        logger.warning(report)
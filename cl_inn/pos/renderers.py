@@ -0,0 +1,48 @@
+import csv
+import io
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class NDJSONRenderer(BaseRenderer):
+    """ Renders a list as newline delimited JSON, one object per line."""
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(render_ndjson_line(row) for row in rows).encode('utf-8')
+
+
+def render_ndjson_line(row):
+    return json.dumps(row, cls=JSONEncoder, ensure_ascii=False) + '\n'
+
+
+class CSVRenderer(BaseRenderer):
+    """ Renders a list of flat objects as CSV, keys of the first one as header."""
+
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        if not rows:
+            return b''
+        header = list(rows[0])
+        body = render_csv_rows([header]) + render_csv_rows([[row.get(key) for key in header] for row in rows])
+        return body.encode('utf-8')
+
+
+def render_csv_rows(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
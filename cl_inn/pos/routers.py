@@ -0,0 +1,127 @@
+""" Read replica routing.
+
+Reads go to the primary unless a view runs them inside replica_reads(), which
+the read_replica view decorator does for safe requests. A user who wrote in
+the last POS_REPLICA_PIN_SECONDS is pinned to the primary so they read their
+own writes, and replicas lagging more than POS_REPLICA_MAX_LAG seconds are
+skipped until they catch up.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.utils import ConnectionDoesNotExist
+
+from pos.cache import get_cache
+
+state = threading.local()
+
+# Replication lag in seconds of a standby, 0 on a database not in recovery
+# or one that replayed all it received.
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_xlog_receive_location() = pg_last_xlog_replay_location() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+# {alias: (checked at, lag or None when unreachable)}, per worker.
+lags = {}
+
+
+def replica_lag(alias):
+    """ Returns replication lag of alias in seconds, None if it cannot be read.
+
+    Measured at most once every POS_REPLICA_LAG_CHECK_INTERVAL seconds. An
+    alias missing from DATABASES is unreachable like a replica that is down.
+    """
+    checked_at, lag = lags.get(alias, (None, None))
+    now = time.time()
+    if checked_at is None or now - checked_at >= settings.POS_REPLICA_LAG_CHECK_INTERVAL:
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(LAG_SQL)
+                lag = float(cursor.fetchone()[0])
+        except (DatabaseError, ConnectionDoesNotExist):
+            lag = None
+        lags[alias] = (now, lag)
+    return lag
+
+
+def healthy_replicas():
+    """ Returns aliases of replicas close enough behind the primary."""
+    return [
+        alias for alias in settings.POS_REPLICAS
+        if replica_lag(alias) is not None and replica_lag(alias) <= settings.POS_REPLICA_MAX_LAG
+    ]
+
+
+def pin_key(user):
+    return 'pos:pinned:{}'.format(user.pk)
+
+
+def pin_to_primary(user):
+    """ Sends reads of user to the primary for POS_REPLICA_PIN_SECONDS."""
+    if settings.POS_REPLICAS and user.is_authenticated:
+        get_cache().set(pin_key(user), True, settings.POS_REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user):
+    return user.is_authenticated and get_cache().get(pin_key(user)) is not None
+
+
+@contextmanager
+def replica_reads(user):
+    """ Routes reads in the block to one healthy replica, if user may use it."""
+    previous = getattr(state, 'alias', None)
+    replicas = healthy_replicas() if settings.POS_REPLICAS and not is_pinned(user) else []
+    state.alias = random.choice(replicas) if replicas else previous
+    try:
+        yield state.alias
+    finally:
+        state.alias = previous
+
+
+def reading_replica():
+    """ Tells whether reads of this thread currently go to a replica."""
+    return getattr(state, 'alias', None) not in (None, DEFAULT_DB_ALIAS)
+
+
+def read_replica(view):
+    """ Serves GET and HEAD requests of view from a replica."""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        with replica_reads(request.user):
+            return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+class ReplicaRouter(object):
+    """ Sends reads in replica_reads() to replicas, everything else to default."""
+
+    def db_for_read(self, model, **hints):
+        return getattr(state, 'alias', None) or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Explicit, as objects read from a replica would be saved back to it.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS}.union(settings.POS_REPLICAS)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.POS_REPLICAS:
+            return False
+        return None
@@ -0,0 +1,29 @@
+""" Folding of product codes, names and search queries.
+
+Search compares folded text: lower case, with Arabic alef variants,
+alef maqsura and taa marbuta written as their plain letters and tatweel and
+harakat dropped, so spelling variants of a name still match. Fold emits the
+exact expression of the pos_product_name_search index (migration 0016,
+renamed by 0017); keep the two in step.
+"""
+from django.db.models import CharField, Func
+
+# Characters past the length of FOLD_TO are removed, as by SQL TRANSLATE.
+FOLD_FROM = 'أإآىةـًٌٍَُِّْ'
+FOLD_TO = 'ااايه'
+FOLD_TABLE = str.maketrans(FOLD_FROM[:len(FOLD_TO)], FOLD_TO, FOLD_FROM[len(FOLD_TO):])
+
+# Shorter queries have no trigram to look up, they only match as prefixes.
+MIN_TRIGRAM_LENGTH = 3
+
+
+def fold(text):
+    return text.lower().translate(FOLD_TABLE)
+
+
+class Fold(Func):
+    function = 'TRANSLATE'
+    template = "%(function)s(LOWER(%(expressions)s), '{}', '{}')".format(FOLD_FROM, FOLD_TO)
+
+    def __init__(self, expression, **extra):
+        super().__init__(expression, output_field=CharField(), **extra)
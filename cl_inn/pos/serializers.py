@@ -1,24 +1,133 @@
+from collections import OrderedDict
+
+from django.core.exceptions import ImproperlyConfigured
 from rest_framework import serializers
+from rest_framework.relations import PKOnlyObject, RelatedField
 from pos.models import *
+from pos.metrics import timed
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
-class UserSerializer(serializers.ModelSerializer):
+
+class EagerLoadingMixin(object):
+    """ Derives select/prefetch related lookups from declared nested serializers
+    and dotted field sources.
+    """
+
+    @classmethod
+    def get_related_lookups(cls, prefix=''):
+        """ Returns (select_related, prefetch_related) paths read by nested fields."""
+        select, prefetch = [], []
+        for name, field in cls._declared_fields.items():
+            if not isinstance(field, serializers.BaseSerializer):
+                if '.' in (field.source or ''):
+                    select.append(prefix + '__'.join(field.source.split('.')[:-1]))
+                continue
+            path = prefix + (field.source or name)
+            if isinstance(field, serializers.ListSerializer):
+                prefetch.append(path)
+                continue
+            select.append(path)
+            if isinstance(field, EagerLoadingMixin):
+                nested_select, nested_prefetch = field.get_related_lookups(path + '__')
+                select.extend(nested_select)
+                prefetch.extend(nested_prefetch)
+        return select, prefetch
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """ Fetches related rows of queryset up front instead of per row."""
+        select, prefetch = cls.get_related_lookups()
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+
+class TimedRepresentationMixin(object):
+    """ Counts representation time in the serialize phase of timed requests."""
+
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+class ValuesSerializer(object):
+    """ Read-only fast path rendering `.values()` rows with a ModelSerializer's fields.
+
+    Produces the same output as serializer_class(many=True).data, but reads
+    plain dicts straight from the database instead of building a model
+    instance per row and resolving every attribute through it. Dotted sources
+    such as 'product.code' are read through the joined 'product__code'.
+    """
+
+    def __init__(self, serializer_class):
+        self.plan = self.build_plan(serializer_class(), '')
+        self.lookups = list(self.plan_lookups(self.plan))
+
+    def build_plan(self, serializer, prefix):
+        plan = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if field.source == '*':
+                raise ImproperlyConfigured('{} cannot be read from values().'.format(name))
+            lookup = prefix + field.source.replace('.', '__')
+            if isinstance(field, serializers.BaseSerializer):
+                plan.append((name, lookup, field, self.build_plan(field, lookup + '__')))
+            else:
+                plan.append((name, lookup, field, None))
+        return plan
+
+    def plan_lookups(self, plan):
+        for name, lookup, field, nested in plan:
+            if nested is None:
+                yield lookup
+            else:
+                yield lookup
+                for nested_lookup in self.plan_lookups(nested):
+                    yield nested_lookup
+
+    def values(self, queryset):
+        """ Returns queryset as dict rows holding every looked up value."""
+        return queryset.values(*self.lookups)
+
+    def represent_row(self, row, plan):
+        data = OrderedDict()
+        for name, lookup, field, nested in plan:
+            value = row[lookup]
+            if nested is not None:
+                data[name] = None if value is None else self.represent_row(row, nested)
+            elif value is None:
+                data[name] = None
+            elif isinstance(field, RelatedField):
+                data[name] = field.to_representation(PKOnlyObject(pk=value))
+            else:
+                data[name] = field.to_representation(value)
+        return data
+
+    def represent(self, rows):
+        with timed('serialize'):
+            return [self.represent_row(row, self.plan) for row in rows]
+
+
+class UserSerializer(TimedRepresentationMixin, EagerLoadingMixin, serializers.ModelSerializer):
     
     class Meta:
         model   = User
         fields  = ('id', 'username', 'email')
 
 
-class ShopSerializer(serializers.ModelSerializer):
+class ShopSerializer(TimedRepresentationMixin, EagerLoadingMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Shop
         fields = ('__all__')
 
 
-class ReceiptSerializer(serializers.ModelSerializer):
+class ReceiptSerializer(TimedRepresentationMixin, EagerLoadingMixin, serializers.ModelSerializer):
 
     shop = ShopSerializer(read_only=True)
     user = UserSerializer(read_only=True)
@@ -26,26 +135,131 @@ class ReceiptSerializer(serializers.ModelSerializer):
     class Meta:
         model = Receipt
         fields = ('__all__')
+        read_only_fields = Receipt.totals_fields
 
 
-class ReceiptPOSTSerializer(serializers.ModelSerializer):
+class ReceiptPOSTSerializer(TimedRepresentationMixin, EagerLoadingMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Receipt
         fields = ('__all__')
+        read_only_fields = Receipt.totals_fields
 
 
-class ItemSerializer(serializers.ModelSerializer):
-
-    receipt = ReceiptPOSTSerializer(read_only=True)
+class ProductSerializer(TimedRepresentationMixin, EagerLoadingMixin, serializers.ModelSerializer):
 
     class Meta:
-        model = Item
+        model = Product
         fields = ('__all__')
-        
 
-class ItemPOSTSerializer(serializers.ModelSerializer):
+
+class ReceiptLineSerializer(TimedRepresentationMixin, EagerLoadingMixin, serializers.ModelSerializer):
+
+    code = serializers.CharField(source='product.code', read_only=True)
+    name = serializers.CharField(source='product.name', read_only=True)
 
     class Meta:
-        model = Item
-        fields = ('__all__')
\ No newline at end of file
+        model = ReceiptLine
+        fields = ('id', 'receipt', 'product', 'code', 'name', 'quantity', 'price', 'discount')
+
+
+class ReceiptLinePOSTSerializer(TimedRepresentationMixin, serializers.Serializer):
+    """ Adds a line to a receipt by product id, or by code creating a missing product."""
+
+    receipt = serializers.PrimaryKeyRelatedField(queryset=Receipt.objects.all())
+    product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), required=False)
+    code = serializers.CharField(max_length=255, required=False)
+    name = serializers.CharField(
+        max_length=255,
+        required=False,
+        validators=Product._meta.get_field('name').validators
+    )
+    price = serializers.FloatField(required=False, validators=Product._meta.get_field('price').validators)
+    discount = serializers.FloatField(required=False, validators=Product._meta.get_field('discount').validators)
+    quantity = serializers.IntegerField(default=1, validators=ReceiptLine._meta.get_field('quantity').validators)
+
+    new_product_fields = ('name', 'price')
+    paid_receipt_msg = 'Receipt is already paid, no items can be added to it.'
+
+    def validate(self, data):
+        if ('product' in data) == ('code' in data):
+            raise serializers.ValidationError('Give either product or code of the item.')
+        if data['receipt'].paid_amount > 0:
+            raise serializers.ValidationError({'receipt': [self.paid_receipt_msg]})
+        if 'code' in data and not Product.objects.filter(code=data['code']).exists():
+            missing = [field for field in self.new_product_fields if field not in data]
+            if missing:
+                raise serializers.ValidationError({
+                    field: ['This field is required for a new product.'] for field in missing
+                })
+        return data
+
+    def create(self, validated_data):
+        product = validated_data.get('product')
+        if product is None:
+            product, _ = Product.objects.get_or_create(code=validated_data['code'], defaults={
+                'name': validated_data.get('name'),
+                'price': validated_data.get('price'),
+                'discount': validated_data.get('discount', 0),
+            })
+        try:
+            return validated_data['receipt'].add_line(product, validated_data['quantity'])
+        except AlreadyPaid:
+            # Paid after validation.
+            raise serializers.ValidationError({'receipt': [self.paid_receipt_msg]})
+
+    def to_representation(self, instance):
+        return ReceiptLineSerializer(instance).data
+
+class ShopDailySalesSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
+
+    class Meta:
+        model = ShopDailySales
+        exclude = ('id', 'refreshed_at')
+
+
+class BulkItemSerializer(serializers.ModelSerializer):
+
+    quantity = serializers.IntegerField(default=1, validators=ReceiptLine._meta.get_field('quantity').validators)
+
+    class Meta:
+        model = Product
+        fields = ('code', 'name', 'price', 'discount', 'stock_amount', 'quantity')
+        # Known codes are sold from the catalog, unknown ones added to it.
+        extra_kwargs = {'code': {'validators': []}}
+
+
+class BulkReceiptSerializer(serializers.ModelSerializer):
+
+    client_id = serializers.CharField(max_length=255)
+    shop = serializers.IntegerField()
+    user = serializers.IntegerField(required=False)
+    items = BulkItemSerializer(many=True)
+
+    class Meta:
+        model = Receipt
+        fields = ('client_id', 'name', 'paid_amount', 'change', 'cashier', 'shop', 'user', 'items')
+
+
+class ItemChangeSerializer(serializers.Serializer):
+
+    id = serializers.IntegerField(required=False)
+    code = serializers.CharField(max_length=255, required=False)
+    price = serializers.FloatField(required=False, validators=Product._meta.get_field('price').validators)
+    discount = serializers.FloatField(required=False, validators=Product._meta.get_field('discount').validators)
+    stock_amount = serializers.IntegerField(
+        required=False,
+        validators=Product._meta.get_field('stock_amount').validators
+    )
+    stock_delta = serializers.IntegerField(required=False)
+
+    change_fields = ('price', 'discount', 'stock_amount', 'stock_delta')
+
+    def validate(self, data):
+        if ('id' in data) == ('code' in data):
+            raise serializers.ValidationError('Give either id or code of the item.')
+        if not any(field in data for field in self.change_fields):
+            raise serializers.ValidationError('Nothing to change.')
+        if 'stock_amount' in data and 'stock_delta' in data:
+            raise serializers.ValidationError('Give either stock_amount or stock_delta.')
+        return data
@@ -0,0 +1,67 @@
+import threading
+
+from django.db.models.signals import post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from pos import cache
+from pos.models import Receipt, Product, ReceiptLine
+
+# Receipts being deleted in this thread, their cascaded lines skip totals.
+_deleting = threading.local()
+
+
+def deleting_receipts():
+    if not hasattr(_deleting, 'receipts'):
+        _deleting.receipts = set()
+    return _deleting.receipts
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    """ Drops the cached product, lines keep their own price copies."""
+    cache.items.invalidate(instance.pk)
+    cache.touch('items')
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    cache.items.invalidate(instance.pk)
+    cache.touch('items')
+
+
+@receiver(post_save, sender=ReceiptLine)
+def line_saved(sender, instance, raw=False, **kwargs):
+    """ Shifts receipt totals by the saved line, fixtures are reconciled."""
+    old = getattr(instance, '_synced_line', None)
+    if not raw:
+        instance.sync_receipt_totals()
+    cache.invalidate_receipts(instance.receipt_id, old and old[0])
+    cache.touch('items')
+
+
+@receiver(post_delete, sender=ReceiptLine)
+def line_deleted(sender, instance, **kwargs):
+    """ Removes deleted line from its receipt totals."""
+    if instance.receipt_id not in deleting_receipts():
+        instance.sync_receipt_totals(deleted=True)
+    cache.invalidate_receipts(instance.receipt_id)
+    cache.touch('items')
+
+
+@receiver(post_save, sender=Receipt)
+def receipt_saved(sender, instance, created=False, **kwargs):
+    """ Drops cached receipt payloads."""
+    if created:
+        return
+    cache.invalidate_receipts(instance.pk)
+
+
+@receiver(pre_delete, sender=Receipt)
+def receipt_deleting(sender, instance, **kwargs):
+    deleting_receipts().add(instance.pk)
+
+
+@receiver(post_delete, sender=Receipt)
+def receipt_deleted(sender, instance, **kwargs):
+    deleting_receipts().discard(instance.pk)
+    cache.invalidate_receipts(instance.pk)
+    cache.touch('items')
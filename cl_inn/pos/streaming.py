@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from pos.pagination import row_value
+from pos.renderers import NDJSONRenderer, render_ndjson_line
+from pos.serializers import ValuesSerializer
+
+
+def is_stream_requested(request):
+    """ Returns True for `.ndjson` suffixed or `?stream=1` requests."""
+    renderer = getattr(request, 'accepted_renderer', None)
+    return request.query_params.get('stream') == '1' or getattr(renderer, 'format', None) == 'ndjson'
+
+
+def iter_chunks(queryset, chunk_size):
+    """ Yields lists of rows ordered by pk, one keyset query per chunk.
+
+    Each chunk is fetched on its own, so no cursor or transaction has to stay
+    open while the client reads and memory is bounded by chunk_size.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = row_value(chunk[-1], 'id')
+
+
+def stream_serialized(queryset, serializer_class, chunk_size=None):
+    """ Returns a response writing serialized rows as NDJSON chunk by chunk."""
+    chunk_size = chunk_size or settings.POS_STREAM_CHUNK_SIZE
+    fast = ValuesSerializer(serializer_class)
+    # Rows are read after the view returns, so keep the database it routed to.
+    queryset = queryset.using(queryset.db)
+
+    def lines():
+        for chunk in iter_chunks(fast.values(queryset), chunk_size):
+            data = fast.represent(chunk)
+            yield ''.join(render_ndjson_line(row) for row in data).encode('utf-8')
+
+    return StreamingHttpResponse(lines(), content_type=NDJSONRenderer.media_type)
@@ -0,0 +1,21 @@
+from celery import shared_task
+from pos import partitions
+from pos.models import BestSeller, ShopDailySales
+
+
+@shared_task
+def refresh_shop_daily_sales():
+    """ Refreshes daily sales rollups of days touched since the last run."""
+    return [day.isoformat() for day in ShopDailySales.refresh()]
+
+
+@shared_task
+def refresh_best_sellers():
+    """ Recomputes best sellers leaderboards from hourly item sales."""
+    BestSeller.refresh()
+
+
+@shared_task
+def create_receipt_partitions():
+    """ Creates receipt partitions of the coming months and seals past ones."""
+    return partitions.ensure()
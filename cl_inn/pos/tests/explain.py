@@ -0,0 +1,52 @@
+import json
+
+from django.db import connection
+
+
+class ExplainMixin(object):
+    """ Test helpers checking the plans of captured queries with EXPLAIN.
+
+    Sequential scans are disabled while explaining, so the planner picks an
+    index whenever one can serve the query even on tiny test tables. Any
+    sequential scan left on a watched table means no index fits.
+    """
+
+    explain_tables = ('pos_receipt', 'pos_receiptline', 'pos_product')
+    explain_statements = ('SELECT', 'UPDATE', 'DELETE')
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            try:
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+                plan = cursor.fetchone()[0]
+            finally:
+                cursor.execute('SET LOCAL enable_seqscan = on')
+        return json.loads(plan) if isinstance(plan, str) else plan
+
+    def table_rows(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+            row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def seq_scans(self, node):
+        """ Yields relation names sequentially scanned anywhere in plan node."""
+        if node.get('Node Type') == 'Seq Scan':
+            yield node.get('Relation Name')
+        for child in node.get('Plans', []):
+            for relation in self.seq_scans(child):
+                yield relation
+
+    def assertNoSeqScans(self, queries, min_rows=0):
+        """ Fails for queries scanning a watched table of at least min_rows rows."""
+        if connection.vendor != 'postgresql':
+            return
+        for query in queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(self.explain_statements):
+                continue
+            for plan in self.explain(sql):
+                for relation in self.seq_scans(plan['Plan']):
+                    if relation in self.explain_tables and self.table_rows(relation) >= min_rows:
+                        self.fail('Sequential scan of {} in: {}'.format(relation, sql))
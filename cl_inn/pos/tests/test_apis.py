@@ -1,8 +1,19 @@
+import csv
+import gzip
+import json
+from threading import Thread
+from django.db import connection, transaction
+from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase, force_authenticate
+from rest_framework.test import APITestCase, APITransactionTestCase, force_authenticate
 from django.contrib.auth import get_user_model
 from pos.models import *
+from pos import cache, metrics
+from pos.bulk import ReceiptUpload
+from pos.export import COLUMNS
+from pos.pagination import KeysetPagination
 
 User = get_user_model()
 
@@ -55,6 +66,65 @@ class ReceiptListAPITest(APITestCase):
         self.assertEqual(request.status_code, status.HTTP_200_OK)
         self.assertTrue(request.data == [])
 
+    def test_get_receipts_pages_with_next_cursor(self):
+        """ Returns 2 newest receipts then the remaining one via Link header."""
+
+        # Setup test
+        for i in range(2):
+            Receipt.objects.create(
+                name='new receipt',
+                shop=self.shop,
+                user=self.user
+            )
+
+        # Exercise test
+        url = reverse('api_receipts_list')
+        request = self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+        first_page = self.client.get(url, {'page_size': 2})
+        next_url = first_page['Link'].split(';')[0].strip('<>')
+        second_page = self.client.get(next_url)
+
+        # Assert test
+        self.assertEqual(len(first_page.data), 2)
+        self.assertEqual(len(second_page.data), 1)
+        self.assertFalse(second_page.has_header('Link'))
+        self.assertEqual(
+            {r['id'] for r in first_page.data + second_page.data},
+            set(Receipt.objects.values_list('id', flat=True))
+        )
+
+    def test_get_receipts_with_invalid_cursor(self):
+        """ Returns 404 for a cursor that cannot be decoded."""
+
+        # Exercise test
+        url = reverse('api_receipts_list')
+        request = self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+        request = self.client.get(url, {'cursor': 'not-a-cursor'})
+
+        # Assert test
+        self.assertEqual(request.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_receipts_with_mistyped_cursor(self):
+        """ Returns 404 for a decodable cursor whose values do not fit the ordering."""
+
+        # Setup test
+        paginator = KeysetPagination(('-date', '-id'))
+        cursors = [
+            paginator.encode_cursor(['not a date', 1]),
+            paginator.encode_cursor([timezone.now(), 'x']),
+            paginator.encode_cursor([None, 1]),
+        ]
+
+        # Exercise test
+        url = reverse('api_receipts_list')
+        request = self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+        requests = [self.client.get(url, {'cursor': cursor}) for cursor in cursors]
+
+        # Assert test
+        for request in requests:
+            self.assertEqual(request.status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(request.data['detail'], 'Invalid cursor.')
+
     def test_post_new_receipts(self):
         """ increases number of receipts in db to 2."""
 
@@ -170,4 +240,624 @@ class ReceiptInstanceAPITest(APITestCase):
         request = self.client.delete(url)
 
         # Assert test
-        self.assertEqual(request.status_code, status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+        self.assertEqual(request.status_code, status.HTTP_204_NO_CONTENT)
+
+
+    def test_pay_receipt_out_of_stock(self):
+        """ Returns 409 with the short lines, leaving receipt and stock unchanged."""
+
+        # Setup test
+        r2 = Receipt.objects.create(
+            name='new receipt',
+            shop=self.shop,
+            user=self.user
+        )
+        product = Product.objects.create(name='item', code='item', price=100, stock_amount=1)
+        r2.add_line(product, 2)
+
+        # Exercise test
+        url = reverse('api_pay_receipt', kwargs={'receipt_id': r2.id})
+        request = self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+        request = self.client.post(url, {'money': 200})
+
+        # Assert test
+        self.assertEqual(request.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(request.data['lines'], [{'product': product.id, 'code': 'item', 'requested': 2, 'available': 1}])
+        self.assertEqual(Receipt.objects.get(pk=r2.pk).paid_amount, 0)
+        self.assertEqual(Product.objects.get(pk=product.pk).stock_amount, 1)
+
+class ItemListAPITest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username = 'ibrahemmmmm', email = 'test_@test.com', password = '000000555555ddd5f5f') 
+        self.shop = Shop.objects.create(name='Big Shop')
+        self.receipt = Receipt.objects.create(
+            name='new receipt',
+            shop=self.shop,
+            user=self.user
+        )
+        for i in range(3):
+            Product.objects.create(
+                name='item',
+                code='item'+str(i),
+                price=300
+            )
+
+    def test_stream_all_items(self):
+        """ Streams all 3 items as newline delimited JSON."""
+
+        # Setup test
+        # Exercise test
+        url = reverse('api_items_list')
+        request = self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+        with self.settings(POS_STREAM_CHUNK_SIZE=2):
+            request = self.client.get(url, {'stream': 1})
+            lines = b''.join(request.streaming_content).decode('utf-8').splitlines()
+
+        # Assert test
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual(request['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(
+            [json.loads(line)['code'] for line in lines],
+            ['item0', 'item1', 'item2']
+        )
+
+    def test_post_items_to_receipt(self):
+        """ Sells a catalog product by code and creates an unknown one, listing both lines."""
+
+        # Setup test
+        url = reverse('api_items_list')
+        data = {'receipt': self.receipt.id, 'code': 'item0'}
+
+        # Exercise test
+        request = self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+        sold = self.client.post(url, data)
+        created = self.client.post(url, dict(data, code='new', name='new item', price=100))
+        incomplete = self.client.post(url, dict(data, code='other'))
+        lines = self.client.get(reverse('api_receipt_items_list', kwargs={'receipt_id': self.receipt.id}))
+
+        # Assert test
+        self.assertEqual(sold.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(created.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(incomplete.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([line['code'] for line in lines.data], ['item0', 'new'])
+        self.assertEqual(Product.objects.count(), 4)
+        self.assertEqual(self.receipt.total_amount, 400)
+
+    def test_post_item_to_paid_receipt(self):
+        """ Refuses to sell an item on a receipt that was paid."""
+
+        # Setup test
+        Product.objects.filter(code='item0').update(stock_amount=1)
+        self.receipt.add_line(Product.objects.get(code='item0'))
+        self.receipt.pay_receipt(300)
+        url = reverse('api_items_list')
+
+        # Exercise test
+        request = self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+        request = self.client.post(url, {'receipt': self.receipt.id, 'code': 'item1'})
+
+        # Assert test
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('receipt', request.data)
+        self.assertEqual(ReceiptLine.objects.filter(receipt=self.receipt).count(), 1)
+
+
+
+class ItemSearchAPITest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username = 'ibrahemmmmm', email = 'test_@test.com', password = '000000555555ddd5f5f') 
+        self.shop = Shop.objects.create(name='Big Shop')
+        self.receipt = Receipt.objects.create(name='new receipt', shop=self.shop, user=self.user)
+        self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+
+    def create_item(self, code, name):
+        return Product.objects.create(name=name, code=code, price=300)
+
+    def search(self, query, **params):
+        params['q'] = query
+        return self.client.get(reverse('api_search_items'), params)
+
+    def test_exact_code_then_prefix_then_contained(self):
+        """ Ranks an exact code over a name prefix over a contained match."""
+
+        # Setup test
+        contained = self.create_item('A100', 'Coca Cola')
+        prefix = self.create_item('A101', 'Cola Zero')
+        exact = self.create_item('COLA', 'Soft drink')
+        self.create_item('A102', 'Bread')
+
+        # Exercise test
+        request = self.search('cola')
+
+        # Assert test
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in request.data], [exact.id, prefix.id, contained.id])
+
+    def test_fuzzy_and_arabic_spellings_match(self):
+        """ Finds a misspelt name and an Arabic name written without hamza."""
+
+        # Setup test
+        chocolate = self.create_item('B100', 'Chocolate')
+        rice = self.create_item('B101', 'أرز مصري')
+
+        # Exercise test
+        misspelt = self.search('chocolte')
+        arabic = self.search('ارز')
+
+        # Assert test
+        self.assertEqual([item['id'] for item in misspelt.data], [chocolate.id])
+        self.assertEqual([item['id'] for item in arabic.data], [rice.id])
+
+    def test_limit_and_empty_query(self):
+        """ Returns at most limit items, 400 without a query."""
+
+        # Setup test
+        for i in range(3):
+            self.create_item('C10' + str(i), 'Milk')
+
+        # Exercise test
+        limited = self.search('milk', limit=2)
+        empty = self.search(' ')
+
+        # Assert test
+        self.assertEqual(len(limited.data), 2)
+        self.assertEqual(empty.status_code, status.HTTP_400_BAD_REQUEST)
+
+class ReceiptBulkAPITest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username = 'ibrahemmmmm', email = 'test_@test.com', password = '000000555555ddd5f5f') 
+        self.shop = Shop.objects.create(name='Big Shop')
+
+    def receipt_data(self, client_id, codes):
+        return {
+            'client_id': client_id,
+            'name': 'offline receipt',
+            'shop': self.shop.id,
+            'items': [{'code': code, 'name': 'item', 'price': 100, 'discount': 0.5} for code in codes]
+        }
+
+    def test_bulk_upload_receipts(self):
+        """ Creates 2 receipts selling new and shared codes, rejects one of a missing shop."""
+
+        # Setup test
+        data = [
+            self.receipt_data('t1-1', ['a', 'b']),
+            self.receipt_data('t1-2', ['c', 'a']),
+            dict(self.receipt_data('t1-3', ['a']), shop=999),
+        ]
+
+        # Exercise test
+        url = reverse('api_receipts_bulk')
+        request = self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+        request = self.client.post(url, data, format='json')
+
+        # Assert test
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['status'] for r in request.data], ['created', 'created', 'rejected'])
+        self.assertEqual(request.data[2]['client_id'], 't1-3')
+        self.assertIn('shop', request.data[2]['errors'])
+        receipt = Receipt.objects.get(pk=request.data[0]['id'])
+        self.assertEqual((receipt.total, receipt.item_count), (100, 2))
+        self.assertEqual(request.data[0]['products'][0], request.data[1]['products'][1])
+        self.assertEqual(Product.objects.count(), 3)
+        self.assertEqual(ReceiptLine.objects.count(), 4)
+
+    def test_bulk_upload_paid_receipts_take_stock(self):
+        """ Takes paid items from stock and counts them sold, rejects a paid receipt short of stock."""
+
+        # Setup test
+        item = Product.objects.create(name='item', code='a', price=100, stock_amount=3)
+        data = [
+            dict(self.receipt_data('t2-1', ['a', 'a']), paid_amount=100),
+            dict(self.receipt_data('t2-2', ['a', 'a']), paid_amount=100),
+            self.receipt_data('t2-3', ['a', 'a']),
+        ]
+
+        # Exercise test
+        url = reverse('api_receipts_bulk')
+        request = self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+        request = self.client.post(url, data, format='json')
+
+        # Assert test
+        self.assertEqual([r['status'] for r in request.data], ['created', 'rejected', 'created'])
+        self.assertEqual(request.data[1]['errors']['items'], [
+            {'product': item.id, 'code': 'a', 'requested': 2, 'available': 1}
+        ])
+        self.assertEqual(Product.objects.get(pk=item.id).stock_amount, 1)
+        self.assertEqual(ItemSales.objects.get(item=item).quantity, 2)
+        self.assertEqual(Receipt.objects.count(), 2)
+
+    def test_bulk_upload_sells_code_created_meanwhile(self):
+        """ Sells the product another upload created after the catalog was read."""
+
+        # Setup test
+        upload = ReceiptUpload([self.receipt_data('t3-1', ['a', 'b'])], self.user)
+        products = upload.catalog(upload.validate_batch(upload.validate_fields()))
+        existing = Product.objects.create(name='item', code='a', price=100)
+
+        # Exercise test
+        upload.create_products(products)
+
+        # Assert test
+        self.assertEqual(products['a'].pk, existing.pk)
+        self.assertIsNotNone(products['b'].pk)
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_bulk_upload_not_a_list(self):
+        """ Returns 400 for a payload that isn't a list."""
+
+        # Exercise test
+        url = reverse('api_receipts_bulk')
+        request = self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+        request = self.client.post(url, {'client_id': 'x'}, format='json')
+
+        # Assert test
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ItemBulkUpdateAPITest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username = 'ibrahemmmmm', email = 'test_@test.com', password = '000000555555ddd5f5f') 
+        self.shop = Shop.objects.create(name='Big Shop')
+        self.receipt = Receipt.objects.create(
+            name='new receipt',
+            shop=self.shop,
+            user=self.user
+        )
+        self.items = [
+            Product.objects.create(name='item', code='item'+str(i), price=100, stock_amount=5)
+            for i in range(3)
+        ]
+        for item in self.items:
+            self.receipt.add_line(item)
+
+    def test_bulk_update_items(self):
+        """ Reprices by id, restocks by code, rejects overselling and bad discount."""
+
+        # Setup test
+        data = [
+            {'id': self.items[0].id, 'price': 200, 'discount': 0.25},
+            {'code': 'item1', 'stock_delta': -2},
+            {'code': 'item2', 'stock_delta': -6},
+            {'id': self.items[2].id, 'discount': 2},
+        ]
+
+        # Exercise test
+        url = reverse('api_items_bulk_update')
+        request = self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+        request = self.client.post(url, data, format='json')
+
+        # Assert test
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['status'] for r in request.data], ['updated', 'updated', 'rejected', 'rejected'])
+        self.assertEqual(Product.objects.get(code='item0').price, 200)
+        self.assertEqual(Product.objects.get(code='item1').stock_amount, 3)
+        self.assertEqual(Product.objects.get(code='item2').stock_amount, 5)
+        self.receipt.refresh_from_db()
+        self.assertEqual(self.receipt.total, 300)
+
+
+class PayloadCacheAPITest(APITransactionTestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.user = User.objects.create_user(username = 'ibrahemmmmm', email = 'test_@test.com', password = '000000555555ddd5f5f') 
+        self.shop = Shop.objects.create(name='Big Shop')
+        self.receipt = Receipt.objects.create(
+            name='new receipt',
+            shop=self.shop,
+            user=self.user
+        )
+
+    def test_cached_receipt_invalidated_by_new_item(self):
+        """ Serves second GET from cache, refreshes total once an item is added."""
+
+        # Setup test
+        url = reverse('api_receipts_instance', kwargs={'receipt_id': self.receipt.id})
+        request = self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+
+        # Exercise test
+        first = self.client.get(url)
+        second = self.client.get(url)
+        self.receipt.add_line(Product.objects.create(name='item', code='item', price=300))
+        third = self.client.get(url)
+
+        # Assert test
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(third.data['total'], 300)
+        self.assertEqual(cache.stats()['receipt'], {'hits': 1, 'misses': 2})
+
+    def read_concurrently(self, url):
+        """ Returns the response of a GET made on another connection."""
+        responses = []
+
+        def get():
+            try:
+                responses.append(self.client.get(url))
+            finally:
+                connection.close()
+
+        thread = Thread(target=get)
+        thread.start()
+        thread.join()
+        return responses[0]
+
+    def test_read_before_commit_is_not_cached(self):
+        """ Drops the item payload cached from the old row while the change commits."""
+
+        # Setup test
+        item = Product.objects.create(name='item', code='item', price=300)
+        url = reverse('api_item_instance', kwargs={'item_id': item.id})
+        self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+
+        # Exercise test
+        with transaction.atomic():
+            item.price = 500
+            item.save()
+            during = self.read_concurrently(url)
+        after = self.client.get(url)
+
+        # Assert test
+        self.assertEqual(during.data['price'], 300)
+        self.assertEqual(after.data['price'], 500)
+
+
+class IdempotencyAPITest(APITransactionTestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.user = User.objects.create_user(username = 'ibrahemmmmm', email = 'test_@test.com', password = '000000555555ddd5f5f') 
+        self.shop = Shop.objects.create(name='Big Shop')
+        self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+
+    def test_retried_payment_is_replayed(self):
+        """ Returns the first 200 again instead of failing on a paid receipt."""
+
+        # Setup test
+        r = Receipt.objects.create(
+            name='new receipt',
+            shop=self.shop,
+            user=self.user
+        )
+        r.add_line(Product.objects.create(name='item', code='item', price=300, stock_amount=1))
+        url = reverse('api_pay_receipt', kwargs={'receipt_id': r.id})
+
+        # Exercise test
+        first = self.client.post(url, {'money': 300}, HTTP_IDEMPOTENCY_KEY='pay-1')
+        retry = self.client.post(url, {'money': 300}, HTTP_IDEMPOTENCY_KEY='pay-1')
+        unkeyed = self.client.post(url, {'money': 300})
+
+        # Assert test
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(unkeyed.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_retried_receipt_post_creates_once(self):
+        """ Creates one receipt for two posts with the same key."""
+
+        # Setup test
+        data = {'name': 'receipt', 'user': self.user.id, 'shop': self.shop.id}
+        url = reverse('api_receipts_list')
+
+        # Exercise test
+        first = self.client.post(url, data, HTTP_IDEMPOTENCY_KEY='receipt-1')
+        retry = self.client.post(url, data, HTTP_IDEMPOTENCY_KEY='receipt-1')
+        reused = self.client.post(url, dict(data, name='other receipt'), HTTP_IDEMPOTENCY_KEY='receipt-1')
+
+        # Assert test
+        self.assertEqual(first.data, retry.data)
+        self.assertEqual(Receipt.objects.count(), 1)
+        self.assertEqual(reused.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+
+class ConditionalGetAPITest(APITransactionTestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.user = User.objects.create_user(username = 'ibrahemmmmm', email = 'test_@test.com', password = '000000555555ddd5f5f') 
+        self.shop = Shop.objects.create(name='Big Shop')
+        self.receipt = Receipt.objects.create(
+            name='new receipt',
+            shop=self.shop,
+            user=self.user
+        )
+        self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+
+    def test_receipt_not_modified_until_item_added(self):
+        """ Returns 304 for the current ETag, 200 once the receipt total changes."""
+
+        # Setup test
+        url = reverse('api_receipts_instance', kwargs={'receipt_id': self.receipt.id})
+        etag = self.client.get(url)['ETag']
+
+        # Exercise test
+        unchanged = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.receipt.add_line(Product.objects.create(name='item', code='item', price=300))
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        # Assert test
+        self.assertEqual(unchanged.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(changed['ETag'], etag)
+
+    def test_items_list_not_modified_until_item_changed(self):
+        """ Returns 304 for the current ETag, 200 once any item changes."""
+
+        # Setup test
+        item = Product.objects.create(name='item', code='item', price=300)
+        url = reverse('api_items_list')
+        etag = self.client.get(url)['ETag']
+
+        # Exercise test
+        unchanged = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        item.set_stock_amount(10)
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        # Assert test
+        self.assertEqual(unchanged.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+
+    def test_items_list_read_before_commit_is_modified(self):
+        """ Returns 200 after the commit for an ETag read while an item changed."""
+
+        # Setup test
+        item = Product.objects.create(name='item', code='item', price=300)
+        url = reverse('api_items_list')
+        responses = []
+
+        def get():
+            try:
+                responses.append(self.client.get(url))
+            finally:
+                connection.close()
+
+        # Exercise test
+        with transaction.atomic():
+            item.set_stock_amount(10)
+            thread = Thread(target=get)
+            thread.start()
+            thread.join()
+        during = responses[0]
+        after = self.client.get(url, HTTP_IF_NONE_MATCH=during['ETag'])
+
+        # Assert test
+        self.assertEqual(during.data[0]['stock_amount'], 0)
+        self.assertEqual(after.status_code, status.HTTP_200_OK)
+        self.assertEqual(after.data[0]['stock_amount'], 10)
+
+
+class ServerTimingAPITest(APITestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        metrics.histograms.clear()
+        self.user = User.objects.create_user(username = 'ibrahemmmmm', email = 'test_@test.com', password = '000000555555ddd5f5f')
+        self.shop = Shop.objects.create(name='Big Shop')
+        self.receipt = Receipt.objects.create(name='new receipt', shop=self.shop, user=self.user)
+        self.receipt.add_line(Product.objects.create(name='item', code='item', price=300))
+        self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+
+    def test_timed_request_reports_and_exports_phases(self):
+        """ Sends Server-Timing phases and counts them in the route histograms."""
+
+        # Setup test
+        self.user.is_staff = True
+        self.user.save()
+
+        # Exercise test
+        request = self.client.get(reverse('api_items_list'))
+        exported = self.client.get(reverse('api_metrics'))
+
+        # Assert test
+        timing = request['Server-Timing']
+        for phase in metrics.PHASES:
+            self.assertIn(phase + ';dur=', timing)
+        self.assertIn('queries"', timing)
+        text = exported.content.decode('utf-8')
+        self.assertIn('pos_request_duration_seconds_count{route="api_items_list",phase="total"} 1\n', text)
+        self.assertIn('pos_request_queries_bucket{route="api_items_list",le="+Inf"} 1\n', text)
+
+    @override_settings(POS_METRICS_TOKEN='scrape-secret', POS_METRICS_ALLOWED_IPS=['10.0.0.0/8'])
+    def test_metrics_let_in_token_or_allowed_address(self):
+        """ Serves scrapers with the token or from an allowed address, not other users."""
+
+        # Setup test
+        url = reverse('api_metrics')
+
+        # Exercise test
+        user = self.client.get(url)
+        self.client.logout()
+        token = self.client.get(url, HTTP_AUTHORIZATION='Bearer scrape-secret')
+        wrong_token = self.client.get(url, HTTP_AUTHORIZATION='Bearer guessed')
+        allowed = self.client.get(url, REMOTE_ADDR='10.1.2.3')
+        other = self.client.get(url, REMOTE_ADDR='192.168.1.2')
+
+        # Assert test
+        self.assertEqual(user.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(token.status_code, status.HTTP_200_OK)
+        self.assertIn(wrong_token.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+        self.assertEqual(allowed.status_code, status.HTTP_200_OK)
+        self.assertIn(other.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+    @override_settings(POS_METRICS_SAMPLE_RATE=0)
+    def test_unsampled_request_is_not_timed(self):
+        """ Leaves requests outside the sample untouched."""
+
+        # Exercise test
+        request = self.client.get(reverse('api_items_list'))
+
+        # Assert test
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertFalse(request.has_header('Server-Timing'))
+        self.assertEqual(metrics.histograms, {})
+
+
+class ExportAPITest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username = 'ibrahemmmmm', email = 'test_@test.com', password = '000000555555ddd5f5f') 
+        self.user.is_staff = True
+        self.user.save()
+        self.shop = Shop.objects.create(name='Big Shop')
+        self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+        self.day = str(timezone.localtime(timezone.now()).date())
+        product = Product.objects.create(name='item', code='item', price=100)
+        for shop in (self.shop, self.shop, Shop.objects.create(name='Other Shop')):
+            Receipt.objects.create(name='receipt', shop=shop, user=self.user).add_line(product, 2)
+
+    def test_export_lines_as_csv(self):
+        """ Streams a header and one row per line of the shop's receipts."""
+
+        # Exercise test
+        url = reverse('api_export_receipts', kwargs={'shop_id': self.shop.id})
+        request = self.client.get(url, {'start': self.day, 'end': self.day})
+
+        # Assert test
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertTrue(request['Content-Type'].startswith('text/csv'))
+        rows = list(csv.reader(b''.join(request.streaming_content).decode('utf-8').splitlines()))
+        self.assertEqual(rows[0], list(COLUMNS))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual({row[list(COLUMNS).index('quantity')] for row in rows[1:]}, {'2'})
+
+    def test_export_lines_as_gzipped_ndjson(self):
+        """ Compresses NDJSON rows for clients accepting gzip."""
+
+        # Exercise test
+        url = reverse('api_export_receipts', kwargs={'shop_id': self.shop.id})
+        request = self.client.get(url, {'start': self.day, 'end': self.day, 'format': 'ndjson'}, HTTP_ACCEPT_ENCODING='gzip')
+
+        # Assert test
+        self.assertEqual(request['Content-Encoding'], 'gzip')
+        rows = [json.loads(line) for line in gzip.decompress(b''.join(request.streaming_content)).decode('utf-8').splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual({row['shop'] for row in rows}, {self.shop.id})
+
+    def test_export_refused_to_non_staff(self):
+        """ Returns 403 to a user who is not staff."""
+
+        # Setup test
+        User.objects.create_user(username='cashier', email='cashier@test.com', password='000000555555ddd5f5f')
+        self.client.login(username='cashier', password='000000555555ddd5f5f')
+
+        # Exercise test
+        url = reverse('api_export_receipts', kwargs={'shop_id': self.shop.id})
+        request = self.client.get(url, {'start': self.day, 'end': self.day})
+
+        # Assert test
+        self.assertEqual(request.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_with_invalid_range(self):
+        """ Returns 400 when end comes before start."""
+
+        # Exercise test
+        url = reverse('api_export_receipts', kwargs={'shop_id': self.shop.id})
+        request = self.client.get(url, {'start': self.day, 'end': '2000-01-01'})
+
+        # Assert test
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,36 @@
+from django.test import TestCase
+from pos import api_urls
+from pos.benchmark import Benchmark, Seeder, compare
+
+
+class BenchmarkTest(TestCase):
+
+    def test_benchmark_covers_every_route(self):
+        """ Runs each api route once against a tiny seeded dataset."""
+
+        # Setup test
+        user = Seeder(shops=2, receipts=3, items=6).seed()
+
+        # Exercise test
+        endpoints = Benchmark(user, iterations=1).run()
+
+        # Assert test
+        names = {pattern.name for pattern in api_urls.urlpatterns if pattern.name}
+        self.assertEqual(set(endpoints), names)
+        self.assertEqual(
+            set(endpoints['api_items_list']),
+            {'p50_ms', 'p95_ms', 'queries', 'sql_ms', 'peak_kb'}
+        )
+
+    def test_compare_reports_regressions(self):
+        """ Flags metrics grown over threshold only."""
+
+        # Setup test
+        baseline = {'endpoints': {'api_items_list': {'p95_ms': 10, 'queries': 4}}}
+        report = {'endpoints': {'api_items_list': {'p95_ms': 11, 'queries': 8}}}
+
+        # Exercise test
+        regressions = compare(report, baseline, 0.2)
+
+        # Assert test
+        self.assertEqual(regressions, ['api_items_list queries: 4 -> 8'])
@@ -0,0 +1,74 @@
+import csv
+import json
+import os
+from io import StringIO
+from tempfile import TemporaryDirectory
+from django.core.management import call_command
+from django.test import TestCase
+from pos.models import Product
+from pos.validators import GeneralCMSValidator
+
+
+class ImportCatalogTest(TestCase):
+
+    def setUp(self):
+        Product.objects.create(name='Coffee', code='a1', price=100, stock_amount=5)
+        self.directory = TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as output:
+            output.write(text)
+        return path
+
+    def test_import_csv_upserts_and_reports_rejected_rows(self):
+        """ Updates a1, creates b1 and rejects every invalid or repeated row with its reason."""
+
+        # Setup test
+        path = self.write('catalog.csv', '\n'.join([
+            'code,name,price,discount,stock_amount',
+            'a1,,150,,',
+            'b1,Tea,10,0.5,3',
+            'c1,1bad,10,,',
+            'd1,Milk,-1,,',
+            'e1,Milk,10,2,',
+            'b1,Tea,11,,',
+            'f1,,10,,',
+        ]) + '\n')
+        rejected = os.path.join(self.directory.name, 'rejected.csv')
+        output = StringIO()
+
+        # Exercise test
+        call_command('import_catalog', path, rejected=rejected, stdout=output)
+
+        # Assert test
+        with open(rejected, encoding='utf-8') as report:
+            reasons = {row['code']: row['reason'] for row in csv.DictReader(report)}
+        self.assertEqual(reasons, {
+            'c1': GeneralCMSValidator.name_validator.message,
+            'd1': Product.price_msg,
+            'e1': Product.discount_msg,
+            'b1': 'Code is repeated from row 2.',
+            'f1': 'Name is required for new products.',
+        })
+        self.assertIn('7 rows, 5 rejected, 1 created, 1 updated, 0 unchanged.', output.getvalue())
+        self.assertEqual(
+            list(Product.objects.order_by('code').values_list('code', 'name', 'price', 'discount', 'stock_amount')),
+            [('a1', 'Coffee', 150, 0, 5), ('b1', 'Tea', 10, 0.5, 3)]
+        )
+
+    def test_import_json_lines_after_dry_run(self):
+        """ Changes nothing on a dry run, then creates the product."""
+
+        # Setup test
+        path = self.write('catalog.ndjson', json.dumps({'code': 'g1', 'name': 'Juice', 'price': 7.5}) + '\n')
+
+        # Exercise test
+        call_command('import_catalog', path, dry_run=True, stdout=StringIO())
+        dry_run = Product.objects.filter(code='g1').exists()
+        call_command('import_catalog', path, stdout=StringIO())
+
+        # Assert test
+        self.assertFalse(dry_run)
+        self.assertEqual(Product.objects.get(code='g1').price, 7.5)
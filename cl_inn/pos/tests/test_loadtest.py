@@ -0,0 +1,47 @@
+from django.db.models import Sum
+from django.test import LiveServerTestCase, SimpleTestCase
+from django.contrib.auth import get_user_model
+from pos.loadtest import Simulation, zipf_weights
+from pos.models import *
+
+User = get_user_model()
+
+
+class ZipfWeightsTest(SimpleTestCase):
+
+    def test_skew_favours_first_ranks(self):
+        """ Gives rank 1 the largest share, all ranks the same without skew."""
+
+        # Exercise test
+        skewed = zipf_weights(4, 1)
+        uniform = zipf_weights(4, 0)
+
+        # Assert test
+        self.assertEqual(skewed[0] / skewed[-1], 1 / (1 + 1/2 + 1/3 + 1/4))
+        self.assertEqual(uniform, [1, 2, 3, 4])
+
+
+class SimulationTest(LiveServerTestCase):
+
+    def test_terminals_check_out_against_live_server(self):
+        """ Runs two terminals through two paid checkouts each."""
+
+        # Setup test
+        user = User.objects.create_user(username = 'ibrahemmmmm', email = 'test_@test.com', password = '000000555555ddd5f5f')
+        shop = Shop.objects.create(name='Big Shop')
+        simulation = Simulation(
+            self.live_server_url + '/api', 'ibrahemmmmm', '000000555555ddd5f5f', user.pk, shop.pk,
+            terminals=2, checkouts=2, think_time=0, max_lines=3, skus=3, stock=100, seed=1
+        )
+
+        # Exercise test
+        report = simulation.run()
+
+        # Assert test
+        self.assertEqual(report['checkouts'], 4)
+        self.assertEqual(report['error_rate'], 0)
+        payments = [metrics['count'] for name, metrics in report['operations'].items() if name.startswith('pay')]
+        self.assertEqual(sum(payments), 4)
+        self.assertEqual(Receipt.objects.filter(paid_amount__gt=0).count(), 4)
+        sold = Product.objects.filter(code__in=[sku['code'] for sku in simulation.catalog]).aggregate(Sum('stock_amount'))
+        self.assertEqual(300 - sold['stock_amount__sum'], report['operations']['add_item']['count'])
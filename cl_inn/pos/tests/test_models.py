@@ -1,10 +1,14 @@
 from django.urls import reverse
-from django.test import TestCase
+from threading import Thread
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth import get_user_model
 from django.core.urlresolvers import resolve
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
 from unittest import skip
-from pos.models import Shop, Receipt, Item
+from io import StringIO
+from pos.models import Shop, Receipt, Product, ReceiptLine, BestSeller, ShopDailySales, OutOfStock, AlreadyPaid
 
 User = get_user_model()
 
@@ -87,14 +91,13 @@ class ReceiptTest(TestCase):
 
 		# Exercise test
 		for i in range(3):
-			item = Item.objects.create(
+			r.add_line(Product.objects.create(
 				name='item',
 				code='item'+str(i),
 				price=300,
 				discount=0,
-				stock_amount=3,
-				receipt=r
-			)
+				stock_amount=3
+			))
 
 		# Assert test
 		self.assertEqual(r.total_amount, 900)
@@ -117,14 +120,13 @@ class ReceiptTest(TestCase):
 
 		# Exercise test
 		for i in range(3):
-			item = Item.objects.create(
+			r.add_line(Product.objects.create(
 				name='item',
 				code='item'+str(i),
 				price=prices[i],
 				discount=discounts[i],
-				stock_amount=3,
-				receipt=r
-			)
+				stock_amount=3
+			))
 
 		# Assert test
 		self.assertEqual(r.total_amount, 375)
@@ -139,14 +141,13 @@ class ReceiptTest(TestCase):
 			user=self.user
 		)
 		for i in range(3):
-			Item.objects.create(
+			r.add_line(Product.objects.create(
 				name='item',
 				code='item'+str(i),
 				price=300,
 				discount=0,
-				stock_amount=3,
-				receipt=r
-			)
+				stock_amount=3
+			))
 
 		# Exercise test
 		r.pay_receipt(900, False)
@@ -155,6 +156,24 @@ class ReceiptTest(TestCase):
 		# Assert test
 		self.assertEqual(r.paid_amount, 900)
 
+	def test_add_line_to_paid_receipt(self):
+		""" Raises AlreadyPaid, leaving the paid lines as they are."""
+		
+		# Setup test
+		r = Receipt.objects.create(
+			name=self.name,
+			shop=self.shop,
+			user=self.user
+		)
+		item = Product.objects.create(name='item', code='item', price=300, stock_amount=3)
+		r.add_line(item)
+		r.pay_receipt(300)
+
+		# Assert test
+		with self.assertRaises(AlreadyPaid):
+			r.add_line(item)
+		self.assertEqual(r.lines.count(), 1)
+
 	def test_pay_receipt_with_positive_parameter_ls_amount(self):
 		""" Returns true and updates paid_amount."""
 		
@@ -165,14 +184,13 @@ class ReceiptTest(TestCase):
 			user=self.user
 		)
 		for i in range(3):
-			Item.objects.create(
+			r.add_line(Product.objects.create(
 				name='item',
 				code='item'+str(i),
 				price=300,
 				discount=0,
-				stock_amount=3,
-				receipt=r
-			)
+				stock_amount=3
+			))
 
 		# Exercise test
 		r.pay_receipt(400, False)
@@ -191,14 +209,13 @@ class ReceiptTest(TestCase):
 			user=self.user
 		)
 		for i in range(3):
-			Item.objects.create(
+			r.add_line(Product.objects.create(
 				name='item',
 				code='item'+str(i),
 				price=300,
 				discount=0,
-				stock_amount=3,
-				receipt=r
-			)
+				stock_amount=3
+			))
 
 		# Exercise test
 		# Assert test
@@ -221,21 +238,102 @@ class ReceiptTest(TestCase):
 
 		# Exercise test
 		for i in range(3):
-			item = Item.objects.create(
+			r.add_line(Product.objects.create(
 				name='item',
 				code='item'+str(i),
 				price=prices[i],
 				discount=discounts[i],
-				stock_amount=3,
-				receipt=r
-			)
+				stock_amount=3
+			))
 
 		# Assert test
 		self.assertEqual(r.get_avg(), float(125))
 
+	def test_stored_totals_follow_line_update_and_delete(self):
+		""" Keeps stored totals in sync with changed and removed lines.
+		>>> 2 x 300, 300 -> 2 x 100, delete 300
+		200
+		"""
+		
+		# Setup test
+		r = Receipt.objects.create(
+			name=self.name,
+			shop=self.shop,
+			user=self.user
+		)
+		lines = [
+			r.add_line(Product.objects.create(name='item', code='item'+str(i), price=300), 2 - i)
+			for i in range(2)
+		]
+
+		# Exercise test
+		lines[0].price = 100
+		lines[0].save()
+		ReceiptLine.objects.get(pk=lines[1].pk).delete()
+		r.refresh_from_db()
+
+		# Assert test
+		self.assertEqual(r.total, 200)
+		self.assertEqual(r.items_sum, 200)
+		self.assertEqual(r.item_count, 2)
+
+	def test_lines_keep_price_of_sale(self):
+		""" Sells one product on two receipts, repricing it leaves both totals."""
+		
+		# Setup test
+		product = Product.objects.create(name='item', code='item', price=300, discount=0.5)
+		receipts = [Receipt.objects.create(name=self.name, shop=self.shop, user=self.user) for i in range(2)]
+		for r in receipts:
+			r.add_line(product, 2)
+
+		# Exercise test
+		product.price = 1000
+		product.save()
+
+		# Assert test
+		self.assertEqual([r.total_amount for r in receipts], [300, 300])
+		self.assertEqual(ReceiptLine.objects.filter(product=product).count(), 2)
+
+	def test_receipt_save_keeps_stored_totals(self):
+		""" Saving a stale receipt instance doesn't overwrite its totals."""
+		
+		# Setup test
+		r = Receipt.objects.create(
+			name=self.name,
+			shop=self.shop,
+			user=self.user
+		)
+		r.add_line(Product.objects.create(name='item', code='item', price=300))
+
+		# Exercise test
+		r.name = 'renamed receipt'
+		r.save()
+
+		# Assert test
+		self.assertEqual(Receipt.objects.get(pk=r.pk).total, 300)
+
+	def test_reconcile_receipt_totals_repairs_drift(self):
+		""" Resets drifted stored totals to live line totals."""
+		
+		# Setup test
+		r = Receipt.objects.create(
+			name=self.name,
+			shop=self.shop,
+			user=self.user
+		)
+		r.add_line(Product.objects.create(name='item', code='item', price=300, discount=0.5))
+		Receipt.objects.filter(pk=r.pk).update(total=0, items_sum=0, item_count=0)
+
+		# Exercise test
+		call_command('reconcile_receipt_totals', stdout=StringIO())
+		r.refresh_from_db()
+
+		# Assert test
+		self.assertEqual((r.total, r.items_sum, r.item_count), (150, 300, 1))
 
 
-class ItemTest(TestCase):
+
+class ProductTest(TestCase):
 
 	def setUp(self):
 		self.shop = Shop.objects.create(name='Big Shop')
@@ -257,16 +355,15 @@ class ItemTest(TestCase):
 		""" Saves an item successfully."""
 		
 		# Setup test
-		item = Item.objects.create(
+		item = Product.objects.create(
 			name=self.itm_name,
 			code=self.code,
 			price=self.price,
-			stock_amount=self.stock_amount,
-			receipt=self.receipt
+			stock_amount=self.stock_amount
 		)
 
 		# Exercise test
-		itms_in_db = Item.objects.all().count()
+		itms_in_db = Product.objects.all().count()
 
 		# Assert test
 		self.assertEqual(None, item.full_clean())
@@ -276,12 +373,11 @@ class ItemTest(TestCase):
 		""" Yales that price cannot be negative."""
 		
 		# Setup test
-		item = Item.objects.create(
+		item = Product.objects.create(
 			name=self.itm_name,
 			code=self.code,
 			price=-10,
-			stock_amount=self.stock_amount,
-			receipt=self.receipt
+			stock_amount=self.stock_amount
 		)
 
 		# Exercise test
@@ -293,12 +389,11 @@ class ItemTest(TestCase):
 		""" Yales that stock is empty."""
 		
 		# Setup test
-		item = Item.objects.create(
+		item = Product.objects.create(
 			name=self.itm_name,
 			code=self.code,
 			price=self.price,
-			stock_amount=-1,
-			receipt=self.receipt
+			stock_amount=-1
 		)
 
 		# Exercise test
@@ -315,21 +410,19 @@ class ItemTest(TestCase):
 		"""
 		
 		# Setup test
-		item = Item.objects.create(
+		item = Product.objects.create(
 			name=self.itm_name,
 			code=self.code,
 			price=300,
 			discount=0.10,
-			stock_amount=self.stock_amount,
-			receipt=self.receipt
+			stock_amount=self.stock_amount
 		)
-		item2 = Item.objects.create(
+		item2 = Product.objects.create(
 			name=self.itm_name,
 			code=self.code+'5d5d5d',
 			price=25000,
 			discount=0.07,
-			stock_amount=self.stock_amount,
-			receipt=self.receipt
+			stock_amount=self.stock_amount
 		)
 
 		# Exercise test
@@ -340,13 +433,12 @@ class ItemTest(TestCase):
 		""" Yales that discount cannot be negative."""
 		
 		# Setup test
-		item = Item.objects.create(
+		item = Product.objects.create(
 			name=self.itm_name,
 			code=self.code,
 			price=300,
 			discount=-0.10,
-			stock_amount=self.stock_amount,
-			receipt=self.receipt
+			stock_amount=self.stock_amount
 		)
 		# Exercise test
 		# Assert test
@@ -357,13 +449,12 @@ class ItemTest(TestCase):
 		""" Yales that discount cannot be greater than price."""
 		
 		# Setup test
-		item = Item.objects.create(
+		item = Product.objects.create(
 			name=self.itm_name,
 			code=self.code,
 			price=300,
 			discount=3,
-			stock_amount=self.stock_amount,
-			receipt=self.receipt
+			stock_amount=self.stock_amount
 		)
 		# Exercise test
 		# Assert test
@@ -374,12 +465,11 @@ class ItemTest(TestCase):
 		""" Changes item's stock_amount by i."""
 		
 		# Setup test
-		item = Item.objects.create(
+		item = Product.objects.create(
 			name=self.itm_name,
 			code=self.code,
 			price=300,
-			stock_amount=self.stock_amount,
-			receipt=self.receipt
+			stock_amount=self.stock_amount
 		)
 
 		# Exercise test
@@ -393,12 +483,11 @@ class ItemTest(TestCase):
 		""" Doesn't change anything."""
 		
 		# Setup test
-		item = Item.objects.create(
+		item = Product.objects.create(
 			name=self.itm_name,
 			code=self.code,
 			price=300,
-			stock_amount=self.stock_amount,
-			receipt=self.receipt
+			stock_amount=self.stock_amount
 		)
 
 		# Exercise test
@@ -412,12 +501,11 @@ class ItemTest(TestCase):
 		""" Decreases stock amount by 1."""
 		
 		# Setup test
-		item = Item.objects.create(
+		item = Product.objects.create(
 			name=self.itm_name,
 			code=self.code,
 			price=300,
-			stock_amount=self.stock_amount,
-			receipt=self.receipt
+			stock_amount=self.stock_amount
 		)
 
 		# Exercise test
@@ -431,12 +519,11 @@ class ItemTest(TestCase):
 		""" Decreases stock amount by 5."""
 		
 		# Setup test
-		item = Item.objects.create(
+		item = Product.objects.create(
 			name=self.itm_name,
 			code=self.code,
 			price=300,
-			stock_amount=10,
-			receipt=self.receipt
+			stock_amount=10
 		)
 
 		# Exercise test
@@ -450,44 +537,176 @@ class ItemTest(TestCase):
 		""" Doesn't change anything."""
 		
 		# Setup test
-		item = Item.objects.create(
+		item = Product.objects.create(
 			name=self.itm_name,
 			code=self.code,
 			price=300,
-			stock_amount=self.stock_amount,
-			receipt=self.receipt
+			stock_amount=self.stock_amount
 		)
 
 		# Exercise test
-		item.decrease_stock(5)
+		taken = item.decrease_stock(5)
 
 		# Assert test
+		self.assertFalse(taken)
 		self.assertEqual(item.stock_amount, self.stock_amount)
 
+	def test_decrease_stock_from_stale_instance(self):
+		""" Takes from the stored stock, not from the loaded copy."""
+		
+		# Setup test
+		item = Product.objects.create(
+			name=self.itm_name,
+			code=self.code,
+			price=300,
+			stock_amount=10
+		)
+		stale = Product.objects.get(pk=item.pk)
+
+		# Exercise test
+		item.decrease_stock(4)
+		stale.decrease_stock(4)
+
+		# Assert test
+		self.assertEqual(stale.stock_amount, 2)
+		self.assertEqual(Product.objects.get(pk=item.pk).stock_amount, 2)
+
+	def test_take_stock_all_or_nothing(self):
+		""" Leaves stock untouched when any product is short, reporting it."""
+		
+		# Setup test
+		products = [
+			Product.objects.create(name='item', code='item'+str(i), price=300, stock_amount=amount)
+			for i, amount in enumerate([3, 1])
+		]
+
+		# Exercise test
+		with self.assertRaises(OutOfStock) as short:
+			Product.take_stock({products[0].pk: 2, products[1].pk: 2})
+		Product.take_stock({products[0].pk: 2, products[1].pk: 1})
+
+		# Assert test
+		self.assertEqual(
+			[(line['code'], line['requested'], line['available']) for line in short.exception.lines],
+			[('item1', 2, 1)]
+		)
+		self.assertEqual(
+			list(Product.objects.order_by('code').values_list('stock_amount', flat=True)),
+			[1, 0]
+		)
+
 	def test_most_sold_item(self):
-		""" Returns item with stock_amount = 1."""
+		""" Returns products of paid receipts by units sold, per shop and overall."""
 		
 		# Setup test
-		prices = [100, 2458, 300]
-		stock = [10, 1, 35]
+		r = Receipt.objects.create(
+			name=self.name,
+			shop=self.shop,
+			user=self.user
+		)
+		unpaid = Receipt.objects.create(
+			name=self.name,
+			shop=self.shop,
+			user=self.user
+		)
+		again = Receipt.objects.create(
+			name=self.name,
+			shop=self.shop,
+			user=self.user
+		)
+		products = [Product.objects.create(name='item', code='item'+str(i), price=100, stock_amount=10) for i in range(2)]
+		r.add_line(products[1])
+		r.add_line(products[0])
+		again.add_line(products[0], 2)
+		unpaid.add_line(products[1], 5)
 
 		# Exercise test
-		for i in range(3):
-			Item.objects.create(
-				name='item',
-				code='item'+str(i),
-				price=prices[i],
-				stock_amount=stock[i],
-				receipt=self.receipt
-			)
+		r.pay_receipt(200)
+		again.pay_receipt(200)
+		BestSeller.refresh()
 
 		# Assert test
-		self.assertEqual(Item.get_most_sold().first().stock_amount, 1)
+		self.assertEqual([i.code for i in Product.get_most_sold()], ['item0', 'item1'])
+		self.assertEqual([i.code for i in Product.get_most_sold('hour', self.shop.id)], ['item0', 'item1'])
+		self.assertEqual(BestSeller.objects.get(window='day', shop=None, rank=1).quantity, 3)
 
 	def test_most_sold_item_when_no_items(self):
 		""" Returns None."""
 		
 		# Setup test
 		# Assert test
-		self.assertEqual(Item.get_most_sold().first(), None)
+		self.assertEqual(Product.get_most_sold().first(), None)
+
+
+class CheckoutStockTest(TransactionTestCase):
+
+	def setUp(self):
+		self.shop = Shop.objects.create(name='Big Shop')
+		self.user = User.objects.create_user(username='Ibrahem', password='010d1d5ss57cxs1x0d')
+
+	def test_concurrent_checkouts_never_oversell(self):
+		""" Pays 5 of 8 concurrent receipts sharing a hot product with 5 in stock.
+		Half of them list the products the other way round, without deadlocking.
+		"""
+		
+		# Setup test
+		hot = Product.objects.create(name='hot', code='hot', price=100, stock_amount=5)
+		cold = Product.objects.create(name='cold', code='cold', price=100, stock_amount=100)
+		receipts = []
+		for i in range(8):
+			r = Receipt.objects.create(name='receipt', shop=self.shop, user=self.user)
+			for product in ([hot, cold] if i % 2 else [cold, hot]):
+				r.add_line(product)
+			receipts.append(r)
+		outcomes = []
+
+		def pay(receipt):
+			try:
+				outcomes.append(receipt.pay_receipt(200))
+			except OutOfStock:
+				outcomes.append('out of stock')
+			finally:
+				connection.close()
+
+		# Exercise test
+		threads = [Thread(target=pay, args=(r,)) for r in receipts]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		# Assert test
+		self.assertEqual(sorted(outcomes, key=str), [True] * 5 + ['out of stock'] * 3)
+		self.assertEqual(Product.objects.get(pk=hot.pk).stock_amount, 0)
+		self.assertEqual(Product.objects.get(pk=cold.pk).stock_amount, 95)
+		self.assertEqual(Receipt.objects.filter(paid_amount__gt=0).count(), 5)
+
+
+class ShopDailySalesTest(TestCase):
+
+	def setUp(self):
+		self.shop = Shop.objects.create(name='Big Shop')
+		self.user = User.objects.create_user(username='Ibrahem', password='010d1d5ss57cxs1x0d')
 
+	def test_refresh_rolls_up_paid_receipts(self):
+		""" Sums today's paid receipts of the shop, skipping unpaid ones.
+		>>> (100, 0.5), (300, 0) paid, (50, 0) unpaid
+		revenue 350, discount 50
+		"""
+		
+		# Setup test
+		receipts = [Receipt.objects.create(name='receipt', shop=self.shop, user=self.user) for i in range(3)]
+		receipts[0].add_line(Product.objects.create(name='item', code='item0', price=100, discount=0.5, stock_amount=1))
+		receipts[1].add_line(Product.objects.create(name='item', code='item1', price=300, stock_amount=1))
+		receipts[2].add_line(Product.objects.create(name='item', code='item2', price=50, stock_amount=1))
+		receipts[0].pay_receipt(50)
+		receipts[1].pay_receipt(300)
+
+		# Exercise test
+		days = ShopDailySales.refresh()
+		sales = ShopDailySales.objects.get(shop=self.shop)
+
+		# Assert test
+		self.assertEqual(days, [sales.day])
+		self.assertEqual((sales.revenue, sales.receipt_count, sales.item_count), (350, 2, 2))
+		self.assertEqual((sales.average_basket, sales.discount_given), (175, 50))
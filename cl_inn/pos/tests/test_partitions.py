@@ -0,0 +1,104 @@
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+from pos import partitions
+from pos.models import *
+
+User = get_user_model()
+
+
+class PartitionsTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username = 'ibrahemmmmm', email = 'test_@test.com', password = '000000555555ddd5f5f')
+        self.shop = Shop.objects.create(name='Big Shop')
+        self.product = Product.objects.create(name='item', code='item', price=100, stock_amount=10)
+        self.old_month = partitions.add_months(partitions.month_of(timezone.now()), -2)
+        with connection.cursor() as cursor:
+            partitions.create_partitions(cursor, [self.old_month])
+
+    def create_receipt(self, created_at=None):
+        receipt = Receipt.objects.create(
+            name='receipt', shop=self.shop, user=self.user, created_at=created_at or timezone.now()
+        )
+        receipt.add_line(self.product)
+        return receipt
+
+    def partition_ids(self, table, month):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM {}'.format(partitions.partition_name(table, month)))
+            return [row[0] for row in cursor.fetchall()]
+
+    def plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN ' + sql)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def test_rows_move_to_partition_of_their_month(self):
+        """ Keeps no rows in the parents and finds them through the parents."""
+
+        # Setup test
+        # Exercise test
+        receipt = self.create_receipt(self.old_month + timedelta(days=3))
+        line = receipt.lines.get()
+
+        # Assert test
+        self.assertEqual(self.partition_ids('pos_receipt', self.old_month), [receipt.id])
+        self.assertEqual(self.partition_ids('pos_receiptline', self.old_month), [line.id])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT (SELECT COUNT(*) FROM ONLY pos_receipt) + (SELECT COUNT(*) FROM ONLY pos_receiptline)')
+            self.assertEqual(cursor.fetchone()[0], 0)
+        self.assertEqual(Receipt.objects.get(pk=receipt.pk).total_amount, 100)
+
+    def test_created_at_cannot_move_to_another_month(self):
+        """ Rejects an update of created_at out of the row's partition."""
+
+        # Setup test
+        receipt = self.create_receipt()
+
+        # Exercise test
+        # Assert test
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Receipt.objects.filter(pk=receipt.pk).update(created_at=self.old_month)
+
+    def test_sealed_month_is_skipped_by_id_lookups(self):
+        """ Reads only the sealed month holding the receipt, or none of them."""
+
+        # Setup test
+        old = self.create_receipt(self.old_month + timedelta(days=3))
+        current = self.create_receipt()
+        sealed = partitions.partition_name('pos_receipt', self.old_month)
+
+        # Exercise test
+        partitions.ensure()
+
+        # Assert test
+        self.assertIn(sealed, self.plan('SELECT * FROM pos_receipt WHERE id = {}'.format(old.id)))
+        self.assertNotIn(sealed, self.plan('SELECT * FROM pos_receipt WHERE id = {}'.format(current.id)))
+        self.assertNotIn(
+            partitions.partition_name('pos_receiptline', self.old_month),
+            self.plan('SELECT * FROM pos_receiptline WHERE receipt_id = {}'.format(current.id))
+        )
+        self.assertTrue(current.pay_receipt(100))
+
+    @override_settings(POS_ARCHIVE_SCHEMA='pos_archive_test')
+    def test_archive_detaches_old_months(self):
+        """ Moves months before the kept ones into the archive schema."""
+
+        # Setup test
+        old = self.create_receipt(self.old_month + timedelta(days=3))
+        current = self.create_receipt()
+
+        # Exercise test
+        call_command('archive_partitions', keep=2, stdout=StringIO())
+
+        # Assert test
+        self.assertFalse(Receipt.objects.filter(pk=old.pk).exists())
+        self.assertTrue(Receipt.objects.filter(pk=current.pk).exists())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM pos_archive_test.{}'.format(partitions.partition_name('pos_receipt', self.old_month)))
+            self.assertEqual(cursor.fetchall(), [(old.id,)])
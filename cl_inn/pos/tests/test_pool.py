@@ -0,0 +1,94 @@
+from django.test import SimpleTestCase
+from psycopg2 import extensions
+from pos.backends.pool import ConnectionPool, PoolTimeout
+
+
+class FakeCursor(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, sql):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, status=extensions.TRANSACTION_STATUS_IDLE, broken=False):
+        self.closed = 0
+        self.status = status
+        self.broken = broken
+        self.autocommit = True
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        if self.broken:
+            raise extensions.QueryCanceledError('server closed the connection')
+        return FakeCursor()
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTest(SimpleTestCase):
+
+    def test_released_connection_is_reused(self):
+        """ Hands the same connection out again instead of opening one."""
+
+        # Setup test
+        pool = ConnectionPool(max_size=2, timeout=0.01)
+        conn = pool.acquire(FakeConnection)
+        pool.release(conn)
+
+        # Exercise test
+        again = pool.acquire(FakeConnection)
+
+        # Assert test
+        self.assertIs(again, conn)
+        stats = pool.stats()
+        self.assertEqual((stats['created'], stats['reused'], stats['in_use']), (1, 1, 1))
+
+    def test_pool_is_bounded(self):
+        """ Times out once max_size connections are checked out."""
+
+        # Setup test
+        pool = ConnectionPool(max_size=2, timeout=0.01)
+        pool.acquire(FakeConnection)
+        pool.acquire(FakeConnection)
+
+        # Exercise test
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(FakeConnection)
+
+        # Assert test
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+    def test_unusable_connections_are_dropped(self):
+        """ Rolls back open transactions, closes broken and unhealthy ones."""
+
+        # Setup test
+        pool = ConnectionPool(max_size=3, timeout=0.01, check_interval=0)
+        in_transaction = pool.acquire(lambda: FakeConnection(extensions.TRANSACTION_STATUS_INERROR))
+        lost = pool.acquire(lambda: FakeConnection(extensions.TRANSACTION_STATUS_UNKNOWN))
+        broken = pool.acquire(lambda: FakeConnection(broken=True))
+
+        # Exercise test
+        pool.release(lost)
+        pool.release(in_transaction)
+        pool.release(broken)
+        fresh = pool.acquire(FakeConnection)
+
+        # Assert test
+        self.assertEqual(in_transaction.status, extensions.TRANSACTION_STATUS_IDLE)
+        self.assertIs(fresh, in_transaction)
+        self.assertTrue(lost.closed)
+        self.assertTrue(broken.closed)
+        self.assertEqual(pool.stats()['discarded'], 2)
@@ -0,0 +1,241 @@
+from django.urls import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APITestCase
+from django.contrib.auth import get_user_model
+from pos.models import *
+from pos.querywatch import QueryWatcher, RepeatedQueriesError
+from pos.tests.explain import ExplainMixin
+
+User = get_user_model()
+
+
+class QueryCountAPITest(ExplainMixin, APITestCase):
+    """ Every API endpoint runs the same number of queries for 1 or many rows,
+    none of them scanning whole receipt, line or product tables.
+    """
+
+    few, many = 1, 10
+
+    def setUp(self):
+        self.user = User.objects.create_user(username = 'ibrahemmmmm', email = 'test_@test.com', password = '000000555555ddd5f5f') 
+        self.shop = Shop.objects.create(name='Big Shop')
+        self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+
+    def create_receipt(self, items=0):
+        receipt = Receipt.objects.create(
+            name='new receipt',
+            shop=self.shop,
+            user=self.user
+        )
+        for i in range(items):
+            receipt.add_line(Product.objects.create(
+                name='item',
+                code='item'+str(receipt.id)+'x'+str(i),
+                price=300,
+                stock_amount=10
+            ))
+        return receipt
+
+    def count_queries(self, method, url, data=None):
+        extra = {'format': 'json'} if isinstance(data, list) else {}
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, **extra)
+        self.assertLess(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNoSeqScans(queries.captured_queries)
+        return len(queries)
+
+    def assertConstantQueries(self, method, build):
+        """ build(rows) prepares rows and returns (url, data) of the request."""
+        few_rows = self.count_queries(method, *build(self.few))
+        many_rows = self.count_queries(method, *build(self.many))
+        self.assertEqual(few_rows, many_rows)
+
+    def test_receipts_list_get(self):
+        def build(rows):
+            for i in range(rows):
+                self.create_receipt(items=1)
+            return reverse('api_receipts_list'), None
+        self.assertConstantQueries('get', build)
+
+    def test_receipts_list_post(self):
+        def build(rows):
+            for i in range(rows):
+                self.create_receipt()
+            return reverse('api_receipts_list'), {'name': 'receipt', 'user': self.user.id, 'shop': self.shop.id}
+        self.assertConstantQueries('post', build)
+
+    def test_receipts_bulk(self):
+        def build(rows):
+            data = [{
+                'client_id': str(rows)+'-'+str(i),
+                'name': 'offline receipt',
+                'shop': self.shop.id,
+                'items': [{'code': 'bulk'+str(rows)+'x'+str(i), 'name': 'item', 'price': 10}]
+            } for i in range(rows)]
+            return reverse('api_receipts_bulk'), data
+        self.assertConstantQueries('post', build)
+
+    def test_receipt_instance_get(self):
+        def build(rows):
+            receipt = self.create_receipt(items=rows)
+            return reverse('api_receipts_instance', kwargs={'receipt_id': receipt.id}), None
+        self.assertConstantQueries('get', build)
+
+    def test_receipt_instance_put(self):
+        def build(rows):
+            receipt = self.create_receipt(items=rows)
+            data = {'name': 'updated receipt', 'user': self.user.id, 'shop': self.shop.id}
+            return reverse('api_receipts_instance', kwargs={'receipt_id': receipt.id}), data
+        self.assertConstantQueries('put', build)
+
+    def test_receipt_instance_delete(self):
+        def build(rows):
+            receipt = self.create_receipt(items=rows)
+            return reverse('api_receipts_instance', kwargs={'receipt_id': receipt.id}), None
+        self.assertConstantQueries('delete', build)
+
+    def test_receipt_average(self):
+        def build(rows):
+            receipt = self.create_receipt(items=rows)
+            return reverse('api_receipt_average', kwargs={'receipt_id': receipt.id}), None
+        self.assertConstantQueries('get', build)
+
+    def test_pay_receipt(self):
+        def build(rows):
+            receipt = self.create_receipt(items=rows)
+            return reverse('api_pay_receipt', kwargs={'receipt_id': receipt.id}), {'money': 300*rows}
+        self.assertConstantQueries('post', build)
+
+    def test_pay_receipt_with_change(self):
+        def build(rows):
+            receipt = self.create_receipt(items=rows)
+            return reverse('api_pay_receipt_change', kwargs={'receipt_id': receipt.id}), {'money': 300*rows + 50}
+        self.assertConstantQueries('post', build)
+
+    def test_items_list_get(self):
+        def build(rows):
+            self.create_receipt(items=rows)
+            return reverse('api_items_list'), None
+        self.assertConstantQueries('get', build)
+
+    def test_items_list_post(self):
+        receipt = self.create_receipt()
+
+        def build(rows):
+            self.create_receipt(items=rows)
+            data = {'name': 'item', 'code': 'new'+str(rows), 'price': 10, 'receipt': receipt.id}
+            return reverse('api_items_list'), data
+        self.assertConstantQueries('post', build)
+
+    def test_items_list_post_product(self):
+        def build(rows):
+            self.create_receipt(items=rows)
+            return reverse('api_items_list'), {'name': 'item', 'code': 'new'+str(rows), 'price': 10}
+        self.assertConstantQueries('post', build)
+
+    def test_receipt_items_list_get(self):
+        def build(rows):
+            receipt = self.create_receipt(items=rows)
+            return reverse('api_receipt_items_list', kwargs={'receipt_id': receipt.id}), None
+        self.assertConstantQueries('get', build)
+
+    def test_item_instance_get(self):
+        def build(rows):
+            item = self.create_receipt(items=rows).lines.first().product
+            return reverse('api_item_instance', kwargs={'item_id': item.id}), None
+        self.assertConstantQueries('get', build)
+
+    def test_item_instance_put(self):
+        def build(rows):
+            item = self.create_receipt(items=rows).lines.first().product
+            data = {'name': 'updated item', 'code': item.code, 'price': 20}
+            return reverse('api_item_instance', kwargs={'item_id': item.id}), data
+        self.assertConstantQueries('put', build)
+
+    def test_item_instance_delete(self):
+        def build(rows):
+            receipt = self.create_receipt(items=rows)
+            item = Product.objects.create(name='item', code='unsold'+str(receipt.id), price=300)
+            return reverse('api_item_instance', kwargs={'item_id': item.id}), None
+        self.assertConstantQueries('delete', build)
+
+    def test_set_stock(self):
+        def build(rows):
+            item = self.create_receipt(items=rows).lines.first().product
+            return reverse('api_set_item_stock', kwargs={'item_id': item.id}), {'amount': 5}
+        self.assertConstantQueries('post', build)
+
+    def test_items_bulk_update(self):
+        def build(rows):
+            lines = self.create_receipt(items=rows).lines.all()
+            return reverse('api_items_bulk_update'), [{'id': line.product_id, 'stock_delta': -1} for line in lines]
+        self.assertConstantQueries('post', build)
+
+    def test_low_stock(self):
+        def build(rows):
+            self.create_receipt(items=rows)
+            return reverse('api_get_low_stock_items'), None
+        self.assertConstantQueries('get', build)
+
+    def test_search_items(self):
+        def build(rows):
+            self.create_receipt(items=rows)
+            return reverse('api_search_items'), {'q': 'item'}
+        self.assertConstantQueries('get', build)
+
+    def test_shop_daily_sales(self):
+        def build(rows):
+            for i in range(rows):
+                self.create_receipt(items=1).pay_receipt(300)
+            ShopDailySales.refresh()
+            return reverse('api_shop_daily_sales', kwargs={'shop_id': self.shop.id}), None
+        self.assertConstantQueries('get', build)
+
+    def test_most_sold(self):
+        def build(rows):
+            self.create_receipt(items=rows)
+            return reverse('api_get_most_sold_item'), None
+        self.assertConstantQueries('get', build)
+
+
+class QueryWatcherTest(TestCase):
+
+    def setUp(self):
+        self.shop = Shop.objects.create(name='Big Shop')
+        for i in range(3):
+            user = User.objects.create_user(username = 'user' + str(i), email = 'test_@test.com', password = '000000555555ddd5f5f')
+            Receipt.objects.create(name='new receipt', shop=self.shop, user=user)
+
+    def test_per_row_lookup_is_reported_with_call_site(self):
+        """ Flags the user fetched by Receipt.__str__ for each receipt."""
+
+        # Exercise test
+        with QueryWatcher() as watcher:
+            names = [str(receipt) for receipt in Receipt.objects.all()]
+
+        # Assert test
+        self.assertEqual(len(names), 3)
+        repeated = watcher.repeated()
+        self.assertEqual(len(repeated), 1)
+        sql, count, distinct, sites = repeated[0]
+        self.assertIn('users_user', sql)
+        self.assertEqual((count, distinct), (3, 3))
+        site, = sites
+        self.assertRegex(site, r'^pos/models.py:\d+ in __str__$')
+        with self.assertRaises(RepeatedQueriesError):
+            watcher.check('raise')
+
+    def test_joined_lookup_passes(self):
+        """ Reports nothing once the users are selected with the receipts."""
+
+        # Exercise test
+        with QueryWatcher() as watcher:
+            names = [str(receipt) for receipt in Receipt.objects.select_related('user')]
+
+        # Assert test
+        self.assertEqual(len(names), 3)
+        self.assertEqual(watcher.repeated(), [])
+        watcher.check('raise')
@@ -0,0 +1,126 @@
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from django.contrib.auth import get_user_model
+from pos import cache, conditional, routers
+from pos.models import *
+
+User = get_user_model()
+
+
+@override_settings(POS_REPLICAS=['replica1', 'replica2'], POS_REPLICA_MAX_LAG=2)
+class ReplicaRouterTest(TestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        routers.lags.clear()
+        self.user = User.objects.create_user(username = 'ibrahemmmmm', email = 'test_@test.com', password = '000000555555ddd5f5f')
+        self.router = routers.ReplicaRouter()
+
+    def test_reads_in_block_go_to_replica(self):
+        """ Routes reads to a replica and writes to default."""
+
+        # Setup test
+        lags = {'replica1': 0.5, 'replica2': 0}
+
+        # Exercise test
+        with mock.patch.object(routers, 'replica_lag', side_effect=lags.get):
+            with routers.replica_reads(self.user):
+                read = self.router.db_for_read(Receipt)
+                write = self.router.db_for_write(Receipt)
+        after = self.router.db_for_read(Receipt)
+
+        # Assert test
+        self.assertIn(read, lags)
+        self.assertEqual(write, 'default')
+        self.assertEqual(after, 'default')
+
+    def test_lagging_replica_is_skipped(self):
+        """ Uses only replicas within POS_REPLICA_MAX_LAG, else default."""
+
+        # Setup test
+        lags = {'replica1': 30, 'replica2': 1}
+
+        # Exercise test
+        with mock.patch.object(routers, 'replica_lag', side_effect=lags.get):
+            healthy = routers.healthy_replicas()
+            lags['replica2'] = None
+            with routers.replica_reads(self.user):
+                read = self.router.db_for_read(Receipt)
+
+        # Assert test
+        self.assertEqual(healthy, ['replica2'])
+        self.assertEqual(read, 'default')
+
+    def test_pinned_user_reads_from_default(self):
+        """ Keeps a user who just wrote on the primary."""
+
+        # Setup test
+        routers.pin_to_primary(self.user)
+
+        # Exercise test
+        with mock.patch.object(routers, 'replica_lag', return_value=0):
+            with routers.replica_reads(self.user):
+                read = self.router.db_for_read(Receipt)
+
+        # Assert test
+        self.assertEqual(read, 'default')
+
+
+@override_settings(POS_REPLICAS=['replica1'])
+class ReplicaPinAPITest(APITestCase):
+
+    def setUp(self):
+        cache.get_cache().clear()
+        routers.lags.clear()
+        self.user = User.objects.create_user(username = 'ibrahemmmmm', email = 'test_@test.com', password = '000000555555ddd5f5f')
+        self.shop = Shop.objects.create(name='Big Shop')
+        self.client.login(username="ibrahemmmmm", password="000000555555ddd5f5f")
+
+    def test_missing_replica_alias_is_unhealthy(self):
+        """ Skips a replica missing from DATABASES instead of failing reads."""
+
+        # Exercise test
+        healthy = routers.healthy_replicas()
+        request = self.client.get(reverse('api_items_list'))
+
+        # Assert test
+        self.assertEqual(healthy, [])
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+
+    def test_write_pins_user_to_primary(self):
+        """ Pins the user after a successful POST, not after a GET."""
+
+        # Setup test
+        url = reverse('api_receipts_list')
+
+        # Exercise test
+        with mock.patch.object(routers, 'healthy_replicas', return_value=[]):
+            read = self.client.get(url)
+        pinned_after_read = routers.is_pinned(self.user)
+        write = self.client.post(url, {'name': 'new receipt', 'shop': self.shop.pk, 'user': self.user.pk})
+
+        # Assert test
+        self.assertEqual(read.status_code, status.HTTP_200_OK)
+        self.assertEqual(write.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(pinned_after_read)
+        self.assertTrue(routers.is_pinned(self.user))
+
+    def test_replica_read_sends_no_validators(self):
+        """ Leaves validators out of a listing read from a replica."""
+
+        # Setup test
+        url = reverse('api_items_list')
+
+        # Exercise test
+        with mock.patch.object(routers, 'healthy_replicas', return_value=[]):
+            with mock.patch.object(conditional, 'reading_replica', return_value=True):
+                replica = self.client.get(url)
+            primary = self.client.get(url)
+
+        # Assert test
+        self.assertEqual(replica.status_code, status.HTTP_200_OK)
+        self.assertFalse(replica.has_header('ETag'))
+        self.assertTrue(primary.has_header('ETag'))
@@ -0,0 +1,45 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.renderers import JSONRenderer
+from pos.models import Shop, Receipt, Product, ReceiptLine
+from pos.serializers import ShopSerializer, ReceiptSerializer, ProductSerializer, ReceiptLineSerializer, ValuesSerializer
+
+User = get_user_model()
+
+
+class ValuesSerializerTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='Ibrahem', email='test_@test.com', password='010d1d5ss57cxs1x0d')
+        self.shop = Shop.objects.create(name='Big Shop')
+        Shop.objects.create(name='Closed Shop', is_active=False)
+        for i in range(2):
+            receipt = Receipt.objects.create(name='receipt', shop=self.shop, user=self.user, cashier=i)
+            receipt.add_line(Product.objects.create(name='item', code='item'+str(i), price=100.5, discount=0.25, stock_amount=2), 2)
+        receipt.pay_receipt(150.75, True)
+
+    def assertSameJSON(self, serializer_class, queryset):
+        """ Renders queryset through both paths and compares the bytes."""
+        fast = ValuesSerializer(serializer_class)
+        renderer = JSONRenderer()
+
+        expected = renderer.render(serializer_class(queryset, many=True).data)
+        actual = renderer.render(fast.represent(fast.values(queryset)))
+
+        self.assertEqual(actual, expected)
+
+    def test_shop_conformance(self):
+        """ Renders shops identically."""
+        self.assertSameJSON(ShopSerializer, Shop.objects.order_by('id'))
+
+    def test_receipt_conformance(self):
+        """ Renders receipts with nested shop and user identically."""
+        self.assertSameJSON(ReceiptSerializer, Receipt.objects.order_by('id'))
+
+    def test_product_conformance(self):
+        """ Renders catalog products identically."""
+        self.assertSameJSON(ProductSerializer, Product.objects.order_by('id'))
+
+    def test_receipt_line_conformance(self):
+        """ Renders lines with dotted product fields identically."""
+        self.assertSameJSON(ReceiptLineSerializer, ReceiptLine.objects.order_by('id'))
@@ -0,0 +1,31 @@
+import os
+import sys
+
+from celery import Celery
+from django.apps import apps, AppConfig
+from django.conf import settings
+
+# This allows easy placement of apps within the interior
+# cl_inn directory, as in config/wsgi.py.
+app_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if app_path not in sys.path:
+    sys.path.append(app_path)
+
+if not settings.configured:
+    # set the default Django settings module for the 'celery' program.
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.local')  # pragma: no cover
+
+
+app = Celery('cl_inn')
+
+
+class CeleryConfig(AppConfig):
+    name = 'cl_inn.taskapp'
+    verbose_name = 'Celery Config'
+
+    def ready(self):
+        # Using a string here means the worker will not have to
+        # pickle the object when using Windows.
+        app.config_from_object('django.conf:settings', namespace='CELERY')
+        installed_apps = [app_config.name for app_config in apps.get_app_configs()]
+        app.autodiscover_tasks(lambda: installed_apps, force=True)
@@ -2,6 +2,9 @@ from django.core.urlresolvers import reverse
 from django.views.generic import DetailView, ListView, RedirectView, UpdateView
 
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.utils.decorators import method_decorator
+
+from pos.routers import read_replica
 
 from .models import User
 
@@ -37,8 +40,14 @@ class UserUpdateView(LoginRequiredMixin, UpdateView):
 		return User.objects.get(username=self.request.user.username)
 
 
+@method_decorator(read_replica, name='dispatch')
 class UserListView(LoginRequiredMixin, ListView):
 	model = User
 	# These next two lines tell the view to index lookups by username
 	slug_field = 'username'
-	slug_url_kwarg = 'username'
\ No newline at end of file
+	slug_url_kwarg = 'username'
+
+	def get_queryset(self):
+		# Rows are read while the template renders, after dispatch returns.
+		queryset = super().get_queryset()
+		return queryset.using(queryset.db)
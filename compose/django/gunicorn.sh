@@ -1,3 +1,5 @@
 #!/bin/sh
 python /app/manage.py collectstatic --noinput
-/usr/local/bin/gunicorn config.wsgi -w 4 -b 0.0.0.0:5000 --chdir=/app
\ No newline at end of file
+# GUNICORN_WORKER_CLASS=gevent serves many terminals per worker; pair it with
+# POS_DB_POOL=True so psycopg2 yields and connections are pooled.
+/usr/local/bin/gunicorn config.wsgi -w ${GUNICORN_WORKERS:-4} -k ${GUNICORN_WORKER_CLASS:-sync} --worker-connections ${GUNICORN_WORKER_CONNECTIONS:-1000} -b 0.0.0.0:5000 --chdir=/app
@@ -37,6 +37,7 @@ DJANGO_APPS = [
     'django.contrib.sites',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     # Useful template tags:
     # 'django.contrib.humanize',
@@ -56,7 +57,8 @@ THIRD_PARTY_APPS = [
 LOCAL_APPS = [
     # custom users app
     'cl_inn.users.apps.UsersConfig',
-    'pos',
+    'pos.apps.PosConfig',
+    'cl_inn.taskapp.celery.CeleryConfig',
 ]
 
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#installed-apps
@@ -65,11 +67,14 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 # MIDDLEWARE CONFIGURATION
 # ------------------------------------------------------------------------------
 MIDDLEWARE = [
+    'pos.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'pos.middleware.ReplicaPinMiddleware',
+    'pos.middleware.QueryWatchMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -114,6 +119,18 @@ DATABASES = {
 }
 DATABASES['default']['ATOMIC_REQUESTS'] = True
 
+# Read replicas, given as database URLs and named replica1, replica2...
+# Safe requests of views decorated with pos.routers.read_replica read from
+# them. Locally any second database works, e.g.
+# DATABASE_REPLICA_URLS=postgres:///cl_inn_replica
+POS_REPLICAS = []
+for number, url in enumerate(env.list('DATABASE_REPLICA_URLS', default=[]), 1):
+    alias = 'replica{}'.format(number)
+    DATABASES[alias] = env.db_url_config(url)
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    POS_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['pos.routers.ReplicaRouter']
+
 
 # GENERAL CONFIGURATION
 # ------------------------------------------------------------------------------
@@ -270,5 +287,78 @@ AUTOSLUG_SLUGIFY_FUNCTION = 'slugify.slugify'
 # Location of root django.contrib.admin URL, use {% url 'admin:index' %}
 ADMIN_URL = r'^admin/'
 
+# CELERY
+# ------------------------------------------------------------------------------
+# See: http://docs.celeryproject.org/en/latest/userguide/configuration.html
+CELERY_BROKER_URL = env('CELERY_BROKER_URL', default='redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = None
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_BEAT_SCHEDULE = {
+    'refresh-shop-daily-sales': {
+        'task': 'pos.tasks.refresh_shop_daily_sales',
+        'schedule': env.int('POS_ROLLUP_INTERVAL', default=15 * 60),
+    },
+    'refresh-best-sellers': {
+        'task': 'pos.tasks.refresh_best_sellers',
+        'schedule': env.int('POS_BEST_SELLERS_INTERVAL', default=5 * 60),
+    },
+    'create-receipt-partitions': {
+        'task': 'pos.tasks.create_receipt_partitions',
+        'schedule': env.int('POS_PARTITIONS_INTERVAL', default=24 * 60 * 60),
+    },
+}
+
 # Your common stuff: Below this line define 3rd party library settings
 # ------------------------------------------------------------------------------
+
+# POS API
+# ------------------------------------------------------------------------------
+# Default and maximum number of rows returned by paginated list endpoints.
+POS_PAGE_SIZE = env.int('POS_PAGE_SIZE', default=100)
+POS_MAX_PAGE_SIZE = env.int('POS_MAX_PAGE_SIZE', default=1000)
+# Rows fetched and written per chunk by streaming (NDJSON) list responses.
+POS_STREAM_CHUNK_SIZE = env.int('POS_STREAM_CHUNK_SIZE', default=2000)
+# Largest number of receipts accepted by one bulk upload.
+POS_BULK_MAX_RECORDS = env.int('POS_BULK_MAX_RECORDS', default=1000)
+# Largest number of item changes accepted by one bulk update, and how many
+# of them are locked and written per UPDATE statement.
+POS_BULK_MAX_ITEM_CHANGES = env.int('POS_BULK_MAX_ITEM_CHANGES', default=50000)
+POS_BULK_UPDATE_CHUNK_SIZE = env.int('POS_BULK_UPDATE_CHUNK_SIZE', default=1000)
+# Number of items kept in each best sellers leaderboard.
+POS_BEST_SELLERS_SIZE = env.int('POS_BEST_SELLERS_SIZE', default=10)
+# Cache alias and timeout (seconds) of cached receipt and item payloads.
+POS_CACHE_ALIAS = env('POS_CACHE_ALIAS', default='default')
+POS_CACHE_TIMEOUT = env.int('POS_CACHE_TIMEOUT', default=60 * 60 * 24)
+# Idempotency-Key handling: how long responses are kept for replay, how long
+# a first request may hold its key, and how often duplicates poll meanwhile.
+POS_IDEMPOTENCY_TTL = env.int('POS_IDEMPOTENCY_TTL', default=60 * 60 * 24)
+POS_IDEMPOTENCY_LOCK_TIMEOUT = env.int('POS_IDEMPOTENCY_LOCK_TIMEOUT', default=30)
+POS_IDEMPOTENCY_POLL_INTERVAL = env.float('POS_IDEMPOTENCY_POLL_INTERVAL', default=0.05)
+# Replica reads: how long a user reads from the primary after writing, the
+# largest replication lag (seconds) tolerated, and how often lag is measured.
+POS_REPLICA_PIN_SECONDS = env.int('POS_REPLICA_PIN_SECONDS', default=10)
+POS_REPLICA_MAX_LAG = env.float('POS_REPLICA_MAX_LAG', default=2)
+POS_REPLICA_LAG_CHECK_INTERVAL = env.int('POS_REPLICA_LAG_CHECK_INTERVAL', default=5)
+# Share of API requests timed into Server-Timing headers and the metrics
+# endpoint, and how often (seconds) each worker publishes its histograms.
+POS_METRICS_SAMPLE_RATE = env.float('POS_METRICS_SAMPLE_RATE', default=0.1)
+POS_METRICS_FLUSH_INTERVAL = env.int('POS_METRICS_FLUSH_INTERVAL', default=10)
+# Who may scrape the metrics endpoint besides admin users: clients sending
+# this bearer token, and clients connecting from these addresses or CIDR
+# ranges. Empty turns the check off.
+POS_METRICS_TOKEN = env('POS_METRICS_TOKEN', default='')
+POS_METRICS_ALLOWED_IPS = env.list('POS_METRICS_ALLOWED_IPS', default=[])
+# Repeated query detection (see pos.querywatch): '' for off, 'log' or
+# 'raise', and how many runs of the same SQL make a query repeated.
+POS_QUERY_WATCH = env('POS_QUERY_WATCH', default='')
+POS_QUERY_WATCH_THRESHOLD = env.int('POS_QUERY_WATCH_THRESHOLD', default=3)
+# Default and largest number of items returned by item search.
+POS_SEARCH_LIMIT = env.int('POS_SEARCH_LIMIT', default=20)
+POS_SEARCH_MAX_LIMIT = env.int('POS_SEARCH_MAX_LIMIT', default=100)
+# Receipt partitions (see pos.partitions): months created ahead of time, how
+# many months archive_partitions keeps online, and the schema it detaches
+# older months into.
+POS_PARTITIONS_AHEAD = env.int('POS_PARTITIONS_AHEAD', default=3)
+POS_PARTITIONS_KEEP = env.int('POS_PARTITIONS_KEEP', default=24)
+POS_ARCHIVE_SCHEMA = env('POS_ARCHIVE_SCHEMA', default='pos_archive')
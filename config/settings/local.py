@@ -73,3 +73,5 @@ TEST_RUNNER = 'django.test.runner.DiscoverRunner'
 
 # Your local stuff: Below this line define 3rd party library settings
 # ------------------------------------------------------------------------------
+# Warn about N+1 and duplicate queries of each request
+POS_QUERY_WATCH = env('POS_QUERY_WATCH', default='log')
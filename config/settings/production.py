@@ -140,6 +140,21 @@ TEMPLATES[0]['OPTIONS']['loaders'] = [
 # Raises ImproperlyConfigured exception if DATABASE_URL not in os.environ
 DATABASES['default'] = env.db('DATABASE_URL')
 
+# Sync workers keep their connection open across requests for CONN_MAX_AGE
+# seconds. Gevent workers serve many requests at once from one process, so
+# they share a bounded pool of connections instead (see
+# pos.backends.postgresql_pool), which also makes psycopg2 cooperative.
+if env.bool('POS_DB_POOL', default=False):
+    DATABASES['default']['ENGINE'] = 'pos.backends.postgresql_pool'
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default'].setdefault('OPTIONS', {}).update({
+        'MAX_CONNS': env.int('POS_DB_POOL_SIZE', default=20),
+        'POOL_TIMEOUT': env.int('POS_DB_POOL_TIMEOUT', default=10),
+        'HEALTH_CHECK_INTERVAL': env.int('POS_DB_POOL_HEALTH_CHECK_INTERVAL', default=30),
+    })
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = env.int('CONN_MAX_AGE', default=60)
+
 # CACHING
 # ------------------------------------------------------------------------------
 
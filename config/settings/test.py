@@ -42,6 +42,15 @@ CACHES = {
 # ------------------------------------------------------------------------------
 TEST_RUNNER = 'django.test.runner.DiscoverRunner'
 
+# Run celery tasks in process
+CELERY_TASK_ALWAYS_EAGER = True
+
+# Time every API request
+POS_METRICS_SAMPLE_RATE = 1.0
+
+# Fail requests running N+1 or duplicate queries
+POS_QUERY_WATCH = 'raise'
+
 
 # PASSWORD HASHING
 # ------------------------------------------------------------------------------